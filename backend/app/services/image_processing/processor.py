@@ -1,9 +1,7 @@
-import cv2
-import numpy as np
-from PIL import Image
-from sklearn.cluster import KMeans
 import os
 
+from services.pipeline import get_pipeline
+
 # This would be expanded with actual block data
 # Format: (Block name, (R, G, B))
 MINECRAFT_BLOCKS = [
@@ -50,70 +48,16 @@ MINECRAFT_BLOCKS = [
 ]
 
 # Directory with block textures (would need to be populated)
-BLOCK_TEXTURES_DIR = "app/services/image_processing/block_textures"
+BLOCK_TEXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "block_textures")
 
-def find_closest_block_color(pixel_rgb):
-    """Find the Minecraft block with the closest RGB color match to a pixel."""
-    min_distance = float('inf')
-    closest_block = None
-    
-    for block_name, block_rgb in MINECRAFT_BLOCKS:
-        # Calculate Euclidean distance between colors
-        distance = sum((p - b) ** 2 for p, b in zip(pixel_rgb, block_rgb)) ** 0.5
-        if distance < min_distance:
-            min_distance = distance
-            closest_block = (block_name, block_rgb)
-    
-    return closest_block
+# Optional .npy file to persist the texture atlas so it can be memory-mapped
+BLOCK_ATLAS_PATH = os.environ.get("BLOCK_ATLAS_PATH")
 
 def process_image_to_minecraft_blocks(input_path, output_path, grid_size=64):
-    """Process an image to convert it to Minecraft blocks."""
-    # Read the image
-    image = cv2.imread(input_path)
-    
-    # Convert from BGR to RGB (OpenCV uses BGR)
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # Resize to the target grid size
-    height, width = image.shape[:2]
-    aspect_ratio = width / height
-    
-    if width > height:
-        new_width = grid_size
-        new_height = int(grid_size / aspect_ratio)
-    else:
-        new_height = grid_size
-        new_width = int(grid_size * aspect_ratio)
-    
-    resized_image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
-    
-    # Create a blank canvas for the output image
-    # Each block will be represented as 16x16 pixels in the output
-    output_image = np.zeros((new_height*16, new_width*16, 3), dtype=np.uint8)
-    
-    # Process each pixel and map it to a Minecraft block
-    for y in range(new_height):
-        for x in range(new_width):
-            pixel_rgb = resized_image[y, x]
-            
-            # Find the closest Minecraft block color
-            block_name, block_rgb = find_closest_block_color(pixel_rgb)
-            
-            # For now, use a solid color for the block
-            # In a more advanced version, we'd load the block texture
-            block_color = np.array(block_rgb, dtype=np.uint8)
-            
-            # Place the block in the output image
-            output_image[y*16:(y+1)*16, x*16:(x+1)*16] = block_color
-    
-    # Save the processed image
-    output_image_pil = Image.fromarray(output_image)
-    output_image_pil.save(output_path)
-    
-    return output_path
+    """Process an image to convert it to Minecraft blocks (the "textured" pipeline)."""
+    return get_pipeline("textured").run(input_path, grid_size=grid_size, output_path=output_path)
 
 # In a more advanced implementation, we would:
-# 1. Load actual block textures instead of using solid colors
-# 2. Use a more sophisticated color matching algorithm
-# 3. Implement options to export as .schematic files
-# 4. Add more block types for better color matching
+# 1. Use a more sophisticated color matching algorithm
+# 2. Implement options to export as .schematic files
+# 3. Add more block types for better color matching
@@ -0,0 +1,195 @@
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from services.shared_arrays import data_fingerprint, shared_path, save_atomic
+
+# Size of a single block texture in pixels (vanilla Minecraft resolution)
+TEXTURE_SIZE = 16
+
+# Cache of built atlases keyed by (textures_dir, block names)
+_atlas_cache = {}
+# Lock so concurrent first requests build each atlas only once
+_atlas_lock = threading.Lock()
+
+
+def texture_filename(block_name: str) -> str:
+    """Map a block name ("Oak Planks" or "oak_planks") to its texture file name"""
+    return block_name.strip().lower().replace(" ", "_") + ".png"
+
+
+def _load_texture(path: str) -> Optional[np.ndarray]:
+    """Load a texture file as a (16, 16, 3) uint8 array, or None if unavailable"""
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with Image.open(path) as texture:
+            texture = texture.convert("RGBA")
+            if texture.size != (TEXTURE_SIZE, TEXTURE_SIZE):
+                texture = texture.resize((TEXTURE_SIZE, TEXTURE_SIZE), Image.NEAREST)
+            rgba = np.asarray(texture, dtype=np.float32)
+    except Exception as e:
+        print(f"Failed to load texture {path}: {e}")
+        return None
+
+    # Composite transparent texels (glass, leaves) over black like the game does
+    alpha = rgba[:, :, 3:4] / 255.0
+    return (rgba[:, :, :3] * alpha).round().astype(np.uint8)
+
+
+def _fallback_texture(color: Sequence[int], seed: int) -> np.ndarray:
+    """
+    Build a stand-in texture for blocks without a texture file
+
+    The tile is the block's average colour with a small deterministic
+    brightness noise so adjacent blocks of the same type stay distinguishable.
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(-6, 7, size=(TEXTURE_SIZE, TEXTURE_SIZE, 1))
+    tile = np.asarray(color, dtype=np.int16)[np.newaxis, np.newaxis, :] + noise
+    return np.clip(tile, 0, 255).astype(np.uint8)
+
+
+def build_texture_atlas(
+    blocks: Sequence[Tuple[str, Sequence[int]]],
+    textures_dir: str,
+    cache_path: Optional[str] = None
+) -> np.ndarray:
+    """
+    Build an (N, 16, 16, 3) texture atlas for a block palette
+
+    Args:
+        blocks: Sequence of (block_name, rgb) in palette index order
+        textures_dir: Directory containing <block_name>.png textures
+        cache_path: Optional .npy file to save the atlas to (or load it from);
+            a saved atlas is only reused if it was built from the same
+            palette and texture files
+
+    Returns:
+        uint8 array where atlas[i] is the texture of palette entry i
+    """
+    fingerprint = atlas_fingerprint(blocks, textures_dir)
+    if cache_path and os.path.isfile(cache_path) and _saved_fingerprint(cache_path) == fingerprint:
+        # Memory-map the saved atlas so it is shared through the page cache
+        atlas = np.load(cache_path, mmap_mode="r")
+        if atlas.shape == (len(blocks), TEXTURE_SIZE, TEXTURE_SIZE, 3):
+            return atlas
+
+    atlas = np.empty((len(blocks), TEXTURE_SIZE, TEXTURE_SIZE, 3), dtype=np.uint8)
+    missing = []
+
+    for index, (block_name, block_color) in enumerate(blocks):
+        texture = _load_texture(os.path.join(textures_dir, texture_filename(block_name)))
+        if texture is None:
+            missing.append(block_name)
+            texture = _fallback_texture(block_color, seed=index)
+        atlas[index] = texture
+
+    if missing:
+        print(f"No texture found for {len(missing)} of {len(blocks)} blocks in {textures_dir}, using colour tiles")
+
+    if cache_path:
+        try:
+            save_atomic(cache_path, atlas)
+            _save_fingerprint(cache_path, fingerprint)
+        except OSError as e:
+            print(f"Failed to save texture atlas to {cache_path}: {e}")
+
+    return atlas
+
+
+def _fingerprint_path(cache_path: str) -> str:
+    return cache_path + ".fingerprint"
+
+
+def _saved_fingerprint(cache_path: str) -> Optional[str]:
+    """Fingerprint of the palette a saved atlas was built from, or None if unknown"""
+    try:
+        with open(_fingerprint_path(cache_path)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _save_fingerprint(cache_path: str, fingerprint: str) -> None:
+    # Written after the atlas, so a reader seeing it also sees the matching atlas
+    temp_path = f"{_fingerprint_path(cache_path)}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(fingerprint)
+    os.replace(temp_path, _fingerprint_path(cache_path))
+
+
+def atlas_fingerprint(blocks: Sequence[Tuple[str, Sequence[int]]], textures_dir: str) -> str:
+    """Version of an atlas: the palette plus the size and age of every texture file"""
+    files = []
+    for block_name, _ in blocks:
+        try:
+            stat = os.stat(os.path.join(textures_dir, texture_filename(block_name)))
+            files.append([stat.st_size, int(stat.st_mtime)])
+        except OSError:
+            files.append(None)
+    return data_fingerprint([[name, list(color)] for name, color in blocks], files, TEXTURE_SIZE)
+
+
+def get_texture_atlas(
+    blocks: Sequence[Tuple[str, Sequence[int]]],
+    textures_dir: str,
+    cache_path: Optional[str] = None
+) -> np.ndarray:
+    """
+    Return the texture atlas for a palette, building it on first use
+
+    Args:
+        blocks: Sequence of (block_name, rgb) in palette index order
+        textures_dir: Directory containing <block_name>.png textures
+        cache_path: .npy file used to persist the atlas; by default a
+            versioned file in the shared data directory, so worker processes
+            map one copy instead of each building their own
+
+    Returns:
+        Cached (N, 16, 16, 3) uint8 atlas
+    """
+    key = (os.path.abspath(textures_dir), tuple(name for name, _ in blocks))
+
+    atlas = _atlas_cache.get(key)
+    if atlas is not None:
+        return atlas
+
+    with _atlas_lock:
+        if key not in _atlas_cache:
+            if cache_path is None:
+                cache_path = shared_path("atlas", atlas_fingerprint(blocks, textures_dir))
+            _atlas_cache[key] = build_texture_atlas(blocks, textures_dir, cache_path)
+        return _atlas_cache[key]
+
+
+def render_textured_preview(index_grid: np.ndarray, atlas: np.ndarray) -> np.ndarray:
+    """
+    Render a textured preview from a grid of palette indices
+
+    A single fancy-index gather pulls every block's texture out of the atlas,
+    so the cost is proportional to the number of output pixels.
+
+    Args:
+        index_grid: (H, W) integer array of palette indices (or a BlockGrid)
+        atlas: (N, T, T, 3) texture atlas
+
+    Returns:
+        (H * T, W * T, 3) uint8 image
+    """
+    index_grid = np.asarray(index_grid)
+    height, width = index_grid.shape
+    tile = atlas.shape[1]
+
+    # (H, W, T, T, 3) -> (H, T, W, T, 3) -> (H * T, W * T, 3)
+    tiles = atlas[index_grid]
+    return tiles.transpose(0, 2, 1, 3, 4).reshape(height * tile, width * tile, 3)
+
+
+def palette_from_blocks(blocks: List[dict]) -> List[Tuple[str, List[int]]]:
+    """Convert a block database list ({"name", "color"} dicts) into atlas palette entries"""
+    return [(block["name"], block["color"]) for block in blocks]
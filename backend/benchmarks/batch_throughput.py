@@ -0,0 +1,86 @@
+"""
+Compare batch throughput against one request per image
+
+Runs in-process against main_optimized:app over ASGI, so no server is needed:
+
+    python benchmarks/batch_throughput.py --images 50 --grid-size 100
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from main_optimized import app
+
+def make_images(count: int, size: int, seed: int):
+    """Generate distinct test images so the result cache never short-circuits a run"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        # Smooth gradients plus noise look more like photos than pure noise
+        y, x = np.mgrid[0:size, 0:size]
+        base = np.stack([x * 255 // size, y * 255 // size, (x + y) * 127 // size], axis=2)
+        noise = rng.integers(-30, 31, size=base.shape)
+        pixels = np.clip(base + noise + rng.integers(0, 80), 0, 255).astype(np.uint8)
+        buffered = io.BytesIO()
+        Image.fromarray(pixels).save(buffered, format="PNG")
+        images.append((f"image_{i}.png", buffered.getvalue()))
+    return images
+
+def run_single(client: TestClient, images, grid_size: int) -> float:
+    start_time = time.perf_counter()
+    for name, data in images:
+        response = client.post(
+            "/process-image",
+            files={"image": (name, data, "image/png")},
+            headers={"X-Grid-Size": str(grid_size), "X-Preview-Mode": "url"}
+        )
+        response.raise_for_status()
+    return time.perf_counter() - start_time
+
+def run_batch(client: TestClient, images, grid_size: int) -> float:
+    start_time = time.perf_counter()
+    response = client.post(
+        "/batch",
+        files=[("images", (name, data, "image/png")) for name, data in images],
+        data={"params": json.dumps({"*": {"gridSize": grid_size}})}
+    )
+    response.raise_for_status()
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    failed = lines[-1]["summary"]["failed"]
+    if failed:
+        raise RuntimeError(f"{failed} batch items failed")
+    return time.perf_counter() - start_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=30, help="number of images per run")
+    parser.add_argument("--size", type=int, default=400, help="source image edge length in pixels")
+    parser.add_argument("--grid-size", type=int, default=100, help="grid size in blocks")
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    seed = int(time.time())
+    single_images = make_images(args.images, args.size, seed)
+    batch_images = make_images(args.images, args.size, seed + 1)
+
+    single_time = run_single(client, single_images, args.grid_size)
+    batch_time = run_batch(client, batch_images, args.grid_size)
+
+    print(f"{'mode':<10}{'seconds':>10}{'images/s':>12}")
+    print(f"{'single':<10}{single_time:>10.2f}{args.images / single_time:>12.2f}")
+    print(f"{'batch':<10}{batch_time:>10.2f}{args.images / batch_time:>12.2f}")
+    print(f"speedup: {single_time / batch_time:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Fixed, deterministic benchmark corpus
+
+Images are generated from a fixed seed rather than checked in, so every
+machine benchmarks exactly the same pixels.
+"""
+import os
+from typing import Dict
+
+import numpy as np
+from PIL import Image
+
+CORPUS_SEED = 1234
+
+def _smooth_noise(rng: np.random.Generator, width: int, height: int, cells: int) -> np.ndarray:
+    """Photo-like colour field: coarse random colours upsampled smoothly, plus grain"""
+    coarse = rng.integers(0, 256, size=(cells, cells * width // height, 3), dtype=np.uint8)
+    field = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BICUBIC), dtype=np.int16)
+    grain = rng.integers(-12, 13, size=field.shape)
+    return np.clip(field + grain, 0, 255).astype(np.uint8)
+
+def _photo(rng, width, height) -> Image.Image:
+    return Image.fromarray(_smooth_noise(rng, width, height, 12))
+
+def _pixel_art(rng) -> Image.Image:
+    # 32x32 sprite with a 12 colour palette, upscaled 8x with hard edges
+    colors = rng.integers(0, 256, size=(12, 3), dtype=np.uint8)
+    sprite = colors[rng.integers(0, len(colors), size=(8, 8))]
+    sprite = np.kron(sprite, np.ones((4, 4, 1), dtype=np.uint8))
+    return Image.fromarray(sprite).resize((256, 256), Image.NEAREST)
+
+def _gradient() -> Image.Image:
+    width, height = 1024, 512
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, 255 - x * 255 // width], axis=2)
+    return Image.fromarray(pixels.astype(np.uint8))
+
+def _transparent(rng) -> Image.Image:
+    size = 800
+    y, x = np.mgrid[0:size, 0:size]
+    radius = np.hypot(x - size / 2, y - size / 2) / (size / 2)
+    alpha = np.clip((1.0 - radius) * 2 * 255, 0, 255).astype(np.uint8)
+    rgba = np.dstack([_smooth_noise(rng, size, size, 6), alpha])
+    return Image.fromarray(rgba, "RGBA")
+
+# Corpus entries: file name -> (builder, save options)
+CORPUS = {
+    "photo.jpg": (lambda rng: _photo(rng, 1200, 800), {"quality": 90}),
+    "pixel_art.png": (_pixel_art, {}),
+    "gradient.png": (lambda rng: _gradient(), {}),
+    "transparent.png": (_transparent, {}),
+    "large.jpg": (lambda rng: _photo(rng, 4000, 3000), {"quality": 92}),
+}
+
+def build_corpus(directory: str) -> Dict[str, str]:
+    """
+    Write the corpus to a directory, skipping files that already exist
+
+    Args:
+        directory: Where to write the images
+
+    Returns:
+        Mapping of corpus image name to file path
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for position, (name, (builder, options)) in enumerate(CORPUS.items()):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            builder(np.random.default_rng(CORPUS_SEED + position)).save(path, **options)
+        paths[name] = path
+    return paths
@@ -0,0 +1,177 @@
+"""
+Calibrate the strategy cost model (services/cost_model.py) on this machine
+
+    python benchmarks/cost_model.py                      # refit data/cost_model.json
+    python benchmarks/cost_model.py --grid-sizes 32 100 --repeat 5 --output /tmp/cost_model.json
+
+Every corpus image is resized once per grid size, then each quantizer,
+matcher and executor combination runs on the resized pixels and both
+preview encoders run on its result. The stage times become samples for
+CostModel.fit, and the mean delta E between the resized image and its
+matched blocks becomes each quantizer and matcher pair's quality.
+
+Matching runs on private palettes without lookup tables, so match times are
+those of colours no worker has seen before (an upper bound; the shared
+tables of a running server are left untouched).
+"""
+import argparse
+import datetime
+import itertools
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+# Add parent directory to path so we can import our modules
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import numpy as np
+
+from benchmarks.corpus import build_corpus
+from services import palette as palette_module
+from services.color_space import srgb_to_lab
+from services.cost_model import (
+    COST_MODEL_PATH, ENCODERS, MATCHERS, QUANTIZERS, CostModel, count_colors,
+    feature_vector, matched_colors
+)
+from services.palette import COLOR_METRICS, BlockPalette, get_block_palette
+from services.pipeline import PipelineContext
+from services.pipeline_strategies import (
+    MATCH_THREADS, encode_preview_image, ingest_decode, match_executors, match_nearest, quantize_colors,
+    render_index, resize_linear_area
+)
+
+DEFAULT_GRID_SIZES = [32, 64, 100, 150, 200]
+CORPUS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "corpus")
+NUM_COLORS = 48
+
+@contextmanager
+def private_palettes() -> Iterator[None]:
+    """Serve palettes without shared lookup tables while the block runs"""
+    saved = dict(palette_module._palettes)
+    for metric in COLOR_METRICS:
+        shared = get_block_palette("blocks", metric)
+        palette_module._palettes[("blocks", metric)] = BlockPalette(shared.blocks, metric=metric)
+    try:
+        yield
+    finally:
+        palette_module._palettes.clear()
+        palette_module._palettes.update(saved)
+
+def _timed(function, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def measure(image_path: str, grid_size: int, repeat: int) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Stage samples and per-pair delta E for one image at one grid size
+
+    Returns:
+        (samples for CostModel.fit, {"<quantizer>:<matcher>": mean delta E})
+    """
+    with open(image_path, "rb") as f:
+        resized = PipelineContext(f.read(), {})
+    ingest_decode(resized)
+    resize_linear_area(resized, grid_size=grid_size)
+    pixels, lab = resized.pixels, resized.lab
+    height, width = pixels.shape[:2]
+    cells = width * height
+    unique_colors = count_colors(pixels)
+    palette_size = len(get_block_palette("blocks"))
+    source_lab = srgb_to_lab(pixels)
+
+    samples, quality = [], {}
+    def sample(term: str, quantizer: str, seconds: List[float]) -> None:
+        samples.append({
+            "term": term, "cells": cells, "colors": matched_colors(quantizer, unique_colors, NUM_COLORS),
+            "paletteSize": palette_size, "seconds": statistics.median(seconds),
+        })
+
+    for quantizer in QUANTIZERS:
+        quantized = pixels
+        if quantizer == "minibatch_kmeans":
+            times = [_timed(quantize_colors, pixels, NUM_COLORS) for _ in range(repeat)]
+            sample(f"quantize:{quantizer}", quantizer, times)
+            quantized = quantize_colors(pixels, NUM_COLORS)
+        else:
+            sample(f"quantize:{quantizer}", quantizer, [0.0])
+
+        # With one match thread "threads" is the serial path, so it is left uncalibrated
+        for matcher, executor in itertools.product(MATCHERS, match_executors()):
+            times = []
+            for _ in range(repeat):
+                with private_palettes():
+                    context = PipelineContext(None, {})
+                    context.pixels = quantized
+                    if quantizer == "none":
+                        context.lab = lab
+                    times.append(_timed(match_nearest, context, metric=matcher, executor=executor))
+            sample(f"match:{matcher}:{executor}", quantizer, times)
+
+            matched_lab = context.palette.lab_colors[context.index_grid]
+            quality[f"{quantizer}:{matcher}"] = float(np.linalg.norm(source_lab - matched_lab, axis=-1).mean())
+
+        render_index(context)
+        for encoder in ENCODERS:
+            times = [_timed(encode_preview_image, context, preview_format=encoder) for _ in range(repeat)]
+            sample(f"encode:{encoder}", quantizer, times)
+    return samples, quality
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid-sizes", type=int, nargs="+", default=DEFAULT_GRID_SIZES)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (the median is used)")
+    parser.add_argument("--output", default=COST_MODEL_PATH)
+    args = parser.parse_args()
+
+    # Import and build everything once so no sample pays for it
+    quantize_colors(np.zeros((8, 8, 3), dtype=np.uint8), 2)
+    for metric in COLOR_METRICS:
+        get_block_palette("blocks", metric)
+
+    images = build_corpus(CORPUS_DIR)
+    samples, quality_runs = [], {}
+    for (name, path), grid_size in itertools.product(images.items(), args.grid_sizes):
+        case_samples, case_quality = measure(path, grid_size, args.repeat)
+        samples.extend(case_samples)
+        for key, delta_e in case_quality.items():
+            quality_runs.setdefault(key, []).append(delta_e)
+        print(f"{name:<16} grid {grid_size:>4}  " + "  ".join(
+            f"{sample['term']} {sample['seconds'] * 1000:.1f}ms" for sample in case_samples if sample["seconds"]
+        ))
+
+    quality = {key: statistics.mean(values) for key, values in quality_runs.items()}
+    model = CostModel.fit(samples, quality, calibration={
+        "fittedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "matchThreads": MATCH_THREADS,
+        "python": platform.python_version(),
+        "corpus": sorted(images),
+        "gridSizes": args.grid_sizes,
+        "repeat": args.repeat,
+        "lookupTables": "none",
+    })
+
+    print("\nPrediction error by term (median of |predicted - measured|)")
+    for term in sorted(model.coefficients):
+        errors = [
+            abs(float(model.coefficients[term] @ feature_vector(sample["cells"], sample["colors"], sample["paletteSize"])) - sample["seconds"]) * 1000
+            for sample in samples if sample["term"] == term
+        ]
+        print(f"  {term:<28}{statistics.median(errors):8.2f} ms")
+    print("\nMean delta E by quantizer and matcher")
+    for key, value in sorted(quality.items()):
+        print(f"  {key:<28}{value:8.2f}")
+
+    model.save(args.output)
+    print(f"\nWrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Load generator and latency report for the conversion API
+
+    # In-process over ASGI (no server needed)
+    python benchmarks/load_test.py --app optimized --concurrency 4 --duration 30
+
+    # Against a local uvicorn started by this script, with 2 workers
+    python benchmarks/load_test.py --app main --spawn --workers 2 --concurrency 8
+
+    # Against a server that is already running
+    python benchmarks/load_test.py --url http://localhost:5000 --server-pid 1234
+
+Requests replay a weighted mix of image and grid sizes at a fixed concurrency
+(a closed loop: each virtual client sends its next request when the previous
+one finishes). The report gives throughput, p50/p95/p99 latency overall and
+per mix entry, error and throttled (429/503) rates, and server memory sampled over the run.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Any, Optional, Tuple
+
+# Add parent directory to path so we can import our modules
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from benchmarks.corpus import _smooth_noise
+
+# Per app: ASGI module, conversion endpoint and health endpoint
+APPS = {
+    "optimized": ("main_optimized", "/process-image", "/health"),
+    "main": ("main", "/api/process-image", "/api/health"),
+}
+
+DEFAULT_MIX = ["256x256@32*3", "800x600@100*2", "1600x1200@200*1"]
+MEMORY_SAMPLE_INTERVAL = 0.5
+
+def parse_mix(entries: List[str]) -> List[Tuple[str, int, int, int, int]]:
+    """
+    Parse mix entries of the form WIDTHxHEIGHT@GRID[*WEIGHT]
+
+    Returns:
+        List of (label, width, height, grid size, weight)
+    """
+    mix = []
+    for entry in entries:
+        try:
+            spec, _, weight = entry.partition("*")
+            size, _, grid = spec.partition("@")
+            width, height = (int(value) for value in size.lower().split("x"))
+            mix.append((spec, width, height, int(grid or 100), int(weight or 1)))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid mix entry {entry!r}, expected e.g. 800x600@100*2")
+    return mix
+
+def build_payloads(mix, seed: int) -> Dict[str, bytes]:
+    """Encode one PNG per mix entry"""
+    rng = np.random.default_rng(seed)
+    payloads = {}
+    for label, width, height, _, _ in mix:
+        buffered = io.BytesIO()
+        Image.fromarray(_smooth_noise(rng, width, height, 8)).save(buffered, format="PNG")
+        payloads[label] = buffered.getvalue()
+    return payloads
+
+def process_tree_rss_mb(pid: int) -> Optional[float]:
+    """Resident memory of a process and all its descendants (Linux only)"""
+    try:
+        children: Dict[int, List[int]] = {}
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    # The parent pid follows the ")" that closes the command name
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+                children.setdefault(parent, []).append(int(name))
+            except (OSError, IndexError, ValueError):
+                continue
+
+        total_pages = 0
+        pending = [pid]
+        while pending:
+            current = pending.pop()
+            try:
+                with open(f"/proc/{current}/statm") as f:
+                    total_pages += int(f.read().split()[1])
+            except OSError:
+                continue
+            pending.extend(children.get(current, []))
+        return total_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, AttributeError, ValueError):
+        return None
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    return float(np.percentile(values, fraction * 100))
+
+def summarize(records: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """Throughput, latency percentiles and error rates for a set of request records"""
+    latencies = [record["latency"] * 1000 for record in records if record["status"] == 200]
+    total = len(records)
+    statuses: Dict[str, int] = {}
+    for record in records:
+        statuses[str(record["status"])] = statuses.get(str(record["status"]), 0) + 1
+
+    # Rate limiting (429) and admission control turning work away (503)
+    throttled = statuses.get("429", 0) + statuses.get("503", 0)
+    errors = total - statuses.get("200", 0) - throttled
+    return {
+        "requests": total,
+        "throughput": round(statuses.get("200", 0) / elapsed, 2) if elapsed > 0 else None,
+        "p50Ms": _round(percentile(latencies, 0.50)),
+        "p95Ms": _round(percentile(latencies, 0.95)),
+        "p99Ms": _round(percentile(latencies, 0.99)),
+        "maxMs": _round(max(latencies) if latencies else None),
+        "errorRate": round(errors / total, 4) if total else 0.0,
+        "throttledRate": round(throttled / total, 4) if total else 0.0,
+        "statuses": statuses,
+    }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+async def _client_loop(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    mix,
+    payloads: Dict[str, bytes],
+    rng: random.Random,
+    deadline: float,
+    remaining: List[int],
+    records: List[Dict[str, Any]],
+    counter: List[int]
+) -> None:
+    weights = [entry[4] for entry in mix]
+    while time.perf_counter() < deadline and remaining[0] != 0:
+        remaining[0] -= 1
+        label, _, _, grid_size, _ = rng.choices(mix, weights=weights)[0]
+
+        # Trailing bytes after the image end make every upload unique, so
+        # server-side result caches can't answer, without re-encoding
+        counter[0] += 1
+        body = payloads[label] + counter[0].to_bytes(8, "little")
+
+        start_time = time.perf_counter()
+        try:
+            response = await client.post(
+                endpoint,
+                files={"image": ("load.png", body, "image/png")},
+                headers={"X-Grid-Size": str(grid_size)}
+            )
+            status = response.status_code
+        except httpx.HTTPError:
+            status = "connection-error"
+        records.append({
+            "mix": label,
+            "status": status,
+            "start": start_time,
+            "latency": time.perf_counter() - start_time,
+        })
+
+async def _sample_memory(pid: Optional[int], stop: asyncio.Event, start_time: float, timeline: List[List[float]]) -> None:
+    while pid is not None:
+        rss = process_tree_rss_mb(pid)
+        if rss is not None:
+            timeline.append([round(time.perf_counter() - start_time, 2), round(rss, 1)])
+        try:
+            await asyncio.wait_for(stop.wait(), MEMORY_SAMPLE_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+async def run_load(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    mix,
+    payloads: Dict[str, bytes],
+    concurrency: int,
+    duration: float,
+    max_requests: Optional[int],
+    server_pid: Optional[int],
+    seed: int
+) -> Dict[str, Any]:
+    records: List[Dict[str, Any]] = []
+    timeline: List[List[float]] = []
+    remaining = [max_requests if max_requests else -1]
+    counter = [0]
+
+    start_time = time.perf_counter()
+    deadline = start_time + duration
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(_sample_memory(server_pid, stop, start_time, timeline))
+
+    await asyncio.gather(*(
+        _client_loop(client, endpoint, mix, payloads, random.Random(seed + worker), deadline, remaining, records, counter)
+        for worker in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start_time
+    stop.set()
+    await sampler
+
+    report = summarize(records, elapsed)
+    report.update({
+        "elapsed": round(elapsed, 2),
+        "concurrency": concurrency,
+        "byMix": {
+            label: summarize([record for record in records if record["mix"] == label], elapsed)
+            for label, *_ in mix
+        },
+        "memory": {
+            "peakMb": max((rss for _, rss in timeline), default=None),
+            "timeline": timeline,
+        },
+    })
+    return report
+
+def _wait_for_server(base_url: str, health_path: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            if httpx.get(base_url + health_path, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError("Server did not become healthy in time")
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{report['requests']} requests in {report['elapsed']} s at concurrency {report['concurrency']}")
+    print(f"throughput {report['throughput']} req/s, errors {report['errorRate']:.1%}, "
+          f"throttled (429/503) {report['throttledRate']:.1%}")
+    print(f"\n{'mix':<18}{'requests':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for label, entry in [("all", report)] + list(report["byMix"].items()):
+        print(f"{label:<18}{entry['requests']:>9}{str(entry['p50Ms']):>10}{str(entry['p95Ms']):>10}"
+              f"{str(entry['p99Ms']):>10}{entry['errorRate']:>8.1%}")
+    if report["memory"]["peakMb"] is not None:
+        print(f"\nserver peak RSS {report['memory']['peakMb']} MB over {len(report['memory']['timeline'])} samples")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=list(APPS), default="optimized")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="base URL of a running server")
+    target.add_argument("--spawn", action="store_true", help="start a local uvicorn for the run")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers when spawning")
+    parser.add_argument("--port", type=int, default=8765, help="port when spawning")
+    parser.add_argument("--server-pid", type=int, help="pid of a running server to sample memory from")
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX, help="WIDTHxHEIGHT@GRID[*WEIGHT] entries")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    module, endpoint, health_path = APPS[args.app]
+    mix = parse_mix(args.mix)
+    payloads = build_payloads(mix, args.seed)
+
+    server = None
+    server_pid = args.server_pid
+    if args.spawn:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(args.port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR
+        )
+        server_pid = server.pid
+        base_url = f"http://127.0.0.1:{args.port}"
+        _wait_for_server(base_url, health_path, server)
+        transport = None
+    elif args.url:
+        base_url = args.url.rstrip("/")
+        transport = None
+    else:
+        # In-process: the app shares this process, so its memory is ours
+        os.chdir(BACKEND_DIR)
+        app = __import__(module).app
+        base_url = "http://loadtest"
+        transport = httpx.ASGITransport(app=app)
+        server_pid = os.getpid()
+
+    async def run() -> Dict[str, Any]:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(
+            base_url=base_url, transport=transport, timeout=args.timeout, limits=limits
+        ) as client:
+            return await run_load(
+                client, endpoint, mix, payloads, args.concurrency, args.duration,
+                args.requests, server_pid, args.seed
+            )
+
+    try:
+        report = asyncio.run(run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report["target"] = {"app": args.app, "url": args.url, "spawned": args.spawn, "workers": args.workers}
+    print_report(report)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure conversion peak memory and fit the admission controller's memory model
+
+    python benchmarks/memory_model.py
+    python benchmarks/memory_model.py --pipelines optimized --sizes 500 2000 --grid-sizes 64 200
+
+Every case runs in a fresh worker process that first warms up with a tiny
+conversion, then records how far the resident set high-water mark rises
+while decoding and converting the image (Linux only). The report compares
+each measurement with services/admission.py's estimate and prints per-unit
+costs fitted by least squares, to update MEMORY_MODEL with.
+"""
+import argparse
+import io
+import itertools
+import multiprocessing
+import os
+import sys
+from typing import Any, Dict, List
+
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.admission import MB, MEMORY_MODEL, estimate_peak_bytes, grid_dimensions, _read_status_kb, _reset_peak_rss
+
+def _image_bytes(width: int, height: int, seed: int = 0) -> bytes:
+    """A smooth image with noise, compressed like a photo upload"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 127 // (width + height)], axis=2)
+    pixels = np.clip(base + rng.integers(-25, 26, size=base.shape), 0, 255).astype(np.uint8)
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+def measure_case(case: Dict[str, Any], image_data: bytes) -> Dict[str, Any]:
+    """Peak RSS rise of one conversion (runs in a fresh worker process)"""
+    from services.pipeline import get_pipeline
+
+    pipeline = get_pipeline(case["pipeline"])
+    params = {"grid_size": case["grid_size"]}
+    pipeline.run(_image_bytes(64, 48, seed=1), use_cache=False, **params)
+
+    baseline = _reset_peak_rss()
+    if baseline is None:
+        raise RuntimeError("Peak RSS measurement needs Linux /proc/self/clear_refs")
+    pipeline.run(image_data, use_cache=False, **params)
+    peak = _read_status_kb("VmHWM")["VmHWM"] * 1024 - baseline
+    return {**case, "peak": peak}
+
+def fit_model(results: List[Dict[str, Any]], pipelines: List[str]) -> Dict[str, float]:
+    """Least-squares per-unit costs: fixed, then per-pipeline source pixel and cell costs"""
+    columns = ["fixed"] + [f"source_pixel:{name}" for name in pipelines] + [f"cell:{name}" for name in pipelines]
+    rows, peaks = [], []
+    for result in results:
+        grid_width, grid_height = grid_dimensions(result["width"], result["height"], result["grid_size"])
+        cells = grid_width * grid_height
+        preview = cells * 16 * MEMORY_MODEL["preview_pixel"]["png"]
+        pixels = result["width"] * result["height"]
+        row = [1.0] + [
+            float(pixels if name == result["pipeline"] else 0) for name in pipelines
+        ] + [
+            float(cells if name == result["pipeline"] else 0) for name in pipelines
+        ]
+        rows.append(row)
+        peaks.append(result["peak"] - preview)
+    coefficients, *_ = np.linalg.lstsq(np.array(rows), np.array(peaks, dtype=np.float64), rcond=None)
+    return dict(zip(columns, coefficients))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", nargs="+", default=["optimized", "legacy"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[400, 1000, 2000], help="source long side in pixels")
+    parser.add_argument("--grid-sizes", type=int, nargs="+", default=[50, 100, 200])
+    args = parser.parse_args()
+
+    cases = [
+        {"pipeline": pipeline, "width": size, "height": size * 3 // 4, "grid_size": grid_size}
+        for pipeline, size, grid_size in itertools.product(args.pipelines, args.sizes, args.grid_sizes)
+    ]
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for case in cases:
+        with context.Pool(1) as pool:
+            result = pool.apply(measure_case, (case, _image_bytes(case["width"], case["height"])))
+        result["estimate"] = estimate_peak_bytes(
+            result["width"], result["height"], grid_size=result["grid_size"], pipeline=result["pipeline"]
+        )
+        results.append(result)
+        print(
+            f"{result['pipeline']:<10} {result['width']:>5}x{result['height']:<5} grid {result['grid_size']:>4}  "
+            f"peak {result['peak'] / MB:8.1f} MB  estimate {result['estimate'] / MB:8.1f} MB  "
+            f"ratio {result['peak'] / result['estimate']:5.2f}"
+        )
+
+    print("\nFitted costs (bytes)")
+    for name, value in fit_model(results, args.pipelines).items():
+        print(f"  {name:<22}{value:>14.1f}")
+
+if __name__ == "__main__":
+    main()
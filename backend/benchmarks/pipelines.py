@@ -0,0 +1,41 @@
+"""
+Adapters that run each conversion pipeline the way its API endpoint does
+
+Every adapter takes an image file path and a grid size. Stage timings are
+recorded by the pipeline engine (services/pipeline.py).
+"""
+import os
+import tempfile
+from typing import Callable, Dict
+
+def run_legacy(path: str, grid_size: int) -> None:
+    """The "legacy" pipeline, as served by main.py"""
+    from services.pipeline import get_pipeline
+
+    with open(path, "rb") as f:
+        image_data = f.read()
+
+    get_pipeline("legacy").run(image_data, grid_size=grid_size)
+
+def run_optimized(path: str, grid_size: int) -> None:
+    """The "optimized" pipeline, as served by main_optimized.py"""
+    from services.pipeline import get_pipeline
+
+    with open(path, "rb") as f:
+        image_data = f.read()
+
+    # Bypass the on-disk result cache so every run does the full work
+    get_pipeline("optimized").run(image_data, use_cache=False, grid_size=grid_size)
+
+def run_app(path: str, grid_size: int) -> None:
+    """The "textured" pipeline behind app/services/image_processing/processor.py (file based)"""
+    from app.services.image_processing.processor import process_image_to_minecraft_blocks
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        process_image_to_minecraft_blocks(path, os.path.join(output_dir, "output.png"), grid_size)
+
+PIPELINES: Dict[str, Callable[[str, int], None]] = {
+    "legacy": run_legacy,
+    "optimized": run_optimized,
+    "app": run_app,
+}
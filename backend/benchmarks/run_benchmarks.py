@@ -0,0 +1,216 @@
+"""
+Benchmark the conversion pipelines across the fixed corpus and grid sizes
+
+    python benchmarks/run_benchmarks.py                       # full run
+    python benchmarks/run_benchmarks.py --pipelines optimized app --grid-sizes 32 100
+    python benchmarks/run_benchmarks.py --baseline benchmarks/results/baseline.json
+
+Each case (pipeline, image, grid size) runs in a fresh child process so its
+peak RSS is measured on its own. Results are written as JSON together with a
+comparison report. With --baseline, the run fails (exit status 1) when any
+stage got slower than the baseline by more than --threshold.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Dict, List, Any, Optional
+
+# Add parent directory to path so we can import our modules
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import numpy as np
+
+from benchmarks.corpus import build_corpus, CORPUS
+from benchmarks.pipelines import PIPELINES
+from services.stage_timer import collect_stage_timings
+
+DEFAULT_GRID_SIZES = [32, 64, 100, 128, 200]
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+CORPUS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "corpus")
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size of this process, if the platform exposes it"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+def run_case(pipeline: str, image_path: str, grid_size: int, repeat: int, warmup: int) -> Dict[str, Any]:
+    """Run one benchmark case; called in a child process"""
+    run = PIPELINES[pipeline]
+    baseline_rss = current_rss_mb()
+
+    for _ in range(warmup):
+        run(image_path, grid_size)
+
+    runs: List[Dict[str, float]] = []
+    for _ in range(repeat):
+        with collect_stage_timings() as timings:
+            start_time = time.perf_counter()
+            run(image_path, grid_size)
+            total = time.perf_counter() - start_time
+        runs.append({**timings.stages, "total": total})
+
+    stages = sorted({name for timings in runs for name in timings})
+    medians = {name: round(statistics.median(t.get(name, 0.0) for t in runs) * 1000, 3) for name in stages}
+    peak = peak_rss_mb()
+
+    return {
+        "stagesMs": {name: value for name, value in medians.items() if name != "total"},
+        "totalMs": medians["total"],
+        "peakRssMb": round(peak, 1) if peak is not None else None,
+        "rssGrowthMb": round(peak - baseline_rss, 1) if peak is not None and baseline_rss is not None else None,
+    }
+
+def run_benchmarks(
+    pipelines: List[str],
+    images: List[str],
+    grid_sizes: List[int],
+    repeat: int,
+    warmup: int
+) -> Dict[str, Any]:
+    corpus = build_corpus(CORPUS_DIR)
+
+    # fork keeps imports warm in the child; elsewhere fall back to spawn
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+
+    results = []
+    for pipeline in pipelines:
+        for image in images:
+            for grid_size in grid_sizes:
+                with context.Pool(processes=1, maxtasksperchild=1) as pool:
+                    case = pool.apply(run_case, (pipeline, corpus[image], grid_size, repeat, warmup))
+                case.update({"pipeline": pipeline, "image": image, "gridSize": grid_size})
+                results.append(case)
+                print(f"{pipeline:<10} {image:<16} {grid_size:>4}  {case['totalMs']:>10.1f} ms  "
+                      f"peak {case['peakRssMb']} MB", flush=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "cpuCount": os.cpu_count(),
+            "repeat": repeat,
+            "warmup": warmup,
+        },
+        "results": results,
+    }
+
+def comparison_report(report: Dict[str, Any]) -> str:
+    """Format total times side by side per image and grid size, plus per-stage medians"""
+    results = report["results"]
+    pipelines = list(dict.fromkeys(case["pipeline"] for case in results))
+    by_key = {(case["pipeline"], case["image"], case["gridSize"]): case for case in results}
+    cases = list(dict.fromkeys((case["image"], case["gridSize"]) for case in results))
+
+    lines = ["Total time (ms)", f"{'image':<16}{'grid':>6}" + "".join(f"{name:>12}" for name in pipelines)]
+    for image, grid_size in cases:
+        row = f"{image:<16}{grid_size:>6}"
+        for name in pipelines:
+            case = by_key.get((name, image, grid_size))
+            row += f"{case['totalMs']:>12.1f}" if case else f"{'-':>12}"
+        lines.append(row)
+
+    lines += ["", "Median stage time across cases (ms)"]
+    for name in pipelines:
+        stage_values: Dict[str, List[float]] = {}
+        for case in results:
+            if case["pipeline"] == name:
+                for stage_name, value in case["stagesMs"].items():
+                    stage_values.setdefault(stage_name, []).append(value)
+        summary = ", ".join(f"{stage_name} {statistics.median(values):.1f}" for stage_name, values in stage_values.items())
+        lines.append(f"{name:<10} {summary}")
+
+    return "\n".join(lines)
+
+def find_regressions(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float,
+    min_delta_ms: float
+) -> List[str]:
+    """
+    Compare stage times against a baseline report
+
+    A stage regresses when it is slower by more than threshold (a fraction)
+    and by more than min_delta_ms, which keeps timer noise on tiny stages out.
+    """
+    baseline_cases = {(case["pipeline"], case["image"], case["gridSize"]): case for case in baseline["results"]}
+    regressions = []
+
+    for case in report["results"]:
+        previous = baseline_cases.get((case["pipeline"], case["image"], case["gridSize"]))
+        if previous is None:
+            continue
+        stages = dict(case["stagesMs"], total=case["totalMs"])
+        previous_stages = dict(previous["stagesMs"], total=previous["totalMs"])
+        for stage_name, value in stages.items():
+            before = previous_stages.get(stage_name)
+            if before is None:
+                continue
+            if value > before * (1 + threshold) and value - before > min_delta_ms:
+                regressions.append(
+                    f"{case['pipeline']}/{case['image']}/{case['gridSize']} {stage_name}: "
+                    f"{before:.1f} -> {value:.1f} ms (+{(value / before - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", nargs="+", choices=list(PIPELINES), default=list(PIPELINES))
+    parser.add_argument("--images", nargs="+", choices=list(CORPUS), default=list(CORPUS))
+    parser.add_argument("--grid-sizes", nargs="+", type=int, default=DEFAULT_GRID_SIZES)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case (median is reported)")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per case")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "latest.json"))
+    parser.add_argument("--baseline", help="earlier results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.pipelines, args.images, args.grid_sizes, args.repeat, args.warmup)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    text = comparison_report(report)
+    with open(os.path.splitext(args.output)[0] + ".txt", "w") as f:
+        f.write(text + "\n")
+    print()
+    print(text)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} stage regression(s) over {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+if __name__ == "__main__":
+    main()
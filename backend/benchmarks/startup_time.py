@@ -0,0 +1,126 @@
+"""
+Cold start report: import-time breakdown and time until the health check passes
+
+    python benchmarks/startup_time.py                    # both apps
+    python benchmarks/startup_time.py --app main --top 15
+    python benchmarks/startup_time.py --no-serve         # imports only
+
+The import breakdown comes from `python -X importtime`, grouped by top-level
+package. With serving enabled, a uvicorn process is started and polled until
+the health endpoint answers, then until the background warm-up finishes.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Any, Tuple
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Per app: module and health endpoint
+APPS = {
+    "optimized": ("main_optimized", "/health"),
+    "main": ("main", "/api/health"),
+}
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+def import_breakdown(module: str) -> Dict[str, Any]:
+    """
+    Import a module in a fresh interpreter and attribute the time to packages
+
+    Returns:
+        {"totalMs", "packages": [(package, self ms)] slowest first}
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+
+    packages: Dict[str, int] = {}
+    total_us = 0
+    for line in completed.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+        if name == module:
+            total_us = int(cumulative_us)
+
+    ranked: List[Tuple[str, float]] = sorted(
+        ((package, round(us / 1000, 1)) for package, us in packages.items()),
+        key=lambda entry: -entry[1]
+    )
+    return {"totalMs": round(total_us / 1000, 1), "packages": ranked}
+
+def time_to_healthy(module: str, health_path: str, port: int, timeout: float = 120.0) -> Dict[str, Any]:
+    """
+    Start uvicorn and measure how long until health passes and warm-up ends
+
+    Returns:
+        {"healthySeconds", "warmSeconds"}; warmSeconds is None if the app
+        does not report its warm-up state
+    """
+    url = f"http://127.0.0.1:{port}{health_path}"
+    start_time = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR
+    )
+    healthy = warm = None
+    try:
+        while time.perf_counter() - start_time < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with status {server.returncode}")
+            try:
+                response = httpx.get(url, timeout=1.0)
+            except httpx.HTTPError:
+                time.sleep(0.02)
+                continue
+            elapsed = time.perf_counter() - start_time
+            if response.status_code == 200:
+                if healthy is None:
+                    healthy = elapsed
+                state = response.json().get("warmup")
+                if state in (None, "warm", "degraded"):
+                    warm = elapsed if state == "warm" else None
+                    break
+            time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return {
+        "healthySeconds": round(healthy, 2) if healthy is not None else None,
+        "warmSeconds": round(warm, 2) if warm is not None else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=list(APPS), nargs="+", default=list(APPS))
+    parser.add_argument("--top", type=int, default=10, help="packages to list")
+    parser.add_argument("--no-serve", action="store_true", help="skip the uvicorn time-to-healthy check")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    for name in args.app:
+        module, health_path = APPS[name]
+        breakdown = import_breakdown(module)
+        print(f"\n{name} ({module}): import {breakdown['totalMs']} ms")
+        for package, ms in breakdown["packages"][:args.top]:
+            print(f"  {package:<28}{ms:>10.1f} ms")
+
+        if not args.no_serve:
+            startup = time_to_healthy(module, health_path, args.port)
+            print(f"  healthy after {startup['healthySeconds']} s, warm after {startup['warmSeconds']} s")
+
+if __name__ == "__main__":
+    main()
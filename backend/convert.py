@@ -0,0 +1,358 @@
+"""
+Bulk converter: turn a directory tree or glob of images into block art files
+
+    python convert.py photos/ -o converted/
+    python convert.py "art/**/*.png" -o converted/ --workers 6 --grid-size 128
+    python convert.py photos/ -o converted/ --outputs preview counts --pipeline legacy
+
+For every input image the output directory gets, at the same relative path:
+
+    <name>.preview.<png|webp>   rendered preview
+    <name>.schem                Sponge schematic, one block high
+    <name>.blocks.json          block counts and grid size
+
+Conversions run in a process pool. A manifest (manifest.json in the output
+directory) records the content hash of every converted input together with
+the settings used, so running the same command again, or resuming an
+interrupted run, only converts new or changed images.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Make the backend modules importable when run from another directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.batch_processor import IMAGE_EXTENSIONS
+from services.shared_arrays import data_fingerprint
+
+MANIFEST_NAME = "manifest.json"
+
+OUTPUT_KINDS = ("preview", "schematic", "counts")
+
+# Seconds between manifest saves while converting
+MANIFEST_SAVE_INTERVAL = 5.0
+
+def _glob_root(pattern: str) -> str:
+    """The directory part of a glob pattern before the first wildcard"""
+    parts = []
+    for part in pattern.replace("\\", "/").split("/"):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return "/".join(parts) or "."
+
+def collect_inputs(inputs: List[str]) -> List[Tuple[str, str]]:
+    """
+    Expand input directories, globs and files into images to convert
+
+    Args:
+        inputs: Directories (searched recursively), glob patterns or files
+
+    Returns:
+        Sorted list of (path, path relative to its input root), without duplicates
+    """
+    found: Dict[str, str] = {}
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for directory, _, files in os.walk(entry):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    found.setdefault(path, os.path.relpath(path, entry))
+        elif glob.has_magic(entry):
+            root = _glob_root(entry)
+            for path in glob.glob(entry, recursive=True):
+                if os.path.isfile(path):
+                    found.setdefault(path, os.path.relpath(path, root))
+        elif os.path.isfile(entry):
+            found.setdefault(entry, os.path.basename(entry))
+        else:
+            raise FileNotFoundError(f"No such file, directory or matching files: {entry}")
+
+    images = sorted(
+        (path, relative) for path, relative in found.items()
+        if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+    )
+
+    # Outputs are named after the relative path, so it must be unique
+    seen: Dict[str, str] = {}
+    for path, relative in images:
+        if relative in seen:
+            raise ValueError(f"{path} and {seen[relative]} would both be written as {relative}")
+        seen[relative] = path
+    return images
+
+def output_paths(output_dir: str, relative: str, outputs: List[str], preview_format: str) -> Dict[str, str]:
+    """Output file of each requested kind for one input"""
+    stem = os.path.join(output_dir, os.path.splitext(relative)[0])
+    paths = {
+        "preview": f"{stem}.preview.{preview_format}",
+        "schematic": f"{stem}.schem",
+        "counts": f"{stem}.blocks.json",
+    }
+    return {kind: paths[kind] for kind in outputs}
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Manifest:
+    """
+    Content hashes and settings of converted inputs, kept in the output directory
+
+    Entries store the file size and modification time too, so unchanged files
+    are recognised without reading them again.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {path}: {e}", file=sys.stderr)
+
+    def content_hash(self, relative: str, path: str) -> str:
+        """Hash of an input, reusing the recorded hash if size and mtime are unchanged"""
+        stat = os.stat(path)
+        entry = self.entries.get(relative)
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            return entry["hash"]
+        return file_hash(path)
+
+    def is_current(self, relative: str, content_hash: str, settings: str, outputs: Dict[str, str]) -> bool:
+        entry = self.entries.get(relative)
+        return (
+            entry is not None
+            and entry["hash"] == content_hash
+            and entry["settings"] == settings
+            and all(os.path.isfile(path) for path in outputs.values())
+        )
+
+    def record(self, relative: str, path: str, content_hash: str, settings: str, summary: Dict[str, Any]) -> None:
+        stat = os.stat(path)
+        self.entries[relative] = {
+            "hash": content_hash,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "settings": settings,
+            **summary,
+        }
+
+    def save(self) -> None:
+        """Write the manifest atomically so an interrupted run never leaves it half written"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"entries": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def convert_one(task: Tuple[str, str, Dict[str, str], str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Convert one image and write its outputs (runs in a worker process)
+
+    Args:
+        task: (path, relative path, output paths by kind, pipeline name, pipeline params)
+
+    Returns:
+        {"relative", "ok", "seconds", "blockCount", "gridSize"} or {"relative", "ok", "error"}
+    """
+    from services.pipeline import get_pipeline
+    from services.materials import materials_report
+    from services.schematic_generator import create_schematic_file
+
+    path, relative, outputs, pipeline_name, params = task
+    start_time = time.perf_counter()
+    try:
+        context = get_pipeline(pipeline_name).run_context(path, stop_after="encode", **params)
+        block_count = context.block_counts()
+        grid_size = context.grid_size
+
+        if "preview" in outputs:
+            _write_atomic(outputs["preview"], context.encoded)
+        if "schematic" in outputs:
+            _write_atomic(outputs["schematic"], create_schematic_file(context.grid))
+        if "counts" in outputs:
+            counts = {
+                "blockCount": block_count,
+                "gridSize": grid_size,
+                "source": relative,
+                "materials": materials_report(context.grid),
+            }
+            _write_atomic(outputs["counts"], json.dumps(counts, indent=2).encode())
+    except Exception as e:
+        return {"relative": relative, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    return {
+        "relative": relative,
+        "ok": True,
+        "seconds": time.perf_counter() - start_time,
+        "blockCount": block_count,
+        "gridSize": grid_size,
+    }
+
+class Progress:
+    """
+    Progress and throughput on stderr: a self-updating line on a terminal,
+    a line every few seconds otherwise
+    """
+    def __init__(self, total: int, interval: float = 5.0):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.done_bytes = 0
+        self.start_time = time.perf_counter()
+        self.interactive = sys.stderr.isatty()
+        self.interval = interval
+        self._last_print = 0.0
+
+    def update(self, ok: bool, size: int) -> None:
+        self.done += 1
+        self.failed += 0 if ok else 1
+        self.done_bytes += size
+
+        now = time.perf_counter()
+        if self.interactive or now - self._last_print >= self.interval or self.done == self.total:
+            self._last_print = now
+            self._print(now)
+
+    def _print(self, now: float) -> None:
+        elapsed = max(now - self.start_time, 1e-9)
+        rate = self.done / elapsed
+        remaining = (self.total - self.done) / rate if rate > 0 else 0
+        line = (
+            f"[{self.done}/{self.total}] {rate:.1f} images/s, "
+            f"{self.done_bytes / elapsed / 1e6:.1f} MB/s, {self.failed} failed, "
+            f"eta {remaining:.0f} s"
+        )
+        if self.interactive:
+            print(f"\r{line}\033[K", end="" if self.done < self.total else "\n", file=sys.stderr, flush=True)
+        else:
+            print(line, file=sys.stderr, flush=True)
+
+def _run_tasks(tasks: List[Tuple], workers: int) -> Iterator[Dict[str, Any]]:
+    """Yield task results as they finish, in this process when workers is 0"""
+    if workers == 0:
+        for task in tasks:
+            yield convert_one(task)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        # Small chunks keep progress smooth and losses small if interrupted
+        yield from pool.imap_unordered(convert_one, tasks, chunksize=1)
+
+def pipeline_params(args: argparse.Namespace) -> Dict[str, Any]:
+    """Pipeline arguments given on the command line (unset ones use the pipeline defaults)"""
+    params = {
+        "grid_size": args.grid_size,
+        "num_colors": args.num_colors,
+        "output_scale": args.output_scale,
+        "preview_format": args.preview_format,
+    }
+    return {name: value for name, value in params.items() if value is not None}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("--pipeline", default="optimized", help="pipeline from data/pipelines.json")
+    parser.add_argument("--outputs", nargs="+", choices=OUTPUT_KINDS, default=list(OUTPUT_KINDS))
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="worker processes (0 converts in this process)")
+    parser.add_argument("--grid-size", type=int)
+    parser.add_argument("--num-colors", type=int)
+    parser.add_argument("--output-scale", type=int)
+    parser.add_argument("--preview-format", choices=["png", "webp"])
+    parser.add_argument("--force", action="store_true", help="convert everything, ignoring the manifest")
+    args = parser.parse_args(argv)
+
+    from services.pipeline import get_pipeline
+
+    pipeline = get_pipeline(args.pipeline)
+    params = pipeline_params(args)
+    unsupported = set(params) - pipeline.parameters
+    if unsupported:
+        parser.error(f"Pipeline {args.pipeline} does not take: {', '.join(sorted(unsupported))}")
+
+    # Outputs are only current if they were made with the same pipeline and settings
+    settings = data_fingerprint(
+        args.pipeline,
+        [[step.stage, step.strategy.name, step.options] for step in pipeline.steps],
+        params,
+        sorted(args.outputs)
+    )
+    preview_format = args.preview_format or "png"
+
+    try:
+        inputs = collect_inputs(args.inputs)
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+
+    manifest = Manifest(os.path.join(args.output, MANIFEST_NAME))
+    tasks = []
+    pending: Dict[str, Tuple[str, str, int]] = {}
+    skipped = 0
+    for path, relative in inputs:
+        outputs = output_paths(args.output, relative, args.outputs, preview_format)
+        content_hash = manifest.content_hash(relative, path)
+        if not args.force and manifest.is_current(relative, content_hash, settings, outputs):
+            skipped += 1
+            continue
+        tasks.append((path, relative, outputs, args.pipeline, params))
+        pending[relative] = (path, content_hash, os.path.getsize(path))
+
+    print(
+        f"{len(inputs)} images, {skipped} up to date, {len(tasks)} to convert "
+        f"with {args.workers} workers",
+        file=sys.stderr
+    )
+
+    progress = Progress(len(tasks))
+    failures = []
+    last_save = time.perf_counter()
+    try:
+        for outcome in _run_tasks(tasks, args.workers):
+            path, content_hash, size = pending[outcome["relative"]]
+            if outcome["ok"]:
+                manifest.record(outcome["relative"], path, content_hash, settings, {"gridSize": outcome["gridSize"]})
+            else:
+                failures.append(outcome)
+            progress.update(outcome["ok"], size)
+
+            if time.perf_counter() - last_save >= MANIFEST_SAVE_INTERVAL:
+                manifest.save()
+                last_save = time.perf_counter()
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume", file=sys.stderr)
+        return 130
+    finally:
+        manifest.save()
+
+    for failure in failures:
+        print(f"Failed: {failure['relative']}: {failure['error']}", file=sys.stderr)
+    print(
+        f"Converted {len(tasks) - len(failures)}, skipped {skipped}, failed {len(failures)} "
+        f"in {time.perf_counter() - progress.start_time:.1f} s",
+        file=sys.stderr
+    )
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+"""
+Gunicorn settings for running several workers
+
+    gunicorn -c gunicorn.conf.py main_optimized:app
+
+The palette arrays, colour lookup table and texture atlases are built once in
+the master before the workers fork. Workers then memory-map the same files
+from SHARED_DATA_DIR instead of building their own copies.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.environ.get("WORKER_TIMEOUT", "120"))
+
+# Import the app in the master so workers share its loaded modules copy-on-write
+preload_app = True
+
+def on_starting(server):
+    """Build the shared data files before any worker starts"""
+    from services.warmup import WarmUp
+
+    status = WarmUp(["palette", "pipelines", "tile_atlas", "texture_atlas"]).run()
+    server.log.info(f"Shared palette data ready in {status['totalMs']} ms")
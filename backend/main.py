@@ -1,20 +1,25 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from PIL import Image
 import io
-import base64
 import os
 import uuid
 import shutil
 import time
 from typing import Optional
+from contextlib import asynccontextmanager
 import logging
 
-from services.image_processor import process_image_to_blocks
+from services.pipeline import get_pipeline
+from services.admission import AdmissionRejected, get_admission_controller
+from services.scheduler import estimate_cost, get_scheduler
+from middleware.timing import timing_middleware, metrics_response
+from middleware.profiling import PROFILING_ENABLED, profiling_middleware, load_profile, profile_token_valid
+from services.warmup import WarmUp
 from models.response_models import ProcessedImageResponse, GridSize
-from app.services.image_processing.processor import process_image_to_minecraft_blocks
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -23,7 +28,15 @@ logger = logging.getLogger(__name__)
 # Create output directory if it doesn't exist
 os.makedirs("output", exist_ok=True)
 
-app = FastAPI(title="Minecraft Block Image Converter API")
+# Heavy imports and lookup tables loaded ahead of the first request
+warm_up = WarmUp(["sklearn", "cv2", "pipelines", "texture_atlas"])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up.on_startup()
+    yield
+
+app = FastAPI(title="Minecraft Block Image Converter API", lifespan=lifespan)
 
 # Configure CORS for frontend
 app.add_middleware(
@@ -36,8 +49,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id"],
 )
 
+# Per-stage Server-Timing header and request metrics
+app.middleware("http")(timing_middleware)
+
+# Operator-only request profiling: ENABLE_PROFILING=1 and PROFILING_TOKEN on the server, the token in X-Profile on the request
+if PROFILING_ENABLED:
+    app.middleware("http")(profiling_middleware)
+
 # Mount static files directory
 app.mount("/output", StaticFiles(directory="output"), name="output")
 
@@ -48,10 +69,32 @@ async def root():
 @app.get("/api/health")
 async def health_check():
     logger.info("Health check endpoint called")
-    return {"status": "healthy"}
+    return {"status": "healthy", "warmup": warm_up.state}
+
+@app.post("/api/warmup")
+def warmup_endpoint():
+    return warm_up.run()
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile_endpoint(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    if PROFILING_ENABLED and not profile_token_valid(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+    profile = load_profile(profile_id) if PROFILING_ENABLED else None
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@app.get("/api/metrics")
+def metrics_endpoint():
+    return metrics_response()
+
+@app.get("/api/admission")
+def admission_status_endpoint():
+    return {**get_admission_controller().status(), "scheduler": get_scheduler().status()}
 
 @app.post("/api/process-image", response_model=ProcessedImageResponse)  # Note the /api prefix
 async def process_image_endpoint(
+    request: Request,
     image: bytes = File(...),
     x_grid_size: Optional[str] = Header(None)
 ):
@@ -59,8 +102,6 @@ async def process_image_endpoint(
     
     try:
         logger.info("Starting image processing request")
-        # Load image from bytes
-        img = Image.open(io.BytesIO(image))
         
         # Get grid size from header or use default
         grid_size = int(x_grid_size) if x_grid_size else 50
@@ -69,36 +110,41 @@ async def process_image_endpoint(
         if grid_size > 100:
             print(f"Processing large grid size: {grid_size}. This may take a while.")
         
-        # Process image
-        processed_img, block_counts, block_grid = process_image_to_blocks(
-            img, 
-            max_width=grid_size, 
-            max_height=grid_size
-        )
+        # Schedule the client fairly and reserve the estimated memory (from the image header) before converting
+        width, height = Image.open(io.BytesIO(image)).size
+        admission = get_admission_controller()
+        estimate = admission.estimate(width, height, grid_size=grid_size, pipeline="legacy")
+        cost = estimate_cost(width, height, grid_size=grid_size)
+        client = get_scheduler().client_key(request.headers, request.client.host if request.client else None)
         
-        # Convert processed image to base64 for response
-        buffered = io.BytesIO()
-        processed_img.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        # Decode, convert and encode with the "legacy" pipeline (data/pipelines.json)
+        try:
+            result = await run_in_threadpool(_run_admitted, client, cost, estimate, image, grid_size)
+        except AdmissionRejected as e:
+            headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+            return JSONResponse(status_code=e.status_code, content={"message": str(e)}, headers=headers)
         
         # Calculate processing time
         processing_time = time.time() - start_time
         
         # Return processed image data and block counts
         return ProcessedImageResponse(
-            imageData=img_base64,
-            blockCount=block_counts,
+            imageData=result["imageData"],
+            imageFormat=result["imageFormat"],
+            previewStats=result["previewStats"],
+            blockCount=result["blockCount"],
             processingTime=round(processing_time, 2),
-            gridSize=GridSize(
-                width=len(block_grid[0]) if block_grid and block_grid[0] else 0,
-                height=len(block_grid)
-            ),
-            blockGrid=block_grid
+            gridSize=GridSize(**result["gridSize"]),
+            blockGrid=result["blockGrid"]
         )
     except Exception as e:
         logger.error(f"Processing error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
 
+def _run_admitted(client: str, cost: float, estimate: int, image: bytes, grid_size: int):
+    with get_scheduler().schedule(client, cost), get_admission_controller().admit(estimate):
+        return get_pipeline("legacy").run(image, grid_size=grid_size)
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 10000))
@@ -1,19 +1,58 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Header, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Request, Form, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
 from PIL import Image
+import numpy as np
+import asyncio
 import io
 import base64
+import hashlib
+import json
 import os
 import time
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Iterator, Optional, List, Tuple
 import uuid
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
 from pathlib import Path
 
-from services.image_processor_optimized import process_image_to_blocks
+from services.image_processor_optimized import process_image_to_blocks, process_image_to_relief
+from services.preview_encoder import (
+    PREVIEW_FORMATS, DEFAULT_PREVIEW_FORMAT, DEFAULT_COMPRESS_LEVEL,
+    render_index_preview, encode_preview
+)
+from services.preview_tiles import TileCache, tile_layout, render_tile
+from services.result_store import create_result_store
+from services.animation_processor import is_animated, process_animation, render_animation_preview
+from services.batch_processor import expand_archive, resolve_item_params, run_batch
+from services.palette import get_block_palette
+from services.block_grid import BlockGrid, GridPalette
+from services.materials import SUBTOTALS, materials_report
+from services.relief import DEFAULT_FILLER, DEFAULT_RELIEF_HEIGHT, MAX_RELIEF_HEIGHT, relief_summary, relief_volume
+from services.admission import AdmissionRejected, get_admission_controller
+from services.scheduler import estimate_cost, get_scheduler
+from services.progress import ProgressReporter, report_progress
+from services.block_stream import STREAM_FORMATS, stream_block_rows
+from services.pipeline import computation_guard, get_pipeline
+from services.metrics import CACHE_REQUESTS
+from services.stage_timer import stage
+from middleware.timing import timing_middleware, metrics_response
+from middleware.profiling import PROFILING_ENABLED, profiling_middleware, load_profile, profile_token_valid
+from services.warmup import WarmUp
 from models.response_models import ProcessedImageResponse
 
-app = FastAPI(title="Minecraft Image Processor API")
+# Heavy imports and lookup tables loaded ahead of the first request
+warm_up = WarmUp(["sklearn", "palette", "pipelines", "kmeans", "tile_atlas"])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up.on_startup()
+    yield
+
+app = FastAPI(title="Minecraft Image Processor API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -22,130 +61,790 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id"],
 )
 
+# Per-stage Server-Timing header and request metrics
+app.middleware("http")(timing_middleware)
+
+# Operator-only request profiling: ENABLE_PROFILING=1 and PROFILING_TOKEN on the server, the token in X-Profile on the request
+if PROFILING_ENABLED:
+    app.middleware("http")(profiling_middleware)
+
 # Create directories for temporary storage
 TEMP_DIR = Path("temp")
 SCHEMATIC_DIR = TEMP_DIR / "schematics"
 TEMP_DIR.mkdir(exist_ok=True)
 SCHEMATIC_DIR.mkdir(exist_ok=True)
 
-# Store processed results for later schematic generation
-processed_results: Dict[str, Dict[str, Any]] = {}
+# Store processed results for previews, tiles and later schematic generation.
+# The default SQLite store is shared by all workers, so any of them can serve
+# a download (see services/result_store.py for the RESULT_STORE_* settings)
+result_store = create_result_store()
+
+# Rendered preview tiles, per process (see services/preview_tiles.py for TILE_CACHE_ITEMS)
+tile_cache = TileCache()
+
+# Results never change once stored, so previews and tiles can be cached aggressively
+RESULT_CACHE_CONTROL = "public, max-age=86400, immutable"
 
 # Maximum image dimensions
 MAX_IMAGE_SIZE = 2000  # pixels (width or height)
 MAX_GRID_SIZE = 200    # blocks
 
+# Maximum number of images in one batch request
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "500"))
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Minecraft Image Processor API", "status": "active"}
 
 @app.post("/process-image", response_model=ProcessedImageResponse)
 async def process_image_endpoint(
+    request: Request,
     image: bytes = File(...),
+    depth: Optional[bytes] = File(None),
     x_grid_size: Optional[str] = Header(None),
     x_original_filename: Optional[str] = Header(None),
-    background_tasks: BackgroundTasks = None
+    x_preview_format: Optional[str] = Header(None),
+    x_compress_level: Optional[str] = Header(None),
+    x_preview_mode: Optional[str] = Header(None),
+    x_materials: Optional[str] = Header(None),
+    x_relief_height: Optional[str] = Header(None),
+    x_relief_filler: Optional[str] = Header(None)
 ):
     try:
-        # Get grid size from header
-        grid_size = int(x_grid_size) if x_grid_size else 100
+        # Get grid size from header, limited for performance
+        try:
+            grid_size = min(_int_header(x_grid_size, 100, "X-Grid-Size"), MAX_GRID_SIZE)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"message": str(e)})
         
-        # Limit grid size for performance
-        grid_size = min(grid_size, MAX_GRID_SIZE)
+        # Preview encoding options
+        preview_format = (x_preview_format or DEFAULT_PREVIEW_FORMAT).lower()
+        if preview_format not in PREVIEW_FORMATS:
+            return JSONResponse(
+                status_code=400,
+                content={"message": f"Unsupported preview format. Choose one of: {', '.join(PREVIEW_FORMATS)}"}
+            )
+        try:
+            compress_level = _int_header(x_compress_level, DEFAULT_COMPRESS_LEVEL, "X-Compress-Level")
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"message": str(e)})
+        
+        # Optional build materials list, with "rows" or "sections" subtotals
+        materials = x_materials.lower() if x_materials else None
+        if materials is not None and materials not in SUBTOTALS:
+            return JSONResponse(
+                status_code=400,
+                content={"message": f"Unsupported materials option. Choose one of: {', '.join(SUBTOTALS)}"}
+            )
         
         # Validate image before processing
         try:
-            img = Image.open(io.BytesIO(image))
-            width, height = img.size
-            
-            # Check if image is too large
-            if width > MAX_IMAGE_SIZE or height > MAX_IMAGE_SIZE:
-                return JSONResponse(
-                    status_code=400,
-                    content={"message": f"Image dimensions too large. Maximum size is {MAX_IMAGE_SIZE}x{MAX_IMAGE_SIZE} pixels"}
-                )
-                
-            # Check if image is empty
-            if width == 0 or height == 0:
+            img = _open_upload(image)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"message": str(e)})
+        
+        # Relief mode raises blocks into columns by lightness, or by an uploaded depth image
+        relief = None
+        if x_relief_height or depth:
+            try:
+                relief_height = _int_header(x_relief_height, DEFAULT_RELIEF_HEIGHT, "X-Relief-Height")
+            except ValueError as e:
+                return JSONResponse(status_code=400, content={"message": str(e)})
+            relief = {
+                "relief_height": relief_height,
+                "filler": x_relief_filler or DEFAULT_FILLER,
+                "depth_image": depth or None
+            }
+            if not 1 <= relief["relief_height"] <= MAX_RELIEF_HEIGHT:
                 return JSONResponse(
                     status_code=400,
-                    content={"message": "Invalid image with zero dimensions"}
+                    content={"message": f"Relief height must be between 1 and {MAX_RELIEF_HEIGHT}"}
                 )
-        except Exception as e:
-            return JSONResponse(
-                status_code=400,
-                content={"message": f"Invalid image file: {str(e)}"}
-            )
+            if relief["filler"] not in get_block_palette().names:
+                return JSONResponse(status_code=400, content={"message": f"Unknown filler block: {relief['filler']}"})
+            if is_animated(img):
+                return JSONResponse(status_code=400, content={"message": "Relief mode does not support animated images"})
+            if depth:
+                try:
+                    _open_upload(depth)
+                except ValueError as e:
+                    return JSONResponse(status_code=400, content={"message": f"Depth image: {e}"})
         
         # Process image
         start_time = time.time()
         
-        # Use either direct function call or background task based on image size
+        # Reserve the estimated memory before decoding; convert off the event loop
         result_id = str(uuid.uuid4())
-        result = process_image_to_blocks(image, grid_size=grid_size)
+        try:
+            result = await _convert_upload(
+                _client_key(request), image, img, grid_size, preview_format, compress_level, relief=relief
+            )
+        except AdmissionRejected as e:
+            return _admission_rejected_response(e)
         
-        # Add image ID to result and save for later reference
+        # Save the result for later preview, tile and schematic requests
+        # (the store's disk and database I/O stays off the event loop)
         result["id"] = result_id
-        processed_results[result_id] = result
+        record = _build_result_record(result)
+        await run_in_threadpool(result_store.put, result_id, record)
         
-        # Clean up old results to prevent memory leaks
-        background_tasks.add_task(cleanup_old_results)
+        # In "url" mode the client fetches the preview separately instead of inline
+        inline_preview = (x_preview_mode or "inline").lower() != "url"
         
         # Return the processed image data
         processing_time = time.time() - start_time
-        print(f"Total processing time: {processing_time:.2f} seconds")
-        
-        return ProcessedImageResponse(
-            imageData=result["imageData"],
-            blockCount=result["blockCount"],
-            id=result_id,
-            processingTime=round(processing_time, 2),
-            gridSize=result["gridSize"]
+        
+        # The response is encoded here rather than by FastAPI so the stage times the JSON encoding too
+        with stage("serialize"):
+            response = _processed_image_response(result_id, result, inline_preview, processing_time)
+            if materials is not None:
+                response.materials = _record_materials(record, materials)
+            return JSONResponse(content=jsonable_encoder(response))
+    except Exception as e:
+        print(f"Error processing image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
+
+@app.post("/process-image/stream")
+async def process_image_stream_endpoint(
+    request: Request,
+    image: bytes = File(...),
+    x_grid_size: Optional[str] = Header(None),
+    x_stream_format: Optional[str] = Header(None)
+):
+    """
+    Convert an image and stream the block grid row by row
+    
+    Sends a header record (id, grid size, palette), the block-index rows in
+    chunks and a summary record (block counts, preview and schematic URLs),
+    as NDJSON or length-prefixed binary frames (X-Stream-Format: binary; see
+    services/block_stream.py). No preview is encoded up front; previewUrl
+    renders it on first request.
+    """
+    stream_format = (x_stream_format or "ndjson").lower()
+    if stream_format not in STREAM_FORMATS:
+        return JSONResponse(
+            status_code=400,
+            content={"message": f"Unsupported stream format. Choose one of: {', '.join(STREAM_FORMATS)}"}
         )
+    
+    try:
+        grid_size = min(_int_header(x_grid_size, 100, "X-Grid-Size"), MAX_GRID_SIZE)
+        img = _open_upload(image)
+        if is_animated(img):
+            raise ValueError("Animated images are not supported by the streaming endpoint, use /process-image")
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    
+    start_time = time.time()
+    width, height = img.size
+    estimate = get_admission_controller().estimate(width, height, grid_size=grid_size)
+    cost = estimate_cost(width, height, grid_size=grid_size)
+    try:
+        context = await run_in_threadpool(
+            _run_admitted, _client_key(request), cost, estimate, _match_blocks, image, grid_size
+        )
+    except AdmissionRejected as e:
+        return _admission_rejected_response(e)
     except Exception as e:
         print(f"Error processing image: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
+    
+    result_id = str(uuid.uuid4())
+    result = {
+        "id": result_id,
+        "blockIndices": context.index_grid,
+        "gridSize": context.grid_size,
+        "blockCount": context.block_counts(),
+    }
+    await run_in_threadpool(result_store.put, result_id, _build_result_record(result))
+    
+    header = {
+        "id": result_id,
+        "gridSize": result["gridSize"],
+        "palette": [{"name": name, "color": list(map(int, color))}
+                    for name, color in zip(context.palette.names, context.palette.colors)],
+    }
+    summary = {
+        "blockCount": result["blockCount"],
+        "processingTime": round(time.time() - start_time, 2),
+        "previewUrl": f"/results/{result_id}/preview.{DEFAULT_PREVIEW_FORMAT}",
+        "tiles": _tile_metadata(result_id, result["gridSize"]),
+        "schematicUrl": f"/get-schematic/{result_id}",
+    }
+    return StreamingResponse(
+        stream_block_rows(header, context.index_grid, summary, stream_format),
+        media_type=STREAM_FORMATS[stream_format]
+    )
+
+def _match_blocks(image: bytes, grid_size: int):
+    """Run the optimized pipeline up to block matching"""
+    return get_pipeline("optimized").run_context(image, stop_after="match", grid_size=grid_size)
+
+@app.websocket("/ws/process-image")
+async def process_image_websocket(websocket: WebSocket):
+    """
+    Convert an image while pushing progress to the client
+    
+    The client sends a JSON options message ({"gridSize", "previewFormat",
+    "compressLevel", "previewMode", "previewRows"}, all optional) followed by
+    the image as one binary message. The server answers with JSON events:
+    "accepted" with the result id, "stage" as each pipeline stage starts,
+    "progress" with the percent done of the match and render loops, "rows"
+    with finished bands of the preview (unless previewRows is false), and
+    finally "result" (the /process-image response) or "error".
+    
+    Progress travels over the connection that submitted the job, so it works
+    whichever worker the connection lands on.
+    """
+    await websocket.accept()
+    try:
+        options = await websocket.receive_json()
+        image = await websocket.receive_bytes()
+    except WebSocketDisconnect:
+        return
+    except (ValueError, KeyError) as e:
+        await _send_websocket_error(websocket, 400, f"Expected a JSON options message, then the image bytes: {e}")
+        return
+    
+    try:
+        grid_size = min(int(options.get("gridSize", 100)), MAX_GRID_SIZE)
+        preview_format = str(options.get("previewFormat", DEFAULT_PREVIEW_FORMAT)).lower()
+        if preview_format not in PREVIEW_FORMATS:
+            raise ValueError(f"Unsupported preview format. Choose one of: {', '.join(PREVIEW_FORMATS)}")
+        compress_level = int(options.get("compressLevel", DEFAULT_COMPRESS_LEVEL))
+        img = _open_upload(image)
+    except (ValueError, TypeError, AttributeError) as e:
+        await _send_websocket_error(websocket, 400, str(e))
+        return
+    
+    start_time = time.time()
+    result_id = str(uuid.uuid4())
+    
+    # Events are emitted on the conversion thread and sent from the event loop
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    reporter = ProgressReporter(
+        lambda event: loop.call_soon_threadsafe(events.put_nowait, event),
+        preview_rows=bool(options.get("previewRows", True))
+    )
+    
+    try:
+        await websocket.send_json({"type": "accepted", "id": result_id})
+        conversion = asyncio.ensure_future(
+            _convert_upload(
+                _client_key(websocket), image, img, grid_size, preview_format, compress_level, reporter=reporter
+            )
+        )
+        while not conversion.done() or not events.empty():
+            next_event = asyncio.ensure_future(events.get())
+            await asyncio.wait({conversion, next_event}, return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                await websocket.send_json(next_event.result())
+            else:
+                next_event.cancel()
+        
+        try:
+            result = conversion.result()
+        except AdmissionRejected as e:
+            await _send_websocket_error(websocket, e.status_code, str(e), retryAfter=e.retry_after)
+            return
+        except Exception as e:
+            print(f"Error processing image: {str(e)}")
+            await _send_websocket_error(websocket, 500, f"Image processing failed: {str(e)}")
+            return
+        
+        result["id"] = result_id
+        await run_in_threadpool(result_store.put, result_id, _build_result_record(result))
+        inline_preview = str(options.get("previewMode", "inline")).lower() != "url"
+        response = _processed_image_response(result_id, result, inline_preview, time.time() - start_time)
+        await websocket.send_json({"type": "result", **jsonable_encoder(response, exclude_none=True)})
+        await websocket.close()
+    except WebSocketDisconnect:
+        # The client left; the conversion thread finishes on its own
+        return
+
+async def _send_websocket_error(websocket: WebSocket, status_code: int, message: str, **extra) -> None:
+    await websocket.send_json({"type": "error", "status": status_code, "message": message, **extra})
+    await websocket.close()
+
+def _int_header(value: Optional[str], default: int, name: str) -> int:
+    """Parse an integer request header (raises ValueError with the client message)"""
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number")
+
+def _open_upload(image: bytes) -> Image.Image:
+    """Open an uploaded image and check its dimensions (raises ValueError with the client message)"""
+    try:
+        img = Image.open(io.BytesIO(image))
+        width, height = img.size
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {str(e)}")
+    
+    # Check if image is too large
+    if width > MAX_IMAGE_SIZE or height > MAX_IMAGE_SIZE:
+        raise ValueError(f"Image dimensions too large. Maximum size is {MAX_IMAGE_SIZE}x{MAX_IMAGE_SIZE} pixels")
+    
+    # Check if image is empty
+    if width == 0 or height == 0:
+        raise ValueError("Invalid image with zero dimensions")
+    return img
+
+async def _convert_upload(
+    client: str,
+    image: bytes,
+    img: Image.Image,
+    grid_size: int,
+    preview_format: str,
+    compress_level: int,
+    reporter: Optional[ProgressReporter] = None,
+    relief: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Convert an opened upload on the thread pool once it is scheduled and its estimated memory is reserved
+
+    relief holds process_image_to_relief's options for relief mode (still images only).
+    """
+    width, height = img.size
+    animated = is_animated(img)
+    frames = getattr(img, "n_frames", 1) if animated else 1
+    estimate = get_admission_controller().estimate(
+        width, height,
+        grid_size=grid_size,
+        frames=frames,
+        pipeline="relief" if relief is not None else "optimized",
+        preview_format=preview_format
+    )
+    cost = estimate_cost(width, height, grid_size=grid_size, frames=frames)
+    if animated:
+        # Animated inputs become one block grid per frame
+        function, kwargs = process_animation, {"grid_size": grid_size}
+    elif relief is not None:
+        function, kwargs = process_image_to_relief, {
+            "grid_size": grid_size, "preview_format": preview_format, "compress_level": compress_level, **relief
+        }
+    else:
+        function, kwargs = process_image_to_blocks, {
+            "grid_size": grid_size, "preview_format": preview_format, "compress_level": compress_level
+        }
+    
+    # Still images go through a cached pipeline, so duplicates need not be scheduled
+    run = _run_admitted if animated else _run_deduplicated
+    if reporter is None:
+        return await run_in_threadpool(run, client, cost, estimate, function, image, **kwargs)
+    return await run_in_threadpool(_run_reported, reporter, run, client, cost, estimate, function, image, **kwargs)
+
+def _run_reported(
+    reporter: ProgressReporter,
+    run: Callable[..., Dict[str, Any]],
+    client: str,
+    cost: float,
+    estimate: int,
+    function: Callable[..., Dict[str, Any]],
+    *args,
+    **kwargs
+) -> Dict[str, Any]:
+    """run (_run_admitted or _run_deduplicated) with the conversion's progress sent to reporter"""
+    with report_progress(reporter):
+        return run(client, cost, estimate, function, *args, **kwargs)
+
+def _processed_image_response(
+    result_id: str,
+    result: Dict[str, Any],
+    inline_preview: bool,
+    processing_time: float
+) -> ProcessedImageResponse:
+    return ProcessedImageResponse(
+        imageData=result["imageData"] if inline_preview else None,
+        previewUrl=f"/results/{result_id}/preview.{result['imageFormat']}",
+        tiles=_tile_metadata(result_id, result["gridSize"]),
+        animation=_animation_metadata(result_id, result),
+        imageFormat=result.get("imageFormat", "png"),
+        previewStats=result.get("previewStats"),
+        blockCount=result["blockCount"],
+        relief=result.get("relief"),
+        id=result_id,
+        processingTime=round(processing_time, 2),
+        gridSize=result["gridSize"]
+    )
+
+@app.post("/batch")
+async def batch_endpoint(
+    request: Request,
+    images: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    params: Optional[str] = Form(None)
+):
+    """
+    Convert many images in one request
+    
+    Accepts any number of "images" files and/or a zip "archive". The optional
+    "params" field holds per-item parameters (see resolve_item_params). Results
+    are streamed back as NDJSON, one line per image in completion order,
+    followed by a summary line.
+    """
+    named_images = []
+    for position, upload in enumerate(images or []):
+        named_images.append((upload.filename or f"image_{position}", await upload.read()))
+    
+    try:
+        if len(named_images) > MAX_BATCH_ITEMS:
+            raise ValueError(f"Too many images. Maximum batch size is {MAX_BATCH_ITEMS}")
+        if archive is not None:
+            # Extraction stops once the batch would be too large
+            archive_images = expand_archive(await archive.read(), max_images=MAX_BATCH_ITEMS - len(named_images))
+            named_images.extend(archive_images)
+        
+        if not named_images:
+            raise ValueError("No images supplied")
+        
+        item_kwargs = resolve_item_params([name for name, _ in named_images], params)
+        
+        items = []
+        for (name, image_data), kwargs in zip(named_images, item_kwargs):
+            kwargs["grid_size"] = min(int(kwargs.get("grid_size", 100)), MAX_GRID_SIZE)
+            items.append((name, image_data, kwargs))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    
+    # The whole batch is rate limited at once, so it is refused up front
+    # rather than failing item by item once the client's bucket runs dry
+    client = _client_key(request)
+    try:
+        get_scheduler().charge(
+            client, sum(_batch_item_cost(image_data, kwargs["grid_size"]) for _, image_data, kwargs in items),
+            "This batch is larger than this client's rate limit allows right now. "
+            "Please try again later or send fewer images."
+        )
+    except AdmissionRejected as e:
+        return _admission_rejected_response(e)
+    
+    # Build the shared palette before the workers start
+    get_block_palette()
+    
+    # Every item is scheduled as the client that sent the batch
+    process_item = partial(_process_batch_item, client=client)
+    return StreamingResponse(_stream_batch(items, process_item), media_type="application/x-ndjson")
+
+def _batch_item_cost(image_data: bytes, grid_size: int) -> float:
+    """Scheduler cost of a batch image, from its header (0 if it cannot be read; the item fails later)"""
+    try:
+        width, height = Image.open(io.BytesIO(image_data)).size
+    except Exception:
+        return 0.0
+    return estimate_cost(width, height, grid_size=grid_size)
+
+def _process_batch_item(image_data: bytes, client: str, **kwargs) -> Dict[str, Any]:
+    """
+    Validate one batch image and run it through the pipeline once it is scheduled and its memory is reserved
+
+    The batch endpoint already charged the client for every item.
+    """
+    width, height = Image.open(io.BytesIO(image_data)).size
+    if width > MAX_IMAGE_SIZE or height > MAX_IMAGE_SIZE:
+        raise ValueError(f"Image dimensions too large. Maximum size is {MAX_IMAGE_SIZE}x{MAX_IMAGE_SIZE} pixels")
+    preview_format = kwargs.get("preview_format", DEFAULT_PREVIEW_FORMAT)
+    if preview_format not in PREVIEW_FORMATS:
+        raise ValueError(f"Unsupported preview format. Choose one of: {', '.join(PREVIEW_FORMATS)}")
+    estimate = get_admission_controller().estimate(
+        width, height, grid_size=kwargs["grid_size"], preview_format=preview_format
+    )
+    cost = estimate_cost(width, height, grid_size=kwargs["grid_size"])
+    with computation_guard(partial(_admitted, client, cost, estimate, charge=False), refusals=(AdmissionRejected,)):
+        return process_image_to_blocks(image_data, **kwargs)
+
+def _run_admitted(
+    client: str,
+    cost: float,
+    estimate: int,
+    function: Callable[..., Dict[str, Any]],
+    *args,
+    **kwargs
+) -> Dict[str, Any]:
+    """
+    Run a conversion once the client's turn comes and its memory is reserved
+
+    The scheduler orders conversions fairly between clients (and enforces
+    their rate limits); the admission controller then holds back any that
+    would overrun the memory budget.
+    """
+    with _admitted(client, cost, estimate):
+        return function(*args, **kwargs)
+
+def _run_deduplicated(
+    client: str,
+    cost: float,
+    estimate: int,
+    function: Callable[..., Dict[str, Any]],
+    *args,
+    **kwargs
+) -> Dict[str, Any]:
+    """
+    _run_admitted for conversions through Pipeline.run
+
+    The slot and memory are only taken when the pipeline really computes: a
+    request whose result is cached, or that waits for an identical request
+    already converting, holds neither (and is not charged) while it waits.
+    """
+    with computation_guard(partial(_admitted, client, cost, estimate), refusals=(AdmissionRejected,)):
+        return function(*args, **kwargs)
+
+@contextmanager
+def _admitted(client: str, cost: float, estimate: int, charge: bool = True) -> Iterator[None]:
+    """Hold a scheduler slot and a memory reservation (charge=False if the client was charged up front)"""
+    with get_scheduler().schedule(client, cost, charge=charge), get_admission_controller().admit(estimate):
+        yield
+
+def _client_key(connection: HTTPConnection) -> str:
+    """Scheduling and rate limit key of a request or WebSocket's client"""
+    return get_scheduler().client_key(connection.headers, connection.client.host if connection.client else None)
+
+def _admission_rejected_response(error: AdmissionRejected) -> JSONResponse:
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else None
+    return JSONResponse(status_code=error.status_code, content={"message": str(error)}, headers=headers)
+
+def _stream_batch(items: List[Tuple[str, bytes, Dict[str, Any]]], process_item: Callable[..., Dict[str, Any]]):
+    """Yield NDJSON lines for a batch as its items complete"""
+    start_time = time.time()
+    succeeded = 0
+    
+    for outcome in run_batch(items, process_item):
+        line = {
+            "index": outcome["index"],
+            "name": outcome["name"],
+            "status": outcome["status"],
+            "processingTime": outcome["processingTime"]
+        }
+        if outcome["status"] == "ok":
+            result = outcome["result"]
+            result_id = str(uuid.uuid4())
+            result["id"] = result_id
+            result_store.put(result_id, _build_result_record(result))
+            line.update({
+                "id": result_id,
+                "blockCount": result["blockCount"],
+                "gridSize": result["gridSize"],
+                "previewUrl": f"/results/{result_id}/preview.{result['imageFormat']}"
+            })
+            succeeded += 1
+        else:
+            line["error"] = outcome["error"]
+        yield json.dumps(line) + "\n"
+    
+    elapsed = time.time() - start_time
+    yield json.dumps({
+        "summary": {
+            "items": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded,
+            "elapsed": round(elapsed, 3),
+            "imagesPerSecond": round(len(items) / elapsed, 2) if elapsed > 0 else None
+        }
+    }) + "\n"
 
 @app.get("/get-schematic/{image_id}")
-async def get_schematic_endpoint(image_id: str):
-    """Generate and return a schematic file for the processed image"""
-    if image_id not in processed_results:
+def get_schematic_endpoint(image_id: str, frame: int = 0):
+    """Generate and return a schematic file for the processed image (or one animation frame)"""
+    result = result_store.get(image_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Image not found")
     
+    frame_count = len(result["frames"]) if result.get("frames") is not None else 1
+    if not 0 <= frame < frame_count:
+        raise HTTPException(status_code=404, detail="Frame not found")
+    
     try:
         from services.schematic_generator import create_schematic_file
         
-        # Get the processed image data
-        result = processed_results[image_id]
-        
         # Create the schematic file
-        schematic_data = create_schematic_file(result)
+        schematic_data = create_schematic_file(result, frame=frame)
         
         # Return the schematic file
+        filename = f"minecraft_art_{image_id}" + (f"_frame{frame}" if frame_count > 1 else "")
         return Response(
             content=schematic_data,
             media_type="application/octet-stream",
-            headers={"Content-Disposition": f"attachment; filename=minecraft_art_{image_id}.schematic"}
+            headers={"Content-Disposition": f"attachment; filename={filename}.schem"}
         )
     except Exception as e:
         print(f"Error generating schematic: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to generate schematic file")
 
-def cleanup_old_results():
-    """Clean up old results to prevent memory leaks"""
-    global processed_results
-    
-    # Keep only the 20 most recent results
-    if len(processed_results) > 20:
-        # Sort by timestamp and keep the newest 20
-        sorted_results = sorted(
-            processed_results.items(), 
-            key=lambda x: x[1].get("timestamp", 0), 
-            reverse=True
-        )
-        processed_results = dict(sorted_results[:20])
+@app.get("/results/{result_id}")
+def get_result_endpoint(result_id: str):
+    """Return the metadata of a stored result"""
+    result = _get_result_or_404(result_id)
+    return {
+        "id": result_id,
+        "blockCount": result["blockCount"],
+        "gridSize": result["gridSize"],
+        "previewUrl": f"/results/{result_id}/preview.{result['imageFormat']}",
+        "tiles": _tile_metadata(result_id, result["gridSize"]),
+        "animation": _animation_metadata(result_id, result),
+        "relief": _relief_metadata(result)
+    }
+
+@app.get("/results/{result_id}/materials")
+def get_materials_endpoint(result_id: str, subtotals: str = "none", frame: int = 0):
+    """Return the build materials list of a stored result (or one animation frame)"""
+    result = _get_result_or_404(result_id)
+    if subtotals not in SUBTOTALS:
+        raise HTTPException(status_code=400, detail=f"Unsupported subtotals. Choose one of: {', '.join(SUBTOTALS)}")
+    try:
+        return _record_materials(result, subtotals, frame)
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Frame not found")
+
+@app.get("/results/{result_id}/preview.{image_format}")
+def get_preview_endpoint(result_id: str, image_format: str, request: Request):
+    """Return the full preview image as raw bytes"""
+    result = _get_result_or_404(result_id)
+    if image_format not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=404, detail="Unsupported preview format")
+    
+    previews = result["previews"]
+    if image_format not in previews:
+        CACHE_REQUESTS.inc(cache="previews", result="miss")
+        # Encode other formats lazily from the stored index grid
+        with stage("render"):
+            index_image = render_index_preview(
+                result["indexGrid"], result["outputScale"], result["gridLineIndex"]
+            )
+        with stage("encode"):
+            previews[image_format] = _with_etag(encode_preview(index_image, result["palette"], image_format))
+        result_store.put_preview(result_id, image_format, previews[image_format])
+    else:
+        CACHE_REQUESTS.inc(cache="previews", result="hit")
+    
+    return _binary_response(request, previews[image_format], PREVIEW_FORMATS[image_format])
+
+@app.get("/results/{result_id}/animation.gif")
+def get_animation_endpoint(result_id: str, request: Request):
+    """Return the animated block preview of an animated result"""
+    result = _get_result_or_404(result_id)
+    if result.get("frames") is None:
+        raise HTTPException(status_code=404, detail="Result is not animated")
+    
+    previews = result["previews"]
+    if "gif" not in previews:
+        CACHE_REQUESTS.inc(cache="previews", result="miss")
+        with stage("encode"):
+            previews["gif"] = _with_etag(render_animation_preview(result))
+        result_store.put_preview(result_id, "gif", previews["gif"])
+    else:
+        CACHE_REQUESTS.inc(cache="previews", result="hit")
+    
+    return _binary_response(request, previews["gif"], "image/gif")
+
+@app.get("/results/{result_id}/tiles/{z}/{x}/{y}.png")
+def get_tile_endpoint(result_id: str, z: int, x: int, y: int, request: Request):
+    """Return one tile of the preview pyramid, rendering it on first request"""
+    result = _get_result_or_404(result_id)
+    
+    # Tiles are cached per process only, in a bounded LRU shared by every result
+    key = (result_id, z, x, y)
+    tile = tile_cache.get(key)
+    if tile is None:
+        CACHE_REQUESTS.inc(cache="tiles", result="miss")
+        try:
+            with stage("render"):
+                tile = _with_etag(render_tile(result["indexGrid"], result["palette"], z, x, y))
+        except IndexError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        tile_cache.put(key, tile)
+    else:
+        CACHE_REQUESTS.inc(cache="tiles", result="hit")
+    
+    return _binary_response(request, tile, "image/png")
+
+def _build_result_record(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a pipeline result into the compact record kept in the result store"""
+    palette = get_block_palette()
+    output_scale = result.get("outputScale", 4)
+    image_format = result.get("imageFormat", "png")
+    
+    return {
+        "id": result["id"],
+        "indexGrid": np.asarray(result["blockIndices"], dtype=np.uint8),
+        "palette": palette.preview_colors,
+        "blockNames": palette.names,
+        "gridLineIndex": palette.grid_line_index if output_scale > 3 else None,
+        "outputScale": output_scale,
+        "gridSize": result["gridSize"],
+        "blockCount": result["blockCount"],
+        "imageFormat": image_format,
+        "timestamp": time.time(),
+        # Encoded previews, filled in lazily as they are requested
+        "previews": {image_format: _with_etag(base64.b64decode(result["imageData"]))} if "imageData" in result else {},
+        # Animated results keep every frame's index grid
+        "frames": result.get("frames"),
+        "durations": result.get("durations"),
+        "frameBlockCounts": result.get("frameBlockCounts"),
+        "rematchedRatio": result.get("rematchedRatio"),
+        # Relief results keep their column heights; the schematic is built from them
+        "reliefHeights": result.get("reliefHeights"),
+        "reliefFiller": (result.get("relief") or {}).get("filler")
+    }
+
+def _record_grid(result: Dict[str, Any], frame: int = 0) -> BlockGrid:
+    """The block grid of a stored result (or of one of its animation frames)"""
+    names = result["blockNames"]
+    frames = result.get("frames")
+    index_grid = frames[frame] if frames is not None else result["indexGrid"]
+    # The stored preview palette has the grid line colour after the blocks
+    return BlockGrid(index_grid, GridPalette(names, result["palette"][:len(names)]))
+
+def _record_materials(result: Dict[str, Any], subtotals: str, frame: int = 0) -> Dict[str, Any]:
+    """The materials report of a stored result; relief results count their whole columns"""
+    grid = _record_grid(result, frame)
+    volume = relief_volume(result) if result.get("reliefHeights") is not None else None
+    return materials_report(grid, subtotals, volume=volume)
+
+def _get_result_or_404(result_id: str) -> Dict[str, Any]:
+    result = result_store.get(result_id)
+    CACHE_REQUESTS.inc(cache="result_store", result="miss" if result is None else "hit")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return result
+
+def _tile_metadata(result_id: str, grid_size: Dict[str, int]) -> Dict[str, Any]:
+    layout = tile_layout(grid_size["width"], grid_size["height"])
+    layout["url"] = f"/results/{result_id}/tiles/{{z}}/{{x}}/{{y}}.png"
+    return layout
+
+def _animation_metadata(result_id: str, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if result.get("frames") is None:
+        return None
+    return {
+        "frameCount": len(result["frames"]),
+        "durations": result["durations"],
+        "frameBlockCounts": result["frameBlockCounts"],
+        "rematchedRatio": result["rematchedRatio"],
+        "previewUrl": f"/results/{result_id}/animation.gif",
+        "schematicUrl": f"/get-schematic/{result_id}?frame={{frame}}"
+    }
+
+def _relief_metadata(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if result.get("reliefHeights") is None:
+        return None
+    return relief_summary(result["reliefHeights"], result["reliefFiller"])
+
+def _with_etag(content: bytes) -> Tuple[bytes, str]:
+    return content, f'"{hashlib.md5(content).hexdigest()}"'
+
+def _binary_response(request: Request, entry: Tuple[bytes, str], media_type: str) -> Response:
+    """Serve cached bytes with validators, answering conditional requests with 304"""
+    content, etag = entry
+    headers = {"ETag": etag, "Cache-Control": RESULT_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
 
 # Health check endpoint
 @app.get("/health")
@@ -154,9 +853,35 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": time.time(),
-        "cached_results": len(processed_results)
+        "cached_results": len(result_store),
+        "warmup": warm_up.state
     }
 
+@app.post("/warmup")
+def warmup_endpoint():
+    """Finish warming up now and report how long each step took"""
+    return warm_up.run()
+
+@app.get("/admission")
+async def admission_status_endpoint():
+    """Memory budget, reservations and estimator calibration, plus the fair scheduler's state"""
+    return {**get_admission_controller().status(), "scheduler": get_scheduler().status()}
+
+@app.get("/profiles/{profile_id}")
+async def get_profile_endpoint(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    """Return the profile report of a request run with X-Profile; X-Profile-Token must carry the profiling token"""
+    if PROFILING_ENABLED and not profile_token_valid(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+    profile = load_profile(profile_id) if PROFILING_ENABLED else None
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics: request and stage latency, cache hit rates, batch queue"""
+    return metrics_response()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5000)
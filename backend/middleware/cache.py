@@ -2,10 +2,14 @@ import hashlib
 import os
 import json
 import time
-from typing import Dict, Any, Callable, Optional
+from typing import Dict, Any, Callable, Optional, Tuple, Type
 import functools
 from pathlib import Path
 
+from services.block_grid import json_default, json_object_hook
+from services.metrics import CACHE_REQUESTS
+from services.single_flight import SingleFlight
+
 class ImageProcessingCache:
     """
     Simple file-based cache for image processing results
@@ -23,6 +27,8 @@ class ImageProcessingCache:
         self.cache_dir.mkdir(exist_ok=True, parents=True)
         self.max_age = max_age
         self.max_size = max_size
+        # Concurrent misses for the same key compute once, across threads and workers
+        self.flights = SingleFlight(str(self.cache_dir / "flights"))
         self._cleanup_old_entries()
     
     def _generate_key(self, image_data: bytes, params: Dict[str, Any]) -> str:
@@ -66,11 +72,52 @@ class ImageProcessingCache:
                 return None
             
             with open(cache_file, 'r') as f:
-                return json.load(f)
+                return json.load(f, object_hook=json_object_hook)
         except Exception as e:
             print(f"Cache error: {e}")
             return None
     
+    def get_or_compute(
+        self,
+        image_data: bytes,
+        params: Dict[str, Any],
+        compute: Callable[[], Dict[str, Any]],
+        retry_on: Tuple[Type[BaseException], ...] = ()
+    ) -> Dict[str, Any]:
+        """
+        Get an item from the cache, computing and storing it on a miss
+        
+        Identical requests that miss at the same time share one computation:
+        threads wait for the first, and other workers wait for its cache entry.
+        
+        Args:
+            image_data: Raw image data
+            params: Processing parameters
+            compute: Produces the result on a miss
+            retry_on: Errors of one caller's compute that other waiting
+                callers retry instead of sharing (see SingleFlight.do)
+            
+        Returns:
+            Cached or computed result
+        """
+        cached_result = self.get(image_data, params)
+        if cached_result:
+            CACHE_REQUESTS.inc(cache="results", result="hit")
+            return cached_result
+        CACHE_REQUESTS.inc(cache="results", result="miss")
+        
+        def compute_and_store() -> Dict[str, Any]:
+            result = compute()
+            self.set(image_data, params, result)
+            return result
+        
+        return self.flights.do(
+            self._generate_key(image_data, params),
+            compute_and_store,
+            reuse=lambda: self.get(image_data, params),
+            retry_on=retry_on
+        )
+    
     def set(self, image_data: bytes, params: Dict[str, Any], result: Dict[str, Any]) -> None:
         """
         Store an item in the cache
@@ -85,7 +132,8 @@ class ImageProcessingCache:
         
         try:
             with open(cache_file, 'w') as f:
-                json.dump(result, f)
+                # BlockGrid values are stored as compressed index bytes
+                json.dump(result, f, default=json_default)
             
             # Update the access time
             os.utime(cache_file, None)
@@ -96,9 +144,9 @@ class ImageProcessingCache:
         self._enforce_size_limit()
     
     def _cleanup_old_entries(self) -> None:
-        """Remove expired cache entries"""
+        """Remove expired cache entries and single-flight lock files"""
         current_time = time.time()
-        for cache_file in self.cache_dir.glob("*.json"):
+        for cache_file in [*self.cache_dir.glob("*.json"), *self.cache_dir.glob("flights/*.lock")]:
             try:
                 mtime = cache_file.stat().st_mtime
                 if current_time - mtime > self.max_age:
@@ -131,13 +179,6 @@ def cached_image_processing(f: Callable):
     @functools.wraps(f)
     def wrapper(image_data: bytes, *args, **kwargs):
         params = {'args': args, 'kwargs': kwargs}
-        cached_result = cache.get(image_data, params)
-        
-        if cached_result:
-            return cached_result
-            
-        result = f(image_data, *args, **kwargs)
-        cache.set(image_data, params, result)
-        return result
+        return cache.get_or_compute(image_data, params, lambda: f(image_data, *args, **kwargs))
         
     return wrapper
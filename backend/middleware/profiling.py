@@ -0,0 +1,237 @@
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+from fastapi import Request
+
+# Secret the X-Profile header (and X-Profile-Token when fetching reports) must carry
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN") or None
+# Operator switch: the middleware is only installed when this is set, and
+# only together with a token, since reports expose source paths and allocation sites
+PROFILING_ENABLED = os.environ.get("ENABLE_PROFILING", "").lower() in ("1", "true", "yes")
+if PROFILING_ENABLED and PROFILING_TOKEN is None:
+    print("ENABLE_PROFILING is set without PROFILING_TOKEN; request profiling stays off")
+    PROFILING_ENABLED = False
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", "temp/profiles"))
+
+# Frames from this directory (outside installed packages) count as application code
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 15
+# Call tree nodes with fewer samples than this fraction of the total are pruned
+CALL_TREE_MIN_FRACTION = 0.01
+
+# Only one request is profiled at a time; the sampler sees every thread
+_profile_lock = threading.Lock()
+
+def _frame_name(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(APP_ROOT):
+        filename = os.path.relpath(filename, APP_ROOT)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def _is_app_frame(filename: str) -> bool:
+    return filename.startswith(APP_ROOT) and "site-packages" not in filename and filename != __file__
+
+class StackSampler:
+    """
+    Sampling profiler that periodically records the stacks of busy threads
+
+    A thread is sampled only while it is running application code, so idle
+    event loop and thread pool workers don't show up. Sampling every thread
+    (rather than tracing one) also captures work that FastAPI hands to its
+    thread pool.
+    """
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+
+                # Start the stack at the first application frame, dropping server internals
+                first_app_frame = next(
+                    (position for position, code in enumerate(stack) if _is_app_frame(code.co_filename)),
+                    None
+                )
+                if first_app_frame is None:
+                    continue
+                self.stacks[tuple(_frame_name(code) for code in stack[first_app_frame:])] += 1
+                self.samples += 1
+
+    def top_functions(self, limit: int = TOP_FUNCTIONS) -> List[Dict[str, Any]]:
+        """Functions ranked by cumulative (inclusive) time"""
+        cumulative: Counter = Counter()
+        own: Counter = Counter()
+        for stack, count in self.stacks.items():
+            for name in set(stack):
+                cumulative[name] += count
+            own[stack[-1]] += count
+
+        interval_ms = self.interval * 1000
+        return [
+            {
+                "function": name,
+                "samples": count,
+                "cumulativeMs": round(count * interval_ms, 1),
+                "selfMs": round(own[name] * interval_ms, 1),
+            }
+            for name, count in cumulative.most_common(limit)
+        ]
+
+    def call_tree(self) -> Dict[str, Any]:
+        """Sampled stacks merged into a tree, pruned of rarely seen branches"""
+        root: Dict[str, Any] = {"function": "<request>", "samples": 0, "children": {}}
+        for stack, count in self.stacks.items():
+            root["samples"] += count
+            node = root
+            for name in stack:
+                node = node["children"].setdefault(name, {"function": name, "samples": 0, "children": {}})
+                node["samples"] += count
+
+        min_samples = max(1, int(root["samples"] * CALL_TREE_MIN_FRACTION))
+
+        def prune(node: Dict[str, Any]) -> Dict[str, Any]:
+            children = sorted(node["children"].values(), key=lambda child: -child["samples"])
+            return {
+                "function": node["function"],
+                "samples": node["samples"],
+                "children": [prune(child) for child in children if child["samples"] >= min_samples],
+            }
+
+        return prune(root)
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format read by flame graph tools"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.items())
+
+def _allocation_summary(snapshot: tracemalloc.Snapshot, peak: int) -> Dict[str, Any]:
+    statistics = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ]).statistics("lineno")
+    return {
+        "peakKb": round(peak / 1024, 1),
+        "retainedKb": round(sum(stat.size for stat in statistics) / 1024, 1),
+        "top": [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "sizeKb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            for stat in statistics[:TOP_ALLOCATIONS]
+        ],
+    }
+
+def profile_token_valid(value: Optional[str]) -> bool:
+    """Whether a header value is the configured profiling token (never true without one)"""
+    if not PROFILING_TOKEN or not value:
+        return False
+    return hmac.compare_digest(value.encode(), PROFILING_TOKEN.encode())
+
+def _profile_requested(request: Request) -> bool:
+    return profile_token_valid(request.headers.get("x-profile"))
+
+def load_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    """Read back a stored profile report, or None if there is none"""
+    try:
+        # Only accept ids we generate, never paths
+        profile_id = str(uuid.UUID(profile_id))
+    except ValueError:
+        return None
+    path = PROFILE_DIR / f"{profile_id}.json"
+    if not path.is_file():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+async def profiling_middleware(request: Request, call_next):
+    """
+    Profile a request when the operator asks for it with the X-Profile header,
+    which must carry PROFILING_TOKEN
+
+    The report (top functions, call tree, allocation summary) is written to
+    PROFILE_DIR under the request id, which is returned in X-Profile-Id; a
+    collapsed-stack file for flame graphs is written next to it.
+    """
+    if not _profile_requested(request):
+        return await call_next(request)
+
+    if not _profile_lock.acquire(blocking=False):
+        response = await call_next(request)
+        response.headers["X-Profile-Status"] = "busy"
+        return response
+
+    profile_id = str(uuid.uuid4())
+    try:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        sampler = StackSampler()
+
+        start_time = time.perf_counter()
+        sampler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            sampler.stop()
+            wall_time = time.perf_counter() - start_time
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+
+        report = {
+            "requestId": profile_id,
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "wallMs": round(wall_time * 1000, 1),
+            "samples": sampler.samples,
+            "sampleIntervalMs": sampler.interval * 1000,
+            "topFunctions": sampler.top_functions(),
+            "callTree": sampler.call_tree(),
+            "allocations": _allocation_summary(snapshot, peak),
+        }
+
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(PROFILE_DIR / f"{profile_id}.json", "w") as f:
+            json.dump(report, f)
+        with open(PROFILE_DIR / f"{profile_id}.collapsed", "w") as f:
+            f.write(sampler.collapsed())
+    finally:
+        _profile_lock.release()
+
+    response.headers["X-Profile-Id"] = profile_id
+    return response
@@ -0,0 +1,59 @@
+import time
+from typing import Dict
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from services.metrics import registry, observe_stages, REQUEST_LATENCY, REQUESTS_IN_PROGRESS
+from services.stage_timer import collect_stage_timings
+
+# Content type of the Prometheus text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def server_timing_header(stages: Dict[str, float], total: float) -> str:
+    """
+    Format stage timings for the Server-Timing response header
+
+    Args:
+        stages: Seconds spent per stage
+        total: Seconds spent handling the whole request
+
+    Returns:
+        Header value such as "decode;dur=1.2, match;dur=8.4, total;dur=15.0"
+    """
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def _route_label(request: Request) -> str:
+    # The route template keeps ids out of the labels, e.g. /results/{result_id}
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+async def timing_middleware(request: Request, call_next):
+    """
+    Time every request by pipeline stage
+
+    Adds a Server-Timing header with the per-stage breakdown and records the
+    request and stage latencies for /metrics.
+    """
+    start_time = time.perf_counter()
+    REQUESTS_IN_PROGRESS.inc()
+    status = "500"
+    try:
+        with collect_stage_timings() as timings:
+            response = await call_next(request)
+        status = str(response.status_code)
+    finally:
+        REQUESTS_IN_PROGRESS.dec()
+        elapsed = time.perf_counter() - start_time
+        REQUEST_LATENCY.observe(elapsed, method=request.method, route=_route_label(request), status=status)
+
+    if timings.stages:
+        observe_stages(timings.stages)
+    response.headers["Server-Timing"] = server_timing_header(timings.stages, elapsed)
+    return response
+
+def metrics_response() -> Response:
+    """Current metrics in Prometheus text format"""
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Dict, List, Any, Optional
 
 class BlockPosition(BaseModel):
@@ -10,9 +10,22 @@ class GridSize(BaseModel):
     height: int
 
 class ProcessedImageResponse(BaseModel):
-    imageData: str  # Base64 encoded image
+    imageData: Optional[str] = None  # Base64 encoded image (omitted when previewUrl is used)
+    imageFormat: Optional[str] = "png"  # Encoding of imageData ("png" or "webp")
+    previewStats: Optional[Dict[str, float]] = None  # Encoded preview size and encode time
     blockCount: Dict[str, int]  # Count of each Minecraft block used
     id: Optional[str] = None  # Unique ID for the processed image
     processingTime: Optional[float] = None  # Time taken to process in seconds
     gridSize: Optional[GridSize] = None  # Grid dimensions
+    previewUrl: Optional[str] = None  # URL of the preview as a binary resource
+    tiles: Optional[Dict[str, Any]] = None  # Tile pyramid layout and URL template
+    animation: Optional[Dict[str, Any]] = None  # Frame metadata for animated inputs
+    materials: Optional[Dict[str, Any]] = None  # Build materials list (X-Materials)
+    relief: Optional[Dict[str, Any]] = None  # Relief size and filler (X-Relief-Height)
     blockGrid: Optional[List[List[BlockPosition]]] = None  # 2D grid of blocks
+
+    @field_validator("blockGrid", mode="before")
+    @classmethod
+    def expand_block_grid(cls, value: Any) -> Any:
+        """Accept a services.block_grid.BlockGrid, expanding it to rows of blocks"""
+        return value.to_legacy() if hasattr(value, "to_legacy") else value
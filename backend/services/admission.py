@@ -0,0 +1,392 @@
+"""
+Memory-aware admission control for conversion requests
+
+Every conversion reserves its estimated peak memory from a per-process
+budget before it starts. Requests that fit are admitted straight away,
+others wait in a FIFO queue until enough memory is released, and requests
+that could never fit (or find the queue full) are rejected with a clear
+error instead of risking an out-of-memory kill.
+
+The estimate comes from the image header (dimensions and frame count) and
+the request parameters, so nothing is decoded before admission. Requests
+that run alone are sampled: their actual peak (the rise in the process's
+resident set high-water mark) is measured and compared with the estimate,
+and the observed ratios calibrate later estimates and are reported by
+status().
+"""
+import ctypes
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+from services.metrics import registry
+
+MB = 1024 * 1024
+
+def _default_budget_mb() -> int:
+    """Half the machine's memory, shared between the worker processes"""
+    try:
+        total = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 1024
+    workers = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+    return max(256, int(total / 2 / workers / MB))
+
+# Memory available to conversions in this process
+MEMORY_BUDGET_MB = int(os.environ.get("MEMORY_BUDGET_MB", _default_budget_mb()))
+
+# Requests allowed to wait for memory, and how long each may wait
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "16"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+# Scale estimates by the observed peak/estimate ratio once enough samples exist
+ADMISSION_CALIBRATE = os.environ.get("ADMISSION_CALIBRATE", "1").lower() not in ("0", "false", "no", "off")
+CALIBRATION_MIN_SAMPLES = 20
+CALIBRATION_QUANTILE = 0.9
+CALIBRATION_LIMITS = (0.5, 4.0)
+# The first conversions in a process also pay one-off import and lookup table costs
+CALIBRATION_SKIP_FIRST = 2
+# Once calibrated, measure one solo conversion in this many (resetting the
+# peak trims the heap, which the next conversion pays for), and stop when
+# the sample window is full
+CALIBRATION_SAMPLE_EVERY = max(1, int(os.environ.get("ADMISSION_SAMPLE_EVERY", "10")))
+CALIBRATION_MAX_SAMPLES = 200
+
+# Bytes per unit of work, fitted with benchmarks/memory_model.py and rounded up
+MEMORY_MODEL = {
+    # Working set of any conversion
+    "fixed": 4 * MB,
+    # Decoded source (4 bytes per pixel) plus a mode-converted copy, and for
+    # linear-light resizing a float32 linear copy and alpha channel
+    "source_pixel": {"optimized": 24, "lab": 24, "relief": 24, "legacy": 8, "textured": 8},
+    # Per grid cell: float pixel copies, clustering and matching arrays
+    # (relief adds its float lightness, heights and column runs)
+    "cell": {"optimized": 64, "lab": 48, "relief": 64, "legacy": 96, "textured": 32},
+    # Per preview pixel: index image and encoder buffers (WebP expands to RGB)
+    "preview_pixel": {"png": 2, "webp": 8},
+    # Per cell of every extra animation frame kept for the result
+    "frame_cell": 16,
+}
+
+ADMISSION_REQUESTS = registry.counter(
+    "mcimage_admission_total", "Admission decisions by outcome", ("outcome",)
+)
+MEMORY_BUDGET = registry.gauge(
+    "mcimage_memory_budget_bytes", "Memory budget for conversions"
+)
+MEMORY_RESERVED = registry.gauge(
+    "mcimage_memory_reserved_bytes", "Estimated memory reserved by running conversions"
+)
+ADMISSION_QUEUE_DEPTH = registry.gauge(
+    "mcimage_admission_queue_depth", "Conversions waiting for memory"
+)
+MEMORY_ESTIMATE_RATIO = registry.histogram(
+    "mcimage_memory_peak_to_estimate_ratio", "Measured peak memory divided by the uncalibrated estimate",
+    buckets=(0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0, 4.0)
+)
+
+class AdmissionRejected(Exception):
+    """
+    A request that cannot be admitted
+
+    Attributes:
+        status_code: HTTP status to answer with (413 never fits, 503 busy)
+        retry_after: Seconds the client should wait before retrying, if busy
+    """
+    def __init__(self, message: str, status_code: int, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def grid_dimensions(width: int, height: int, grid_size: int) -> Tuple[int, int]:
+    """Block grid size an image is resized to (as the fit_lanczos resize stage does)"""
+    scale_factor = min(grid_size / width, grid_size / height)
+    return max(1, int(width * scale_factor)), max(1, int(height * scale_factor))
+
+def estimate_peak_bytes(
+    width: int,
+    height: int,
+    grid_size: int = 100,
+    frames: int = 1,
+    pipeline: str = "optimized",
+    output_scale: int = 4,
+    preview_format: str = "png"
+) -> int:
+    """
+    Estimate the peak memory of converting an image, from its header alone
+
+    Args:
+        width: Source width in pixels
+        height: Source height in pixels
+        grid_size: Maximum grid size in blocks
+        frames: Number of animation frames (frames are converted one at a time)
+        pipeline: Pipeline name, selects the per-pixel and per-cell costs
+        output_scale: Preview pixels per block
+        preview_format: Preview encoding
+
+    Returns:
+        Estimated peak bytes above the idle process
+    """
+    grid_width, grid_height = grid_dimensions(width, height, grid_size)
+    cells = grid_width * grid_height
+    source_cost = MEMORY_MODEL["source_pixel"].get(pipeline, max(MEMORY_MODEL["source_pixel"].values()))
+    cell_cost = MEMORY_MODEL["cell"].get(pipeline, max(MEMORY_MODEL["cell"].values()))
+    preview_cost = MEMORY_MODEL["preview_pixel"].get(preview_format, max(MEMORY_MODEL["preview_pixel"].values()))
+
+    return int(
+        MEMORY_MODEL["fixed"]
+        + width * height * source_cost
+        + cells * cell_cost
+        + cells * output_scale * output_scale * preview_cost
+        + (frames - 1) * cells * MEMORY_MODEL["frame_cell"]
+    )
+
+def _read_status_kb(*fields: str) -> Optional[Dict[str, int]]:
+    """Selected fields of /proc/self/status in kB, or None off Linux"""
+    try:
+        with open("/proc/self/status") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in fields:
+            values[name] = int(value.split()[0])
+    return values if len(values) == len(fields) else None
+
+def _malloc_trim() -> None:
+    """Return free heap memory to the OS (glibc), so reused memory shows up in the RSS peak"""
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL("libc.so.6")
+            _libc.malloc_trim
+        except (OSError, AttributeError):
+            _libc = False
+    if _libc:
+        _libc.malloc_trim(0)
+
+_libc: Any = None
+
+def _reset_peak_rss() -> Optional[int]:
+    """
+    Reset the resident set high-water mark
+
+    Freed memory the allocator keeps would be reused without raising the
+    peak, so it is released first.
+
+    Returns:
+        The current RSS in bytes, or None if unsupported (non-Linux)
+    """
+    _malloc_trim()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+    status = _read_status_kb("VmRSS")
+    return status["VmRSS"] * 1024 if status else None
+
+class AdmissionController:
+    """
+    Reserves estimated memory for conversions against a fixed budget
+    """
+    def __init__(
+        self,
+        budget_bytes: int,
+        max_queue: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        calibrate: bool = ADMISSION_CALIBRATE
+    ):
+        """
+        Initialize the controller
+
+        Args:
+            budget_bytes: Memory conversions may reserve in total
+            max_queue: Requests allowed to wait for memory
+            queue_timeout: Seconds a request may wait before it is rejected
+            calibrate: Scale estimates by the measured peak/estimate ratio
+        """
+        self.budget = budget_bytes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.calibrate = calibrate
+        self.reserved = 0
+        self.in_flight = 0
+        self._queue: Deque[object] = deque()
+        self._condition = threading.Condition()
+        # (uncalibrated estimate, measured peak) of requests that ran alone
+        self.samples: Deque[Tuple[int, int]] = deque(maxlen=CALIBRATION_MAX_SAMPLES)
+        self._measuring: Optional[Dict[str, Any]] = None
+        self._measured = 0
+        self._solo = 0
+        MEMORY_BUDGET.set(budget_bytes)
+
+    @property
+    def correction(self) -> float:
+        """Factor applied to raw estimates, from the measured peaks"""
+        if not self.calibrate or len(self.samples) < CALIBRATION_MIN_SAMPLES:
+            return 1.0
+        ratios = [peak / estimate for estimate, peak in self.samples]
+        low, high = CALIBRATION_LIMITS
+        return float(min(high, max(low, np.quantile(ratios, CALIBRATION_QUANTILE))))
+
+    def estimate(self, width: int, height: int, **params) -> int:
+        """Calibrated peak memory estimate; see estimate_peak_bytes for the arguments"""
+        return int(estimate_peak_bytes(width, height, **params) * self.correction)
+
+    def _fits(self, request_bytes: int) -> bool:
+        # A request alone is always admitted if it fits the budget at all
+        return self.in_flight == 0 or self.reserved + request_bytes <= self.budget
+
+    @contextmanager
+    def admit(self, estimate_bytes: int) -> Iterator[None]:
+        """
+        Hold a memory reservation while the block runs, waiting for one if needed
+
+        Args:
+            estimate_bytes: Calibrated estimate from estimate()
+
+        Raises:
+            AdmissionRejected: If the request can never fit, the queue is
+                full, or no memory was released within the queue timeout
+        """
+        if estimate_bytes > self.budget:
+            ADMISSION_REQUESTS.inc(outcome="too_large")
+            raise AdmissionRejected(
+                f"This image needs an estimated {estimate_bytes / MB:.0f} MB to convert, more than the "
+                f"{self.budget / MB:.0f} MB processing budget. Use a smaller image or grid size.",
+                status_code=413
+            )
+
+        raw_estimate = estimate_bytes / self.correction
+        with self._condition:
+            if self._queue or not self._fits(estimate_bytes):
+                self._wait_for_memory(estimate_bytes)
+            else:
+                ADMISSION_REQUESTS.inc(outcome="admitted")
+
+            self.reserved += estimate_bytes
+            self.in_flight += 1
+            MEMORY_RESERVED.set(self.reserved)
+            measurement = self._claim_measurement(raw_estimate)
+
+        # Trimming the heap and resetting the peak take milliseconds, so never under the lock
+        if measurement is not None:
+            measurement["baseline"] = _reset_peak_rss()
+
+        try:
+            yield
+        finally:
+            peak = _read_status_kb("VmHWM") if measurement is not None else None
+            with self._condition:
+                self._finish_measurement(measurement, peak)
+                self.reserved -= estimate_bytes
+                self.in_flight -= 1
+                MEMORY_RESERVED.set(self.reserved)
+                self._condition.notify_all()
+
+    def _wait_for_memory(self, estimate_bytes: int) -> None:
+        """Queue until this request is first in line and fits (called with the lock held)"""
+        if len(self._queue) >= self.max_queue:
+            ADMISSION_REQUESTS.inc(outcome="queue_full")
+            raise AdmissionRejected(
+                "The server is busy converting other images. Please try again shortly.",
+                status_code=503, retry_after=max(1, int(self.queue_timeout / 4))
+            )
+
+        ticket = object()
+        self._queue.append(ticket)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while self._queue[0] is not ticket or not self._fits(estimate_bytes):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    ADMISSION_REQUESTS.inc(outcome="timeout")
+                    raise AdmissionRejected(
+                        "The server is busy converting other images. Please try again shortly.",
+                        status_code=503, retry_after=max(1, int(self.queue_timeout / 4))
+                    )
+                self._condition.wait(remaining)
+        finally:
+            self._queue.remove(ticket)
+            ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+            # The next request in line may fit now
+            self._condition.notify_all()
+        ADMISSION_REQUESTS.inc(outcome="queued")
+
+    def _claim_measurement(self, raw_estimate: float) -> Optional[Dict[str, Any]]:
+        """
+        Decide whether to measure this request's peak (called with the lock held)
+
+        Only requests running alone are measured: every one until the
+        calibration has CALIBRATION_MIN_SAMPLES, then one in
+        CALIBRATION_SAMPLE_EVERY until the sample window is full. The caller
+        resets the peak and fills in the baseline.
+        """
+        if self._measuring is not None:
+            # Another request was being measured; overlapping peaks are meaningless
+            self._measuring["overlapped"] = True
+            return None
+        if self.in_flight != 1 or len(self.samples) >= CALIBRATION_MAX_SAMPLES:
+            return None
+        self._solo += 1
+        if len(self.samples) >= CALIBRATION_MIN_SAMPLES and self._solo % CALIBRATION_SAMPLE_EVERY:
+            return None
+        self._measuring = {"estimate": raw_estimate, "baseline": None, "overlapped": False}
+        return self._measuring
+
+    def _finish_measurement(self, measurement: Optional[Dict[str, Any]], status: Optional[Dict[str, int]]) -> None:
+        if measurement is None:
+            return
+        self._measuring = None
+        if measurement["overlapped"] or measurement["baseline"] is None or status is None:
+            return
+        self._measured += 1
+        if self._measured <= CALIBRATION_SKIP_FIRST:
+            return
+        self.record_peak(measurement["estimate"], status["VmHWM"] * 1024 - measurement["baseline"])
+
+    def record_peak(self, raw_estimate: float, peak_bytes: int) -> None:
+        """Add a measured (uncalibrated estimate, actual peak) pair to the calibration samples"""
+        if raw_estimate <= 0 or peak_bytes <= 0:
+            return
+        self.samples.append((int(raw_estimate), int(peak_bytes)))
+        MEMORY_ESTIMATE_RATIO.observe(peak_bytes / raw_estimate)
+
+    def status(self) -> Dict[str, Any]:
+        """Current reservations and calibration, for the admission endpoint"""
+        with self._condition:
+            ratios = [peak / estimate for estimate, peak in self.samples]
+            return {
+                "budgetMb": round(self.budget / MB, 1),
+                "reservedMb": round(self.reserved / MB, 1),
+                "inFlight": self.in_flight,
+                "queued": len(self._queue),
+                "correction": round(self.correction, 3),
+                "calibrationSamples": len(ratios),
+                "peakToEstimate": {
+                    "p50": round(float(np.quantile(ratios, 0.5)), 3),
+                    "p90": round(float(np.quantile(ratios, 0.9)), 3),
+                    "max": round(max(ratios), 3),
+                } if ratios else None,
+            }
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide admission controller"""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(MEMORY_BUDGET_MB * MB)
+    return _controller
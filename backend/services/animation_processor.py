@@ -0,0 +1,174 @@
+from PIL import Image, ImageSequence
+import numpy as np
+from typing import Dict, Any, Iterator, List, TYPE_CHECKING
+import base64
+import io
+import time
+
+from services.block_grid import BlockGrid
+from services.image_processor_optimized import preprocess_image
+from services.palette import get_block_palette
+from services.preview_encoder import render_index_preview, encode_preview, encode_animated_preview
+
+if TYPE_CHECKING:
+    from sklearn.cluster import MiniBatchKMeans
+
+# Largest number of frames converted from one animation
+MAX_ANIMATION_FRAMES = 300
+
+# Frame duration used when the file does not specify one (milliseconds)
+DEFAULT_FRAME_DURATION = 100
+
+# Re-fit the colour quantizer when more than this share of pixels changes
+# between frames (scene cuts), instead of re-matching region by region
+REFIT_CHANGED_RATIO = 0.5
+
+def is_animated(image: Image.Image) -> bool:
+    """Check whether an image has more than one frame"""
+    return getattr(image, "is_animated", False) and getattr(image, "n_frames", 1) > 1
+
+def _fit_quantizer(np_image: np.ndarray, num_colors: int) -> "MiniBatchKMeans":
+    from sklearn.cluster import MiniBatchKMeans
+    
+    pixels = np_image.reshape(-1, 3)
+    kmeans = MiniBatchKMeans(n_clusters=min(num_colors, len(pixels)), batch_size=1000, random_state=42)
+    return kmeans.fit(pixels)
+
+def iter_animation_frames(
+    image: Image.Image,
+    grid_size: int = 100,
+    num_colors: int = 48,
+    change_threshold: int = 0
+) -> Iterator[Dict[str, Any]]:
+    """
+    Convert an animation to block grids one frame at a time
+
+    Frames are decoded lazily and only the previous frame is kept, so memory
+    does not grow with the number of frames. Pixels that did not change since
+    the previous frame reuse its block matches; only changed pixels are
+    re-quantized with the current colour model and re-matched.
+
+    Args:
+        image: Animated PIL image (GIF, APNG, WebP)
+        grid_size: Maximum grid size in blocks (width or height)
+        num_colors: Number of colors to reduce to
+        change_threshold: Largest per-channel difference still treated as unchanged
+
+    Yields:
+        {"frame", "duration", "indexGrid", "changedPixels"} for each frame
+    """
+    palette = get_block_palette()
+    previous_pixels = None
+    previous_indices = None
+    kmeans = None
+
+    for frame_number, frame in enumerate(ImageSequence.Iterator(image)):
+        if frame_number >= MAX_ANIMATION_FRAMES:
+            break
+
+        duration = frame.info.get("duration") or DEFAULT_FRAME_DURATION
+        np_image = preprocess_image(frame.convert("RGBA"), grid_size, grid_size)
+
+        if previous_pixels is None:
+            changed = np.ones(np_image.shape[:2], dtype=bool)
+        else:
+            difference = np.abs(np_image.astype(np.int16) - previous_pixels.astype(np.int16))
+            changed = difference.max(axis=2) > change_threshold
+        changed_count = int(changed.sum())
+
+        if kmeans is None or changed_count > REFIT_CHANGED_RATIO * changed.size:
+            # First frame or scene cut: fit the colours and match the whole frame
+            kmeans = _fit_quantizer(np_image, num_colors)
+            centers = kmeans.cluster_centers_.astype(np.uint8)
+            indices = palette.match(centers[kmeans.labels_].reshape(np_image.shape))
+        elif changed_count:
+            centers = kmeans.cluster_centers_.astype(np.uint8)
+            indices = previous_indices.copy()
+            indices[changed] = palette.match(centers[kmeans.predict(np_image[changed])])
+        else:
+            indices = previous_indices
+
+        yield {
+            "frame": frame_number,
+            "duration": duration,
+            "indexGrid": indices,
+            "changedPixels": changed_count
+        }
+
+        previous_pixels = np_image
+        previous_indices = indices
+
+def process_animation(
+    image_data: bytes,
+    grid_size: int = 100,
+    num_colors: int = 48,
+    output_scale: int = 4
+) -> Dict[str, Any]:
+    """
+    Convert an animated image into a block animation
+
+    Args:
+        image_data: Raw image bytes
+        grid_size: Maximum grid size in blocks (width or height)
+        num_colors: Number of colors to reduce to
+        output_scale: Scale factor for the preview frames
+
+    Returns:
+        Dictionary with the first frame preview, the stacked frame index grids,
+        frame durations and per-frame block counts
+    """
+    start_time = time.time()
+    palette = get_block_palette()
+    image = Image.open(io.BytesIO(image_data))
+
+    frames: List[np.ndarray] = []
+    durations = []
+    frame_counts = []
+    changed_pixels = 0
+
+    for frame in iter_animation_frames(image, grid_size, num_colors):
+        index_grid = frame["indexGrid"]
+        frames.append(index_grid)
+        durations.append(frame["duration"])
+        changed_pixels += frame["changedPixels"]
+
+        frame_counts.append(BlockGrid(index_grid, palette).counts())
+
+    frames_array = np.stack(frames)
+    height, width = frames_array.shape[1:]
+
+    # The first frame doubles as the still preview for clients without animation support
+    grid_line_index = palette.grid_line_index if output_scale > 3 else None
+    first_frame = render_index_preview(frames_array[0], output_scale, grid_line_index)
+    preview_bytes = encode_preview(first_frame, palette.preview_colors, "png")
+
+    return {
+        "imageData": base64.b64encode(preview_bytes).decode('utf-8'),
+        "imageFormat": "png",
+        "blockCount": frame_counts[0],
+        "blockIndices": BlockGrid(frames_array[0], palette),
+        "frames": frames_array,
+        "frameBlockCounts": frame_counts,
+        "durations": durations,
+        "gridSize": {"width": width, "height": height},
+        "outputScale": output_scale,
+        # Share of pixels that had to be re-matched across the whole animation
+        "rematchedRatio": round(changed_pixels / frames_array.size, 4),
+        "processingTime": round(time.time() - start_time, 2)
+    }
+
+def render_animation_preview(result: Dict[str, Any]) -> bytes:
+    """
+    Encode the animated preview for a stored animation result
+
+    Args:
+        result: Stored result with "frames", "durations", "palette", "outputScale" and "gridLineIndex"
+
+    Returns:
+        Animated GIF bytes
+    """
+    index_images = (
+        render_index_preview(index_grid, result["outputScale"], result["gridLineIndex"])
+        for index_grid in result["frames"]
+    )
+    return encode_animated_preview(index_images, result["durations"], result["palette"])
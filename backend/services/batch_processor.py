@@ -0,0 +1,215 @@
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Any, Callable, Iterator, Optional, Set, Tuple
+
+from services.metrics import observe_stages, BATCH_QUEUE_DEPTH, BATCH_WORKERS_BUSY, BATCH_WORKERS
+from services.stage_timer import collect_stage_timings
+
+# File extensions picked out of uploaded archives
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp"}
+
+# Largest archive member we are willing to decompress
+MAX_ARCHIVE_MEMBER_SIZE = 20 * 1024 * 1024
+
+# Per-item parameters accepted in the batch request, mapped to pipeline arguments
+ITEM_PARAMETERS = {
+    "gridSize": "grid_size",
+    "numColors": "num_colors",
+    "previewFormat": "preview_format",
+    "compressLevel": "compress_level",
+}
+
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", max(1, min(8, (os.cpu_count() or 4) - 1))))
+
+# Worker pool shared by every batch request
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_batch_executor() -> ThreadPoolExecutor:
+    """Return the shared batch worker pool, creating it on first use"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+                BATCH_WORKERS.set(BATCH_MAX_WORKERS)
+    return _executor
+
+def expand_archive(archive_data: bytes, max_images: Optional[int] = None) -> List[Tuple[str, bytes]]:
+    """
+    Extract the images from a zip archive
+
+    Args:
+        archive_data: Raw zip file bytes
+        max_images: Most images to accept; extraction stops as soon as the
+            archive turns out to hold more
+
+    Returns:
+        List of (member name, image bytes) in archive order
+
+    Raises:
+        ValueError: If the archive is invalid, a member is too large or
+            there are more than max_images images
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(archive_data))
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Invalid zip archive: {e}")
+
+    images = []
+    with archive:
+        for member in archive.infolist():
+            name = member.filename
+            if member.is_dir() or name.startswith("__MACOSX/"):
+                continue
+            if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            if max_images is not None and len(images) >= max_images:
+                raise ValueError(f"Too many images. The archive holds more than the {max_images} the batch has room for")
+            images.append((name, _read_member(archive, member)))
+    return images
+
+def _read_member(archive: zipfile.ZipFile, member: zipfile.ZipInfo) -> bytes:
+    """Decompress one member, never more than MAX_ARCHIVE_MEMBER_SIZE bytes of it"""
+    # The header's file_size is not trusted: a crafted archive can understate it
+    if member.file_size > MAX_ARCHIVE_MEMBER_SIZE:
+        raise ValueError(f"Archive member {member.filename} is too large")
+    try:
+        with archive.open(member) as f:
+            data = f.read(MAX_ARCHIVE_MEMBER_SIZE + 1)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, RuntimeError) as e:
+        raise ValueError(f"Could not extract archive member {member.filename}: {e}")
+    if len(data) > MAX_ARCHIVE_MEMBER_SIZE:
+        raise ValueError(f"Archive member {member.filename} is too large")
+    return data
+
+def resolve_item_params(names: List[str], params_json: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Work out the pipeline arguments for each batch item
+
+    The params field is either a JSON list aligned with the items, or an
+    object mapping item names to parameters where "*" supplies defaults.
+
+    Args:
+        names: Item names in request order
+        params_json: Raw JSON from the request, or None
+
+    Returns:
+        List of keyword-argument dicts for the pipeline, one per item
+
+    Raises:
+        ValueError: If the parameters are malformed, or a value is not an
+            integer or a string
+    """
+    if not params_json:
+        return [{} for _ in names]
+
+    try:
+        params = json.loads(params_json)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid params JSON: {e}")
+
+    if isinstance(params, list):
+        if len(params) != len(names):
+            raise ValueError(f"Expected {len(names)} parameter entries, got {len(params)}")
+        per_item = params
+    elif isinstance(params, dict):
+        for key, value in params.items():
+            if not isinstance(value, dict):
+                raise ValueError(f"Parameters for {key} must be an object")
+        defaults = params.get("*", {})
+        per_item = [{**defaults, **params.get(name, {})} for name in names]
+    else:
+        raise ValueError("params must be a JSON list or object")
+
+    resolved = []
+    for name, item_params in zip(names, per_item):
+        if not isinstance(item_params, dict):
+            raise ValueError(f"Parameters for {name} must be an object")
+        unknown = set(item_params) - set(ITEM_PARAMETERS)
+        if unknown:
+            raise ValueError(f"Unknown parameters for {name}: {', '.join(sorted(unknown))}")
+        for key, value in item_params.items():
+            # bool is an int subclass, but true is no grid size
+            if isinstance(value, bool) or not isinstance(value, (int, str)):
+                raise ValueError(f"Parameter {key} for {name} must be a number or a string")
+        resolved.append({ITEM_PARAMETERS[key]: value for key, value in item_params.items()})
+    return resolved
+
+def _run_item(
+    process_func: Callable[..., Dict[str, Any]],
+    position: int,
+    name: str,
+    image_data: bytes,
+    kwargs: Dict[str, Any]
+) -> Dict[str, Any]:
+    BATCH_QUEUE_DEPTH.dec()
+    BATCH_WORKERS_BUSY.inc()
+    start_time = time.perf_counter()
+    try:
+        # Worker threads don't inherit the request's stage collector
+        with collect_stage_timings() as timings:
+            result = process_func(image_data, **kwargs)
+        status, error = "ok", None
+    except Exception as e:
+        result, status, error = None, "error", str(e)
+    finally:
+        BATCH_WORKERS_BUSY.dec()
+    observe_stages(timings.stages)
+    return {
+        "index": position,
+        "name": name,
+        "status": status,
+        "error": error,
+        "result": result,
+        "processingTime": round(time.perf_counter() - start_time, 3)
+    }
+
+def run_batch(
+    items: List[Tuple[str, bytes, Dict[str, Any]]],
+    process_func: Callable[..., Dict[str, Any]],
+    window: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run batch items through the shared worker pool
+
+    Only a window of items is submitted at a time, so one large batch does
+    not queue all of its work ahead of other requests. Closing the generator
+    (e.g. when the client disconnects) cancels whatever has not started.
+
+    Args:
+        items: (name, image bytes, pipeline kwargs) for each image
+        process_func: Pipeline called as process_func(image_bytes, **kwargs)
+        window: Most items submitted at once, BATCH_MAX_WORKERS by default
+
+    Yields:
+        One outcome per item, in completion order
+    """
+    executor = get_batch_executor()
+    window = window or BATCH_MAX_WORKERS
+    BATCH_QUEUE_DEPTH.inc(len(items))
+    waiting = iter(enumerate(items))
+    unsubmitted = len(items)
+    in_flight: Set[Future] = set()
+    try:
+        while True:
+            while unsubmitted and len(in_flight) < window:
+                position, (name, image_data, kwargs) = next(waiting)
+                in_flight.add(executor.submit(_run_item, process_func, position, name, image_data, kwargs))
+                unsubmitted -= 1
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # Items that never started leave the queue without running
+        for future in in_flight:
+            if future.cancel():
+                BATCH_QUEUE_DEPTH.dec()
+        BATCH_QUEUE_DEPTH.dec(unsubmitted)
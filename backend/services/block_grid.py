@@ -0,0 +1,156 @@
+import base64
+import zlib
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+class GridPalette(NamedTuple):
+    """
+    Block names and colours a BlockGrid refers to, for grids restored without
+    their services.palette.BlockPalette
+    """
+    names: Sequence[str]
+    colors: np.ndarray
+
+class BlockGrid:
+    """
+    A 2D grid of blocks stored as one small integer per cell
+
+    Cells hold indices into a palette shared by every grid built from it
+    (a services.palette.BlockPalette or any object with "names" and
+    "colors"). Indices are uint8 for palettes of up to 256 blocks and uint16
+    beyond, one or two bytes per cell where a list of {"name", "color"}
+    dicts costs well over a hundred.
+
+    The grid converts to a numpy array (np.asarray(grid)), so functions
+    taking an index array accept it directly. Slicing returns a grid on the
+    same palette; integer indices keep their axis, so the result is always 2D.
+    """
+    __slots__ = ("indices", "palette")
+    __hash__ = None
+
+    def __init__(self, indices: Any, palette: Any):
+        """
+        Initialize the grid
+
+        Args:
+            indices: (H, W) array of palette indices
+            palette: Object with "names" and "colors" in index order
+        """
+        indices = np.asarray(indices)
+        if indices.ndim != 2:
+            raise ValueError(f"A block grid needs a 2D index array, got shape {indices.shape}")
+        dtype = np.uint8 if len(palette.names) <= 256 else np.uint16
+        self.indices = indices.astype(dtype, copy=False)
+        self.palette = palette
+
+    @property
+    def names(self) -> Sequence[str]:
+        return self.palette.names
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.indices.shape
+
+    @property
+    def grid_size(self) -> Dict[str, int]:
+        height, width = self.indices.shape
+        return {"width": int(width), "height": int(height)}
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return self.indices if dtype is None else self.indices.astype(dtype)
+
+    def __getitem__(self, key: Any) -> "BlockGrid":
+        keys = key if isinstance(key, tuple) else (key,)
+        keys = tuple(
+            slice(k, k + 1 if k != -1 else None) if isinstance(k, (int, np.integer)) else k
+            for k in keys
+        )
+        return BlockGrid(self.indices[keys], self.palette)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, BlockGrid):
+            return NotImplemented
+        same_palette = other.palette is self.palette or (
+            list(other.names) == list(self.names)
+            and np.array_equal(np.asarray(other.palette.colors), np.asarray(self.palette.colors))
+        )
+        return same_palette and np.array_equal(self.indices, other.indices)
+
+    def __repr__(self) -> str:
+        height, width = self.indices.shape
+        return f"BlockGrid({width}x{height}, {len(self.names)} blocks)"
+
+    def __reduce__(self):
+        # Pickle the names and colours rather than the (possibly shared-memory) palette
+        palette = GridPalette(list(self.names), np.asarray(self.palette.colors))
+        return BlockGrid, (self.indices, palette)
+
+    def count_array(self) -> np.ndarray:
+        """Number of cells using each palette index"""
+        return np.bincount(self.indices.ravel(), minlength=len(self.names))
+
+    def counts(self) -> Dict[str, int]:
+        """Number of each block used, by name (blocks that do not occur are left out)"""
+        counts = self.count_array()
+        return {self.names[i]: int(counts[i]) for i in np.flatnonzero(counts)}
+
+    def runs(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Run-length view of the rows: maximal horizontal runs of one block
+
+        Returns:
+            Arrays (row, start column, length, palette index) with one entry
+            per run, in row-major order
+        """
+        height, width = self.indices.shape
+        starts = np.ones((height, width), dtype=bool)
+        starts[:, 1:] = self.indices[:, 1:] != self.indices[:, :-1]
+        rows, columns = np.nonzero(starts)
+
+        # Every row starts a run, so runs never cross a row boundary
+        flat_starts = rows * width + columns
+        lengths = np.diff(np.append(flat_starts, height * width))
+        return rows, columns, lengths, self.indices[rows, columns]
+
+    def tolist(self) -> List[List[int]]:
+        """Palette indices as nested lists"""
+        return self.indices.tolist()
+
+    def to_legacy(self) -> List[List[Dict[str, Any]]]:
+        """Rows of {"name", "color"} for every block position (the older API shape)"""
+        cells = [{"name": name, "color": list(map(int, color))}
+                 for name, color in zip(self.names, self.palette.colors)]
+        return [[cells[index] for index in row] for row in self.indices.tolist()]
+
+    def to_json(self) -> Dict[str, Any]:
+        """Compact JSON form: the compressed index bytes plus the palette"""
+        return {
+            "shape": list(self.indices.shape),
+            "dtype": self.indices.dtype.name,
+            "data": base64.b64encode(zlib.compress(self.indices.tobytes())).decode("ascii"),
+            "names": list(self.names),
+            "colors": np.asarray(self.palette.colors).tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "BlockGrid":
+        """Rebuild a grid from to_json's output"""
+        indices = np.frombuffer(zlib.decompress(base64.b64decode(data["data"])), dtype=data["dtype"])
+        palette = GridPalette(data["names"], np.asarray(data["colors"], dtype=np.uint8))
+        return cls(indices.reshape(data["shape"]), palette)
+
+# Marker key for BlockGrid values inside JSON documents (see json_default)
+JSON_KEY = "__blockGrid__"
+
+def json_default(value: Any) -> Any:
+    """json.dump default= hook that stores BlockGrid values compactly"""
+    if isinstance(value, BlockGrid):
+        return {JSON_KEY: value.to_json()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def json_object_hook(value: Dict[str, Any]) -> Any:
+    """json.load object_hook= that restores values written through json_default"""
+    if len(value) == 1 and JSON_KEY in value:
+        return BlockGrid.from_json(value[JSON_KEY])
+    return value
@@ -0,0 +1,106 @@
+"""
+Progressive encodings of a block index grid
+
+A stream is a header record (grid size and palette), the grid's rows in
+chunks, and a summary record. Chunks are serialized one at a time, so the
+full serialized grid never exists in memory and clients can draw rows as
+they arrive.
+
+NDJSON: one JSON object per line, with "type" "header", "rows" ({"y", "rows"})
+or "summary".
+
+Binary: frames of a one-byte type (b"H", b"R" or b"S"), a 4-byte big-endian
+payload length and the payload. Header and summary payloads are UTF-8 JSON;
+a rows payload is the 4-byte big-endian index of its first row followed by
+the rows' block indices, one uint8 per block.
+"""
+import json
+import struct
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "binary": "application/octet-stream",
+}
+
+DEFAULT_ROWS_PER_CHUNK = 16
+
+_FRAME_HEADER = struct.Struct(">cI")
+_ROW_OFFSET = struct.Struct(">I")
+
+def stream_block_rows(
+    header: Dict[str, Any],
+    index_grid: np.ndarray,
+    summary: Dict[str, Any],
+    stream_format: str = "ndjson",
+    rows_per_chunk: int = DEFAULT_ROWS_PER_CHUNK
+) -> Iterator[bytes]:
+    """
+    Encode a header, the grid's rows in chunks and a summary
+
+    Args:
+        header: JSON-serializable header fields
+        index_grid: (H, W) uint8 array of palette indices
+        summary: JSON-serializable summary fields
+        stream_format: One of STREAM_FORMATS
+        rows_per_chunk: Grid rows per rows record
+
+    Yields:
+        Encoded records
+    """
+    if stream_format not in STREAM_FORMATS:
+        raise ValueError(f"Unsupported stream format: {stream_format}")
+    binary = stream_format == "binary"
+    height = index_grid.shape[0]
+
+    yield _encode_record(binary, "header", header)
+    for start in range(0, height, max(1, rows_per_chunk)):
+        rows = index_grid[start:start + rows_per_chunk]
+        if binary:
+            payload = _ROW_OFFSET.pack(start) + np.ascontiguousarray(rows, dtype=np.uint8).tobytes()
+            yield _FRAME_HEADER.pack(b"R", len(payload)) + payload
+        else:
+            yield (json.dumps({"type": "rows", "y": start, "rows": rows.tolist()}) + "\n").encode("utf-8")
+    yield _encode_record(binary, "summary", summary)
+
+def _encode_record(binary: bool, record_type: str, fields: Dict[str, Any]) -> bytes:
+    if binary:
+        payload = json.dumps(fields).encode("utf-8")
+        return _FRAME_HEADER.pack(record_type[0].upper().encode("ascii"), len(payload)) + payload
+    return (json.dumps({"type": record_type, **fields}) + "\n").encode("utf-8")
+
+def read_binary_block_stream(data: bytes) -> Tuple[Dict[str, Any], np.ndarray, Dict[str, Any]]:
+    """
+    Decode a complete binary stream
+
+    Args:
+        data: Concatenated frames
+
+    Returns:
+        Tuple of (header, (H, W) uint8 index grid, summary)
+    """
+    header: Dict[str, Any] = {}
+    summary: Dict[str, Any] = {}
+    chunks: List[Tuple[int, bytes]] = []
+    position = 0
+    while position < len(data):
+        frame_type, length = _FRAME_HEADER.unpack_from(data, position)
+        payload = data[position + _FRAME_HEADER.size:position + _FRAME_HEADER.size + length]
+        position += _FRAME_HEADER.size + length
+        if frame_type == b"H":
+            header = json.loads(payload)
+        elif frame_type == b"S":
+            summary = json.loads(payload)
+        elif frame_type == b"R":
+            chunks.append((_ROW_OFFSET.unpack_from(payload)[0], payload[_ROW_OFFSET.size:]))
+        else:
+            raise ValueError(f"Unknown frame type: {frame_type!r}")
+
+    width, height = header["gridSize"]["width"], header["gridSize"]["height"]
+    grid = np.empty((height, width), dtype=np.uint8)
+    for start, rows in chunks:
+        block = np.frombuffer(rows, dtype=np.uint8).reshape(-1, width)
+        grid[start:start + len(block)] = block
+    return header, grid, summary
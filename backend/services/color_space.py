@@ -0,0 +1,91 @@
+"""
+Vectorized sRGB, linear-light and CIE Lab conversions
+
+The formulas and constants are those of services.block_database.rgb_to_lab
+(sRGB transfer curve, D65 white point), applied to whole arrays at once.
+"""
+import numpy as np
+
+# Linear-light value of every 8-bit sRGB channel value
+_SRGB_TO_LINEAR_64 = np.where(
+    np.arange(256) / 255.0 <= 0.04045,
+    np.arange(256) / 255.0 / 12.92,
+    ((np.arange(256) / 255.0 + 0.055) / 1.055) ** 2.4
+)
+SRGB_TO_LINEAR = _SRGB_TO_LINEAR_64.astype(np.float32)
+
+# Linear RGB to XYZ and the D65 reference white
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_XYZ_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+def srgb_to_linear(pixels: np.ndarray) -> np.ndarray:
+    """
+    Convert 8-bit sRGB to linear light through the lookup table
+
+    Args:
+        pixels: uint8 array of sRGB channel values
+
+    Returns:
+        float32 array of the same shape, in [0, 1]
+    """
+    return SRGB_TO_LINEAR[pixels]
+
+def linear_to_srgb(linear: np.ndarray) -> np.ndarray:
+    """
+    Convert linear light back to 8-bit sRGB
+
+    Args:
+        linear: Float array of linear channel values in [0, 1]
+
+    Returns:
+        uint8 array of the same shape
+    """
+    linear = np.clip(linear, 0.0, 1.0)
+    encoded = np.where(
+        linear <= 0.0031308,
+        linear * 12.92,
+        1.055 * np.power(linear, 1 / 2.4, dtype=np.float32) - 0.055
+    )
+    return np.rint(encoded * 255).astype(np.uint8)
+
+def linear_to_lab(linear: np.ndarray, dtype: type = np.float32) -> np.ndarray:
+    """
+    Convert linear RGB to CIE Lab
+
+    Args:
+        linear: (..., 3) array of linear RGB in [0, 1]
+        dtype: Working and result precision
+
+    Returns:
+        (..., 3) array of L, a, b
+    """
+    xyz = (linear.astype(dtype, copy=False) @ _RGB_TO_XYZ.T.astype(dtype)) / _XYZ_WHITE.astype(dtype)
+    f = np.where(xyz > 0.008856, np.power(np.maximum(xyz, 0), 1 / 3), 7.787 * xyz + 16 / 116).astype(dtype, copy=False)
+    lab = np.empty(f.shape, dtype=dtype)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+def srgb_to_lab(pixels: np.ndarray, dtype: type = np.float32) -> np.ndarray:
+    """
+    Convert 8-bit sRGB to CIE Lab
+
+    Args:
+        pixels: (..., 3) array of sRGB colours in 0-255 (8-bit ones go through the lookup table)
+        dtype: Working and result precision (float64 reproduces rgb_to_lab)
+
+    Returns:
+        (..., 3) array of L, a, b
+    """
+    if pixels.dtype == np.uint8:
+        table = _SRGB_TO_LINEAR_64 if dtype == np.float64 else SRGB_TO_LINEAR.astype(dtype)
+        return linear_to_lab(table[pixels], dtype)
+
+    encoded = pixels.astype(dtype) / 255
+    linear = np.where(encoded <= 0.04045, encoded / 12.92, np.power((np.maximum(encoded, 0) + 0.055) / 1.055, 2.4))
+    return linear_to_lab(linear, dtype)
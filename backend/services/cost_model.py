@@ -0,0 +1,231 @@
+"""
+Cost model for choosing conversion strategies per image
+
+A plan is one combination of quantizer, matcher (colour metric), match
+executor and preview encoder. The model predicts the time of each stage a
+plan changes from three features known once the image is resized: grid
+cells, unique colours and palette size. Coefficients are fitted per stage
+strategy on the benchmark corpus by benchmarks/cost_model.py, which also
+records each quantizer and matcher pair's mean colour error (CIE76 delta E
+between the resized image and the matched blocks) as its quality.
+
+At runtime select() returns the plan with the lowest predicted time among
+those within the quality target, instead of fixed pixel-count thresholds.
+"""
+import json
+import os
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+COST_MODEL_PATH = os.environ.get(
+    "COST_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cost_model.json")
+)
+
+# Largest mean delta E a plan may have by default. On the benchmark corpus
+# this admits Lab matching and unquantized RGB matching but not k-means with
+# RGB matching (about 18), so speed only decides between comparable plans.
+DEFAULT_MAX_DELTA_E = float(os.environ.get("COST_MODEL_MAX_DELTA_E", "16"))
+
+QUANTIZERS = ("minibatch_kmeans", "none")
+MATCHERS = ("rgb", "lab")
+EXECUTORS = ("serial", "threads")
+ENCODERS = ("png", "webp")
+
+FEATURES = ("constant", "cells", "colorDistances", "cellDistances")
+
+class Plan(NamedTuple):
+    """One combination of stage strategies"""
+    quantizer: str
+    matcher: str
+    executor: str
+    encoder: str
+
+    def terms(self) -> List[str]:
+        """Model terms whose predictions add up to the plan's time"""
+        return [f"quantize:{self.quantizer}", f"match:{self.matcher}:{self.executor}", f"encode:{self.encoder}"]
+
+    @property
+    def quality_key(self) -> str:
+        return f"{self.quantizer}:{self.matcher}"
+
+def all_plans(encoders: Sequence[str] = ENCODERS, executors: Sequence[str] = EXECUTORS) -> List[Plan]:
+    """Every plan, in the order ties are broken"""
+    return [
+        Plan(quantizer, matcher, executor, encoder)
+        for quantizer in QUANTIZERS for matcher in MATCHERS
+        for executor in executors for encoder in encoders
+    ]
+
+def matched_colors(quantizer: str, unique_colors: int, num_colors: int) -> int:
+    """Distinct colours the matcher sees after quantization"""
+    return min(unique_colors, num_colors) if quantizer != "none" else unique_colors
+
+def feature_vector(cells: int, colors: int, palette_size: int) -> np.ndarray:
+    """
+    Features of one stage run
+
+    Args:
+        cells: Grid cells
+        colors: Distinct colours being matched
+        palette_size: Blocks in the palette
+
+    Returns:
+        Values of FEATURES, scaled to similar magnitudes
+    """
+    return np.array([1.0, cells / 1e4, colors * palette_size / 1e6, cells * palette_size / 1e6])
+
+def count_colors(pixels: np.ndarray) -> int:
+    """Number of distinct RGB colours in an (H, W, 3) uint8 image"""
+    flat = pixels.reshape(-1, 3)
+    codes = (flat[:, 0].astype(np.int32) << 16) | (flat[:, 1].astype(np.int32) << 8) | flat[:, 2]
+    return int(np.unique(codes).size)
+
+class CostModel:
+    """
+    Fitted per-stage time coefficients and per-plan quality
+    """
+    def __init__(
+        self,
+        coefficients: Dict[str, Sequence[float]],
+        quality: Dict[str, float],
+        calibration: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Initialize the model
+
+        Args:
+            coefficients: Seconds per feature (FEATURES order) for each term
+                ("quantize:<name>", "match:<metric>:<executor>", "encode:<format>")
+            quality: Mean delta E for each "<quantizer>:<matcher>" pair
+            calibration: Where and how the model was fitted, for reference
+        """
+        self.coefficients = {term: np.asarray(values, dtype=np.float64) for term, values in coefficients.items()}
+        self.quality = dict(quality)
+        self.calibration = calibration or {}
+
+    def predict(self, plan: Plan, cells: int, unique_colors: int, palette_size: int, num_colors: int = 48) -> float:
+        """
+        Predicted seconds of the stages a plan changes
+
+        Returns:
+            The time, or infinity if a term has not been calibrated
+        """
+        colors = matched_colors(plan.quantizer, unique_colors, num_colors)
+        total = 0.0
+        for term in plan.terms():
+            coefficients = self.coefficients.get(term)
+            if coefficients is None:
+                return float("inf")
+            total += float(coefficients @ feature_vector(cells, colors, palette_size))
+        return total
+
+    def select(
+        self,
+        cells: int,
+        unique_colors: int,
+        palette_size: int,
+        encoder: str = "png",
+        max_delta_e: float = DEFAULT_MAX_DELTA_E,
+        num_colors: int = 48,
+        plans: Optional[Iterable[Plan]] = None
+    ) -> Tuple[Plan, float]:
+        """
+        Choose the fastest plan within the quality target
+
+        Args:
+            cells: Grid cells
+            unique_colors: Distinct colours of the resized image
+            palette_size: Blocks in the palette
+            encoder: Preview format the client asked for (plans are limited to it)
+            max_delta_e: Largest acceptable mean colour error
+            num_colors: Colours the quantizer reduces to
+            plans: Candidates (all_plans by default)
+
+        Returns:
+            (plan, predicted seconds); the most accurate plan if none meets the target
+        """
+        candidates = [plan for plan in (plans or all_plans()) if plan.encoder == encoder]
+        if not candidates:
+            raise ValueError(f"No plans for encoder: {encoder}")
+
+        within_target = [
+            plan for plan in candidates
+            if self.quality.get(plan.quality_key, float("inf")) <= max_delta_e
+        ]
+        if not within_target:
+            best_quality = min(self.quality.get(plan.quality_key, float("inf")) for plan in candidates)
+            within_target = [
+                plan for plan in candidates if self.quality.get(plan.quality_key, float("inf")) == best_quality
+            ]
+
+        predictions = [
+            (self.predict(plan, cells, unique_colors, palette_size, num_colors), position, plan)
+            for position, plan in enumerate(within_target)
+        ]
+        seconds, _, plan = min(predictions)
+        return plan, seconds
+
+    @classmethod
+    def fit(
+        cls,
+        samples: Iterable[Dict[str, Any]],
+        quality: Dict[str, float],
+        calibration: Optional[Dict[str, Any]] = None
+    ) -> "CostModel":
+        """
+        Fit non-negative coefficients per term by least squares
+
+        Args:
+            samples: Stage runs as {"term", "cells", "colors", "paletteSize", "seconds"}
+            quality: Mean delta E per "<quantizer>:<matcher>" pair
+            calibration: Metadata stored with the model
+
+        Returns:
+            The fitted model
+        """
+        from scipy.optimize import nnls
+
+        by_term: Dict[str, List[Dict[str, Any]]] = {}
+        for sample in samples:
+            by_term.setdefault(sample["term"], []).append(sample)
+
+        coefficients = {}
+        for term, term_samples in by_term.items():
+            features = np.array([
+                feature_vector(sample["cells"], sample["colors"], sample["paletteSize"]) for sample in term_samples
+            ])
+            seconds = np.array([sample["seconds"] for sample in term_samples])
+            coefficients[term], _ = nnls(features, seconds)
+        return cls(coefficients, quality, calibration)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "features": list(FEATURES),
+            "coefficients": {term: [float(value) for value in values] for term, values in sorted(self.coefficients.items())},
+            "quality": {key: round(value, 3) for key, value in sorted(self.quality.items())},
+            "calibration": self.calibration,
+        }
+
+    def save(self, path: str = COST_MODEL_PATH) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+            f.write("\n")
+
+    @classmethod
+    def load(cls, path: str = COST_MODEL_PATH) -> "CostModel":
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("features") != list(FEATURES):
+            raise ValueError(f"Cost model {path} was fitted on other features; run benchmarks/cost_model.py")
+        return cls(data["coefficients"], data["quality"], data.get("calibration"))
+
+_model: Optional[CostModel] = None
+
+def get_cost_model() -> CostModel:
+    """Return the calibrated model from COST_MODEL_PATH, loading it on first use"""
+    global _model
+    if _model is None:
+        _model = CostModel.load()
+    return _model
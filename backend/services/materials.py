@@ -0,0 +1,141 @@
+"""
+Build materials lists: how many of each block a build needs, in the units
+players gather them in, with optional per-row or per-map-section subtotals
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from services.block_grid import BlockGrid
+from services.relief import ReliefVolume
+
+STACK_SIZE = 64
+SHULKER_BOX_SLOTS = 27
+
+# Blocks along each side of the area one Minecraft map shows
+MAP_SECTION_SIZE = 128
+
+SUBTOTALS = ("none", "rows", "sections")
+
+def materials_report(
+    grid: BlockGrid,
+    subtotals: str = "none",
+    section_size: int = MAP_SECTION_SIZE,
+    volume: Optional[ReliefVolume] = None
+) -> Dict[str, Any]:
+    """
+    Count the blocks of a grid in stacks and shulker boxes
+
+    Everything comes from bincounts over the index array (or the relief's
+    runs, weighted by length): one pass for the totals and one for the
+    subtotals.
+
+    Args:
+        grid: Block grid to count
+        subtotals: "none", "rows" (per grid row) or "sections" (per map-sized square)
+        section_size: Side of a section in blocks
+        volume: The relief raised from grid, if any: its columns (filler
+            included) are counted instead, and subtotals group columns
+
+    Returns:
+        {"totalBlocks", "materials", "totals"} plus "rows" or "sections" when
+        requested. Each material (most used first) is {"name", "count",
+        "shulkerBoxes", "stacks", "remainder"}: full boxes, then full stacks,
+        then single blocks. "totals" gives the stack slots everything needs
+        and the shulker boxes to carry them.
+    """
+    if subtotals not in SUBTOTALS:
+        raise ValueError(f"Unknown subtotals: {subtotals}. Choose one of: {', '.join(SUBTOTALS)}")
+
+    if volume is not None:
+        names: Sequence[str] = volume.names
+        counts = volume.count_array()
+        # Every run of a column counts its length, grouped by the column's grid cell
+        cells = np.repeat(np.arange(volume.offsets.size - 1), np.diff(volume.offsets))
+        blocks = volume.blocks
+        weights = np.where(blocks == volume.air, 0, volume.lengths)
+    else:
+        names = grid.names
+        counts = grid.count_array()
+        cells, blocks, weights = None, grid.indices.ravel(), None
+    used = np.flatnonzero(counts)
+    used = used[np.argsort(-counts[used], kind="stable")]
+    used_counts = counts[used]
+
+    # Every material needs its own slots, so a partial stack still takes a slot
+    slots = -(-used_counts // STACK_SIZE)
+    materials = [
+        {
+            "name": names[index],
+            "count": int(count),
+            "shulkerBoxes": count // (STACK_SIZE * SHULKER_BOX_SLOTS),
+            "stacks": count % (STACK_SIZE * SHULKER_BOX_SLOTS) // STACK_SIZE,
+            "remainder": count % STACK_SIZE,
+        }
+        for index, count in zip(used.tolist(), used_counts.tolist())
+    ]
+    report: Dict[str, Any] = {
+        "totalBlocks": int(used_counts.sum()),
+        "materials": materials,
+        "totals": {
+            "slots": int(slots.sum()),
+            "shulkerBoxes": -(-int(slots.sum()) // SHULKER_BOX_SLOTS),
+        },
+    }
+
+    if subtotals == "rows":
+        height = grid.shape[0]
+        row_ids = np.repeat(np.arange(height), grid.shape[1])
+        report["rows"] = [
+            {"y": y, "counts": row_counts}
+            for y, row_counts in enumerate(_grouped_counts(names, _run_groups(row_ids, cells), blocks, weights, height))
+        ]
+    elif subtotals == "sections":
+        height, width = grid.shape
+        sections_x = -(-width // section_size)
+        sections_y = -(-height // section_size)
+        ys, xs = np.indices(grid.shape)
+        section_ids = ((ys // section_size) * sections_x + xs // section_size).ravel()
+        report["sections"] = [
+            {
+                "x": section % sections_x,
+                "y": section // sections_x,
+                "bounds": _section_bounds(section % sections_x, section // sections_x, section_size, width, height),
+                "counts": section_counts,
+            }
+            for section, section_counts in enumerate(
+                _grouped_counts(names, _run_groups(section_ids, cells), blocks, weights, sections_x * sections_y)
+            )
+        ]
+    return report
+
+def _run_groups(cell_groups: np.ndarray, cells: Optional[np.ndarray]) -> np.ndarray:
+    """Group of every counted item: of each cell, or of each relief run's cell"""
+    return cell_groups if cells is None else cell_groups[cells]
+
+def _grouped_counts(
+    names: Sequence[str],
+    group_ids: np.ndarray,
+    blocks: np.ndarray,
+    weights: Optional[np.ndarray],
+    groups: int
+) -> List[Dict[str, int]]:
+    """Block counts per group, from a single bincount over (group, block) pairs"""
+    palette_size = len(names)
+    table = np.bincount(
+        group_ids * palette_size + blocks, weights=weights, minlength=groups * palette_size
+    ).astype(np.int64).reshape(groups, palette_size)
+
+    grouped: List[Dict[str, int]] = [{} for _ in range(groups)]
+    group_index, block_index = np.nonzero(table)
+    for group, block, count in zip(group_index.tolist(), block_index.tolist(), table[group_index, block_index].tolist()):
+        grouped[group][names[block]] = count
+    return grouped
+
+def _section_bounds(x: int, y: int, size: int, width: int, height: int) -> Dict[str, int]:
+    return {
+        "left": x * size,
+        "top": y * size,
+        "width": min(size, width - x * size),
+        "height": min(size, height - y * size),
+    }
@@ -0,0 +1,211 @@
+import numpy as np
+import threading
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from services.block_database import get_minecraft_blocks, is_natural_block
+from services.color_space import srgb_to_lab
+from services.preview_encoder import preview_palette
+from services.shared_arrays import data_fingerprint, shared_array, shared_table
+
+# Distance multiplier applied to transparent blocks so solid blocks are preferred
+TRANSPARENT_PENALTY = 1.2
+
+# Distance multiplier of natural blocks under the Lab metric (as in find_closest_block)
+NATURAL_PREFERENCE = 0.9
+
+# Pixels per distance matrix in match_lab
+LAB_MATCH_CHUNK = 1 << 16
+
+# Lookup table entry for colours that have not been matched yet
+UNMATCHED = 255
+
+# Colour difference used to pick the closest block
+#   rgb: Euclidean RGB distance, transparent blocks penalised
+#   lab: CIE76 in Lab space with the natural-block preference of find_closest_block
+COLOR_METRICS = ("rgb", "lab")
+
+class BlockPalette:
+    """
+    Array form of the block database, shared by every conversion
+
+    Building this once per process replaces re-reading the block list and
+    converting colours for each pixel or each request. A shared palette keeps
+    its arrays in memory-mapped files (see services/shared_arrays.py) so every
+    worker process maps one copy, and adds a 24-bit colour lookup table that
+    workers fill in together as colours are first seen.
+    """
+    def __init__(self, blocks: List[Dict[str, Any]], shared: bool = False, metric: str = "rgb"):
+        """
+        Initialize the palette
+
+        Args:
+            blocks: Block database entries ({"name", "color", "is_transparent"})
+            shared: Back the arrays and lookup table with shared files
+            metric: One of COLOR_METRICS
+        """
+        if metric not in COLOR_METRICS:
+            raise ValueError(f"Unknown colour metric: {metric}")
+
+        self.blocks = blocks
+        self.metric = metric
+        self.names = [block["name"] for block in blocks]
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+        def build_colors() -> np.ndarray:
+            return np.array([block["color"] for block in blocks], dtype=np.uint8)
+
+        def build_weights() -> np.ndarray:
+            return np.array(
+                [TRANSPARENT_PENALTY if block.get("is_transparent", False) else 1.0 for block in blocks]
+            )
+
+        if shared:
+            fingerprint = data_fingerprint(
+                [[block["name"], block["color"], block.get("is_transparent", False)] for block in blocks],
+                TRANSPARENT_PENALTY
+            )
+            self.colors = shared_array("palette-colors", fingerprint, build_colors)
+            self.weights = shared_array("palette-weights", fingerprint, build_weights)
+            # Block index of every 24-bit RGB colour, filled in on first sight
+            # (v2: Lab matching became vectorized, so tables filled by the old code are not reused)
+            lookup_name = "palette-lookup" if metric == "rgb" else f"palette-lookup-{metric}-v2"
+            self._lookup = shared_table(lookup_name, fingerprint, 1 << 24, UNMATCHED)
+        else:
+            self.colors = build_colors()
+            self.weights = build_weights()
+            self._lookup = None
+
+        # Preview palette: block colours plus the grid line colour at index len(blocks)
+        self.preview_colors = preview_palette(self.colors)
+        self._match_colors = self.colors.astype(np.float64)
+
+        # Lab metric: block colours in Lab and find_closest_block's two multipliers
+        self.lab_colors = srgb_to_lab(np.asarray(self.colors), np.float64)
+        self._natural_weights = np.array(
+            [NATURAL_PREFERENCE if is_natural_block(name) else 1.0 for name in self.names]
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def grid_line_index(self) -> int:
+        """Preview palette index used for grid lines"""
+        return len(self.names)
+
+    def _nearest(self, colors: np.ndarray) -> np.ndarray:
+        """Closest block index for each row of an (N, 3) colour array"""
+        if self.metric == "lab":
+            # CIE76, then the multipliers in the order find_closest_block applies them
+            diff = srgb_to_lab(colors, np.float64)[:, np.newaxis, :] - self.lab_colors[np.newaxis, :, :]
+            distances = np.sqrt((diff ** 2).sum(axis=2)) * self.weights[np.newaxis, :] * self._natural_weights[np.newaxis, :]
+            return distances.argmin(axis=1).astype(np.uint8)
+
+        diff = colors.astype(np.float64)[:, np.newaxis, :] - self._match_colors[np.newaxis, :, :]
+        distances = np.sqrt((diff ** 2).sum(axis=2)) * self.weights[np.newaxis, :]
+        return distances.argmin(axis=1).astype(np.uint8)
+
+    def match(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Find the closest block for every pixel
+
+        Distances are computed once per unique colour, so quantized images
+        cost a few dozen distance rows regardless of their size. With the
+        shared lookup table, colours any worker has matched before cost a
+        single table read.
+
+        Args:
+            pixels: (..., 3) array of RGB colours
+
+        Returns:
+            Array of block indices with the same leading shape as pixels
+        """
+        flat = pixels.reshape(-1, 3)
+
+        if self._lookup is None or flat.dtype != np.uint8:
+            unique_colors, inverse = np.unique(flat, axis=0, return_inverse=True)
+            return self._nearest(unique_colors)[inverse.reshape(-1)].reshape(pixels.shape[:-1])
+
+        codes = (flat[:, 0].astype(np.int32) << 16) | (flat[:, 1].astype(np.int32) << 8) | flat[:, 2]
+        indices = self._lookup[codes]
+
+        missing = indices == UNMATCHED
+        if missing.any():
+            new_codes = np.unique(codes[missing])
+            new_colors = np.stack([new_codes >> 16, (new_codes >> 8) & 0xFF, new_codes & 0xFF], axis=1)
+            # Every worker computes the same index for a colour, so racing writes are harmless
+            new_indices = self._nearest(new_colors)
+            self._lookup[new_codes] = new_indices
+            indices[missing] = new_indices[np.searchsorted(new_codes, codes[missing])]
+
+        return indices.reshape(pixels.shape[:-1])
+
+    def match_lab(self, lab: np.ndarray) -> np.ndarray:
+        """
+        Find the closest block for every pixel of a Lab image (Lab metric)
+
+        For pixels that are already in Lab, e.g. from the linear-light resize,
+        so no colour conversion is left in the matching loop.
+
+        Args:
+            lab: (..., 3) array of L, a, b
+
+        Returns:
+            Array of block indices with the same leading shape as lab
+        """
+        flat = lab.reshape(-1, 3).astype(np.float32, copy=False)
+        blocks = self.lab_colors.astype(np.float32)
+        block_norms = (blocks ** 2).sum(axis=1)
+        multipliers = (self.weights * self._natural_weights).astype(np.float32)
+
+        indices = np.empty(len(flat), dtype=np.uint8)
+        # Chunks keep the (pixels, blocks) distance matrix small
+        for start in range(0, len(flat), LAB_MATCH_CHUNK):
+            chunk = flat[start:start + LAB_MATCH_CHUNK]
+            # |p - b|^2 = |p|^2 - 2 p.b + |b|^2, as one matrix product
+            squared = (chunk ** 2).sum(axis=1)[:, np.newaxis] - 2 * chunk @ blocks.T + block_norms
+            distances = np.sqrt(np.maximum(squared, 0)) * multipliers
+            indices[start:start + LAB_MATCH_CHUNK] = distances.argmin(axis=1)
+        return indices.reshape(lab.shape[:-1])
+
+    def warm(self) -> None:
+        """Touch the lookup structures so the first request does not pay for them"""
+        self.match(self.colors)
+
+def _basic_blocks() -> List[Dict[str, Any]]:
+    """The small wool/concrete palette of the textured converter"""
+    from app.services.image_processing.processor import MINECRAFT_BLOCKS
+    return [{"name": name, "color": list(color)} for name, color in MINECRAFT_BLOCKS]
+
+# Block lists palettes can be built from, by name
+PALETTE_SOURCES: Dict[str, Callable[[], List[Dict[str, Any]]]] = {
+    "blocks": get_minecraft_blocks,
+    "basic": _basic_blocks,
+}
+
+_palettes: Dict[Tuple[str, str], BlockPalette] = {}
+_palette_lock = threading.Lock()
+
+def get_block_palette(name: str = "blocks", metric: str = "rgb") -> BlockPalette:
+    """
+    Return a process-wide block palette, building it on first use
+
+    Args:
+        name: Block list to use, one of PALETTE_SOURCES
+        metric: Colour metric, one of COLOR_METRICS
+
+    Returns:
+        Shared BlockPalette for the block list
+    """
+    key = (name, metric)
+    palette = _palettes.get(key)
+    if palette is None:
+        if name not in PALETTE_SOURCES:
+            raise ValueError(f"Unknown palette: {name}")
+        with _palette_lock:
+            palette = _palettes.get(key)
+            if palette is None:
+                palette = BlockPalette(PALETTE_SOURCES[name](), shared=True, metric=metric)
+                palette.warm()
+                _palettes[key] = palette
+    return palette
@@ -0,0 +1,344 @@
+"""
+Configurable conversion pipeline
+
+A pipeline is an ordered list of named stages, each run by a swappable
+strategy. Every stage reads and writes the same PipelineContext, whose
+image data is held as numpy arrays:
+
+    ingest     source (bytes, path or PIL image)  -> image (PIL, RGB/RGBA) or pixels
+    normalise  image                              -> pixels (H, W, 3) uint8
+    resize     image or pixels                    -> image or pixels at grid size (+ lab)
+    quantize   pixels                             -> pixels with fewer colours
+    match      pixels or lab                      -> palette, index_grid (H, W) uint8
+    dither     pixels                             -> index_grid
+    render     index_grid                         -> preview (index or RGB image)
+    encode     preview                            -> encoded bytes
+    export     everything above                   -> result
+
+Pipelines are defined in data/pipelines.json (override with PIPELINES_CONFIG);
+strategies register themselves in services/pipeline_strategies.py. The engine
+times every stage (see services/stage_timer.py) and caches whole results for
+byte inputs in the on-disk result cache, coalescing identical concurrent runs.
+"""
+import contextvars
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple, Type
+
+import numpy as np
+
+from middleware.cache import ImageProcessingCache
+from services.block_grid import BlockGrid
+from services.progress import current_progress
+from services.stage_timer import stage
+
+STAGES = ["ingest", "normalise", "resize", "quantize", "match", "dither", "render", "encode", "export"]
+
+PIPELINES_CONFIG = os.environ.get(
+    "PIPELINES_CONFIG",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "pipelines.json")
+)
+
+# Called after every stage with (stage name, context); the stage time is in context.timings
+StageHook = Callable[[str, "PipelineContext"], None]
+
+# (guard, refusals) set by computation_guard
+_computation_guard: contextvars.ContextVar = contextvars.ContextVar("computation_guard", default=None)
+
+@contextmanager
+def computation_guard(
+    guard: Callable[[], ContextManager[Any]],
+    refusals: Tuple[Type[BaseException], ...] = ()
+) -> Iterator[None]:
+    """
+    Enter guard() around the pipeline runs in the block that really compute
+
+    Pipeline.run results served from the cache, or shared from an identical
+    run already in progress, skip the guard, so a request only takes what
+    the guard holds (a scheduler slot, a memory reservation) for work it
+    does itself.
+
+    Args:
+        guard: Returns the context manager to enter
+        refusals: Errors the guard raises to refuse one caller; callers
+            waiting for that run compute for themselves instead
+    """
+    token = _computation_guard.set((guard, refusals))
+    try:
+        yield
+    finally:
+        _computation_guard.reset(token)
+
+def _guarded(compute: Callable[[], Any]) -> Any:
+    current = _computation_guard.get()
+    if current is None:
+        return compute()
+    with current[0]():
+        return compute()
+
+class PipelineContext:
+    """
+    State passed from stage to stage
+    """
+    def __init__(self, source: Any, params: Dict[str, Any]):
+        self.source = source
+        self.params = params
+        self.image = None          # PIL image, before normalise
+        self._pixels: Optional[np.ndarray] = None       # (H, W, 3) uint8
+        self.lab: Optional[np.ndarray] = None           # (H, W, 3) float32 Lab of pixels, if a stage made it
+        self.plan = None           # services.cost_model.Plan, if the quantize stage chose one
+        self.palette = None        # services.palette.BlockPalette
+        self.index_grid: Optional[np.ndarray] = None    # (H, W) uint8 block indices
+        self.preview: Optional[np.ndarray] = None       # (H', W') palette indices or (H', W', 3) RGB
+        self.encoded: Optional[bytes] = None
+        self.encoded_format: Optional[str] = None
+        self.result: Any = None
+        self.timings: Dict[str, float] = {}
+        self.stats: Dict[str, Any] = {}
+        self.start_time = time.time()
+
+    @property
+    def pixels(self) -> Optional[np.ndarray]:
+        return self._pixels
+
+    @pixels.setter
+    def pixels(self, pixels: Optional[np.ndarray]) -> None:
+        # Any stage that changes the pixels leaves a Lab copy out of date
+        self._pixels = pixels
+        self.lab = None
+
+    @property
+    def grid_size(self) -> Dict[str, int]:
+        height, width = self.index_grid.shape
+        return {"width": int(width), "height": int(height)}
+
+    def preview_rgb(self) -> np.ndarray:
+        """The rendered preview as an (H', W', 3) RGB array"""
+        if self.preview.ndim == 2:
+            return self.palette.preview_colors[self.preview]
+        return self.preview
+
+    @property
+    def grid(self) -> BlockGrid:
+        """The index grid as a BlockGrid on the matched palette"""
+        return BlockGrid(self.index_grid, self.palette)
+
+    def block_counts(self) -> Dict[str, int]:
+        """Number of each block used, counted from the index grid"""
+        return self.grid.counts()
+
+    def block_grid(self) -> List[List[Dict[str, Any]]]:
+        """Rows of {"name", "color"} for every block position"""
+        return self.grid.to_legacy()
+
+class Strategy:
+    """
+    A registered implementation of one stage
+    """
+    def __init__(self, stage_name: str, name: str, function: Callable):
+        self.stage = stage_name
+        self.name = name
+        self.function = function
+        # Keyword arguments the strategy accepts, filled from options and request params
+        self.parameters = [
+            parameter.name for parameter in list(inspect.signature(function).parameters.values())[1:]
+        ]
+
+_strategies: Dict[Tuple[str, str], Strategy] = {}
+
+def register_strategy(stage_name: str, name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator registering a function as a strategy for a stage
+
+    The function takes the PipelineContext followed by keyword arguments,
+    which are filled from the pipeline configuration and request parameters.
+
+    Args:
+        stage_name: One of STAGES
+        name: Strategy name used in pipeline configuration
+    """
+    if stage_name not in STAGES:
+        raise ValueError(f"Unknown pipeline stage: {stage_name}")
+
+    def decorator(function: Callable) -> Callable:
+        _strategies[(stage_name, name)] = Strategy(stage_name, name, function)
+        return function
+
+    return decorator
+
+def get_strategy(stage_name: str, name: str) -> Strategy:
+    # Built-in strategies register themselves on import
+    import services.pipeline_strategies  # noqa: F401
+
+    strategy = _strategies.get((stage_name, name))
+    if strategy is None:
+        raise ValueError(f"Unknown {stage_name} strategy: {name}")
+    return strategy
+
+class Step:
+    """
+    One configured stage of a pipeline: a strategy and its fixed options
+    """
+    def __init__(self, stage_name: str, strategy: str, options: Optional[Dict[str, Any]] = None):
+        self.strategy = get_strategy(stage_name, strategy)
+        self.options = options or {}
+
+        unknown = set(self.options) - set(self.strategy.parameters)
+        if unknown:
+            raise ValueError(f"Unknown options for {stage_name} strategy {strategy}: {sorted(unknown)}")
+
+    @property
+    def stage(self) -> str:
+        return self.strategy.stage
+
+    def arguments(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Configured options, overridden by any request parameters the strategy accepts"""
+        arguments = dict(self.options)
+        arguments.update({name: params[name] for name in self.strategy.parameters if name in params})
+        return arguments
+
+class Pipeline:
+    """
+    An ordered list of stage strategies
+    """
+    def __init__(self, name: str, steps: List[Step], cache: bool = False, description: str = ""):
+        """
+        Initialize the pipeline
+
+        Args:
+            name: Pipeline name, part of the result cache key
+            steps: Stages in the order they run
+            cache: Cache results of byte inputs in the on-disk result cache
+            description: Human-readable summary
+        """
+        seen = [step.stage for step in steps]
+        if len(set(seen)) != len(seen):
+            raise ValueError(f"Pipeline {name} runs a stage more than once: {seen}")
+
+        self.name = name
+        self.steps = steps
+        self.description = description
+        self.cache = ImageProcessingCache() if cache else None
+        self.parameters = {parameter for step in steps for parameter in step.strategy.parameters}
+        # Part of the result cache key, so changing the configuration invalidates old results
+        self.configuration = [[step.stage, step.strategy.name, step.options] for step in steps]
+
+    def run_context(
+        self,
+        source: Any,
+        stop_after: Optional[str] = None,
+        hooks: Optional[List[StageHook]] = None,
+        **params
+    ) -> PipelineContext:
+        """
+        Run the stages and return the full context
+
+        Args:
+            source: Input for the ingest stage
+            stop_after: Last stage to run (None runs them all)
+            hooks: Called after each stage with (stage name, context)
+            **params: Request parameters, passed to the strategies that accept them
+
+        Returns:
+            The PipelineContext after the last stage run
+        """
+        unknown = set(params) - self.parameters
+        if unknown:
+            raise TypeError(f"Pipeline {self.name} got unexpected parameters: {sorted(unknown)}")
+
+        context = PipelineContext(source, params)
+        progress = current_progress()
+        for step in self.steps:
+            if progress is not None:
+                progress.stage(step.stage)
+            start_time = time.perf_counter()
+            with stage(step.stage):
+                step.strategy.function(context, **step.arguments(params))
+            context.timings[step.stage] = time.perf_counter() - start_time
+
+            for hook in hooks or ():
+                hook(step.stage, context)
+            if step.stage == stop_after:
+                break
+        return context
+
+    def run(self, source: Any, use_cache: bool = True, hooks: Optional[List[StageHook]] = None, **params) -> Any:
+        """
+        Run the pipeline and return its export result
+
+        Args:
+            source: Input for the ingest stage
+            use_cache: Look byte inputs up in the result cache first
+            hooks: Called after each stage with (stage name, context)
+            **params: Request parameters
+
+        Returns:
+            Whatever the export stage produced
+        """
+        def compute() -> Any:
+            # Only a run that really computes enters the computation guard
+            return _guarded(lambda: self.run_context(source, hooks=hooks, **params).result)
+
+        if use_cache and self.cache is not None and isinstance(source, bytes):
+            # Concurrent identical requests share one run (see ImageProcessingCache.get_or_compute)
+            key = {"pipeline": self.name, "steps": self.configuration, "params": params}
+            guard = _computation_guard.get()
+            return self.cache.get_or_compute(source, key, compute, retry_on=guard[1] if guard else ())
+        return compute()
+
+def load_pipelines(path: Optional[str] = None) -> Dict[str, Pipeline]:
+    """
+    Build pipelines from a JSON configuration file
+
+    The file maps pipeline names to {"description", "cache", "stages"}, where
+    stages is an ordered list of {"stage", "strategy", "options"}.
+
+    Args:
+        path: Configuration file, PIPELINES_CONFIG by default
+
+    Returns:
+        Dictionary of pipeline name to Pipeline
+    """
+    with open(path or PIPELINES_CONFIG) as f:
+        config = json.load(f)
+
+    pipelines = {}
+    for name, definition in config.items():
+        steps = [Step(entry["stage"], entry["strategy"], entry.get("options")) for entry in definition["stages"]]
+        pipelines[name] = Pipeline(
+            name, steps,
+            cache=definition.get("cache", False),
+            description=definition.get("description", "")
+        )
+    return pipelines
+
+_pipelines: Optional[Dict[str, Pipeline]] = None
+_pipelines_lock = threading.Lock()
+
+def get_pipelines() -> Dict[str, Pipeline]:
+    """Return every configured pipeline, loading the configuration on first use"""
+    global _pipelines
+    if _pipelines is None:
+        with _pipelines_lock:
+            if _pipelines is None:
+                _pipelines = load_pipelines()
+    return _pipelines
+
+def get_pipeline(name: str) -> Pipeline:
+    """
+    Return a configured pipeline
+
+    Args:
+        name: Pipeline name from the configuration file
+
+    Returns:
+        The Pipeline
+    """
+    pipelines = get_pipelines()
+    if name not in pipelines:
+        raise ValueError(f"Unknown pipeline: {name}")
+    return pipelines[name]
@@ -0,0 +1,583 @@
+"""
+Built-in strategies for the conversion pipeline stages (see services/pipeline.py)
+
+Each strategy takes the PipelineContext and keyword options. Options come
+from the pipeline configuration and can be overridden per request.
+"""
+from PIL import Image
+import numpy as np
+from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import io
+import os
+import threading
+import time
+
+from services.pipeline import PipelineContext, register_strategy
+from services.color_space import SRGB_TO_LINEAR, linear_to_lab, linear_to_srgb
+from services.cost_model import DEFAULT_MAX_DELTA_E, EXECUTORS, all_plans, count_colors, get_cost_model
+from services.palette import get_block_palette
+from services.relief import (
+    DEFAULT_FILLER, DEFAULT_RELIEF_HEIGHT, ReliefVolume,
+    depth_lightness, image_lightness, lightness_heights, relief_summary, validate_filler
+)
+from services.progress import current_progress, progress_bands
+from services.preview_encoder import (
+    DEFAULT_PREVIEW_FORMAT, DEFAULT_COMPRESS_LEVEL,
+    render_index_preview, encode_preview
+)
+
+# --- ingest ----------------------------------------------------------------
+
+@register_strategy("ingest", "decode")
+def ingest_decode(context: PipelineContext) -> None:
+    """Decode image bytes, a file path or a PIL image into an RGB or RGBA image"""
+    source = context.source
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        image.load()
+
+    # Palette, greyscale and other modes are expanded so every later stage sees RGB(A)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.mode or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    context.image = image
+
+@register_strategy("ingest", "opencv_file")
+def ingest_opencv_file(context: PipelineContext) -> None:
+    """Read an image file with OpenCV straight into an RGB array (alpha is dropped)"""
+    # OpenCV is slow to import, so it is loaded on first use
+    import cv2
+
+    image = cv2.imread(context.source)
+    if image is None:
+        raise ValueError(f"Could not read image: {context.source}")
+    # OpenCV uses BGR channel order
+    context.pixels = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+# --- resize ----------------------------------------------------------------
+
+@register_strategy("resize", "fit_lanczos")
+def resize_fit_lanczos(
+    context: PipelineContext,
+    grid_size: int = 100,
+    max_width: Optional[int] = None,
+    max_height: Optional[int] = None
+) -> None:
+    """
+    Scale to fit within the grid, preserving aspect ratio, with LANCZOS
+
+    Args:
+        grid_size: Maximum width and height in blocks
+        max_width: Maximum width in blocks, if different from grid_size
+        max_height: Maximum height in blocks, if different from grid_size
+    """
+    image = context.image if context.pixels is None else Image.fromarray(context.pixels)
+    width, height = image.size
+    scale_factor = min((max_width or grid_size) / width, (max_height or grid_size) / height)
+    new_width = max(1, int(width * scale_factor))
+    new_height = max(1, int(height * scale_factor))
+
+    resized_image = image.resize((new_width, new_height), Image.LANCZOS)
+    if context.pixels is None:
+        context.image = resized_image
+    else:
+        context.pixels = np.asarray(resized_image)
+
+@register_strategy("resize", "linear_area")
+def resize_linear_area(
+    context: PipelineContext,
+    grid_size: int = 100,
+    max_width: Optional[int] = None,
+    max_height: Optional[int] = None
+) -> None:
+    """
+    Scale to fit within the grid by area averaging in linear light
+
+    Pixels go through the 256-entry sRGB-to-linear table, are composited
+    over white and averaged down in float32. Averaging sRGB values instead
+    darkens fine detail, because they are not proportional to light. The
+    result becomes the sRGB pixels plus their Lab values (context.lab) in
+    one vectorized pass, so Lab matching needs no further conversion.
+    Transparency is handled here, so no normalise stage is needed.
+
+    Args:
+        grid_size: Maximum width and height in blocks
+        max_width: Maximum width in blocks, if different from grid_size
+        max_height: Maximum height in blocks, if different from grid_size
+    """
+    import cv2
+
+    if context.pixels is None:
+        image = context.image
+        source = np.asarray(image if image.mode in ("RGB", "RGBA") else image.convert("RGBA"))
+        context.image = None
+    else:
+        source = context.pixels
+
+    height, width = source.shape[:2]
+    scale_factor = min((max_width or grid_size) / width, (max_height or grid_size) / height)
+    new_width = max(1, int(width * scale_factor))
+    new_height = max(1, int(height * scale_factor))
+
+    linear = SRGB_TO_LINEAR[source[:, :, :3]]
+    if source.shape[2] == 4:
+        # Composite over white in place: (linear - 1) * alpha + 1
+        alpha = source[:, :, 3:4] * np.float32(1 / 255)
+        linear -= 1
+        linear *= alpha
+        linear += 1
+        del alpha
+
+    linear = cv2.resize(linear, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    context.pixels = linear_to_srgb(linear)
+    context.lab = linear_to_lab(linear)
+
+@register_strategy("resize", "fit_long_side_area")
+def resize_fit_long_side_area(context: PipelineContext, grid_size: int = 64) -> None:
+    """
+    Scale the long side to exactly grid_size blocks with OpenCV area averaging
+
+    Args:
+        grid_size: Length of the long side in blocks
+    """
+    import cv2
+
+    if context.pixels is None:
+        context.pixels = np.asarray(context.image.convert("RGB"))
+        context.image = None
+
+    height, width = context.pixels.shape[:2]
+    aspect_ratio = width / height
+    if width > height:
+        new_width, new_height = grid_size, int(grid_size / aspect_ratio)
+    else:
+        new_width, new_height = int(grid_size * aspect_ratio), grid_size
+
+    context.pixels = cv2.resize(
+        context.pixels, (max(1, new_width), max(1, new_height)), interpolation=cv2.INTER_AREA
+    )
+
+# --- normalise -------------------------------------------------------------
+
+@register_strategy("normalise", "white_background")
+def normalise_white_background(context: PipelineContext) -> None:
+    """Convert to an RGB array, compositing transparent pixels over white"""
+    if context.pixels is not None:
+        return
+
+    np_image = np.array(context.image)
+    if np_image.shape[2] == 4:
+        alpha = np_image[:, :, 3]
+        rgb_image = np_image[:, :, :3]
+        mask = (alpha[:, :, np.newaxis] / 255.0)
+        white_background = np.ones_like(rgb_image) * 255
+        np_image = (rgb_image * mask + white_background * (1 - mask)).astype(np.uint8)
+
+    context.pixels = np_image
+    context.image = None
+
+@register_strategy("normalise", "drop_alpha")
+def normalise_drop_alpha(context: PipelineContext) -> None:
+    """Convert to an RGB array, ignoring any alpha channel"""
+    if context.pixels is not None:
+        return
+
+    context.pixels = np.ascontiguousarray(np.array(context.image)[:, :, :3])
+    context.image = None
+
+# --- quantize --------------------------------------------------------------
+
+def quantize_colors(np_image: np.ndarray, num_colors: int = 48) -> np.ndarray:
+    """
+    Reduce the number of colors using mini-batch k-means clustering
+
+    Args:
+        np_image: Image as numpy array
+        num_colors: Number of colors to reduce to
+
+    Returns:
+        Color-quantized image
+    """
+    h, w, d = np_image.shape
+    pixels = np_image.reshape(-1, d)
+
+    # sklearn is slow to import, so it is loaded on first use (see services/warmup.py)
+    from sklearn.cluster import MiniBatchKMeans
+
+    kmeans = MiniBatchKMeans(n_clusters=num_colors, batch_size=1000, random_state=42)
+    labels = kmeans.fit_predict(pixels)
+
+    # Map each pixel to its corresponding centroid
+    return kmeans.cluster_centers_[labels].reshape(h, w, d).astype(np.uint8)
+
+@register_strategy("quantize", "minibatch_kmeans")
+def quantize_minibatch_kmeans(context: PipelineContext, num_colors: int = 48) -> None:
+    """
+    Args:
+        num_colors: Number of colours to reduce to
+    """
+    context.pixels = quantize_colors(context.pixels, num_colors)
+
+@register_strategy("quantize", "adaptive_kmeans")
+def quantize_adaptive_kmeans(context: PipelineContext) -> None:
+    """
+    Pick the quantizer by image size
+
+    Large and medium grids are clustered to 32 and 24 colours. Small grids
+    keep their colours and get an edge-preserving smooth plus a sharpen.
+    """
+    np_image = context.pixels
+    height, width = np_image.shape[:2]
+
+    if width * height > 2500:
+        from sklearn.cluster import KMeans
+
+        kmeans = KMeans(n_clusters=32 if width * height > 10000 else 24, random_state=42, n_init=10)
+        kmeans.fit(np_image.reshape(-1, 3))
+        centers = kmeans.cluster_centers_.astype(int)
+        context.pixels = centers[kmeans.labels_].reshape(np_image.shape).astype(np.uint8)
+    else:
+        import cv2
+
+        smoothed = cv2.bilateralFilter(np_image, 9, 75, 75)
+        kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+        context.pixels = cv2.filter2D(smoothed, -1, kernel)
+
+@register_strategy("quantize", "none")
+def quantize_none(context: PipelineContext) -> None:
+    """Keep every colour"""
+
+@register_strategy("quantize", "auto")
+def quantize_auto(
+    context: PipelineContext,
+    num_colors: int = 48,
+    palette: str = "blocks",
+    max_delta_e: float = DEFAULT_MAX_DELTA_E,
+    preview_format: str = DEFAULT_PREVIEW_FORMAT
+) -> None:
+    """
+    Choose the quantizer, matcher and match executor with the cost model
+
+    The fastest plan within the quality target (services/cost_model.py) is
+    picked from the grid size, unique colours and palette size, and stored
+    in context.plan for match strategies configured with "auto". Threaded
+    plans are only considered when MATCH_THREADS allows more than one thread.
+
+    Args:
+        num_colors: Number of colours k-means reduces to
+        palette: Palette the match stage uses
+        max_delta_e: Largest acceptable mean colour error of the plan
+        preview_format: Preview format being encoded
+    """
+    height, width = context.pixels.shape[:2]
+    unique_colors = count_colors(context.pixels)
+    plan, seconds = get_cost_model().select(
+        cells=width * height,
+        unique_colors=unique_colors,
+        palette_size=len(get_block_palette(palette)),
+        encoder=preview_format,
+        max_delta_e=max_delta_e,
+        num_colors=num_colors,
+        plans=all_plans(executors=match_executors())
+    )
+    context.plan = plan
+    context.stats["plan"] = {**plan._asdict(), "predictedMs": round(seconds * 1000, 2), "uniqueColors": unique_colors}
+
+    if plan.quantizer == "minibatch_kmeans":
+        context.pixels = quantize_colors(context.pixels, num_colors)
+
+# --- match -----------------------------------------------------------------
+
+# Threads matching row bands in parallel (numpy releases the GIL)
+MATCH_THREADS = int(os.environ.get("MATCH_THREADS", max(1, min(8, (os.cpu_count() or 4) - 1))))
+
+def match_executors() -> Tuple[str, ...]:
+    """Match executors that differ on this machine ("threads" runs serially with one thread)"""
+    return EXECUTORS if MATCH_THREADS > 1 else ("serial",)
+
+_match_executor: Optional[ThreadPoolExecutor] = None
+_match_executor_lock = threading.Lock()
+
+def get_match_executor() -> ThreadPoolExecutor:
+    """Return the thread pool shared by threaded matching"""
+    global _match_executor
+    if _match_executor is None:
+        with _match_executor_lock:
+            if _match_executor is None:
+                _match_executor = ThreadPoolExecutor(max_workers=MATCH_THREADS, thread_name_prefix="match")
+    return _match_executor
+
+@register_strategy("match", "nearest")
+def match_nearest(
+    context: PipelineContext,
+    palette: str = "blocks",
+    metric: str = "rgb",
+    executor: str = "serial"
+) -> None:
+    """
+    Map every pixel to its closest block
+
+    Args:
+        palette: Block list, one of services.palette.PALETTE_SOURCES
+        metric: Colour metric, one of services.palette.COLOR_METRICS, or
+            "auto" for the plan chosen by the quantize stage
+        executor: "serial", "threads" (row bands on a thread pool) or "auto"
+    """
+    plan = context.plan
+    if metric == "auto":
+        metric = plan.matcher if plan is not None else "rgb"
+    if executor == "auto":
+        executor = plan.executor if plan is not None else "serial"
+    if executor not in ("serial", "threads"):
+        raise ValueError(f"Unknown match executor: {executor}")
+    context.palette = get_block_palette(palette, metric)
+
+    # Lab pixels from the resize stage are matched as they are
+    if metric == "lab" and context.lab is not None:
+        source, match = context.lab, context.palette.match_lab
+    else:
+        source, match = context.pixels, context.palette.match
+
+    progress = current_progress()
+    height = source.shape[0]
+    if executor == "threads" and height > 1 and MATCH_THREADS > 1:
+        edges = np.linspace(0, height, min(MATCH_THREADS, height) + 1).astype(int)
+        bands = list(get_match_executor().map(
+            lambda band: match(source[band[0]:band[1]]), zip(edges[:-1], edges[1:])
+        ))
+        if progress is not None:
+            progress.advance("match", height, height)
+        context.index_grid = np.concatenate(bands)
+        return
+
+    # Matched in row bands only while a client is listening for progress
+    bands = []
+    for start, end in progress_bands(height):
+        bands.append(match(source[start:end]))
+        if progress is not None:
+            progress.advance("match", end, height)
+    context.index_grid = bands[0] if len(bands) == 1 else np.concatenate(bands)
+
+# --- dither ----------------------------------------------------------------
+
+# 4x4 Bayer threshold matrix, centred on zero
+BAYER_4X4 = (np.array([
+    [0, 8, 2, 10],
+    [12, 4, 14, 6],
+    [3, 11, 1, 9],
+    [15, 7, 13, 5],
+]) + 0.5) / 16 - 0.5
+
+@register_strategy("dither", "ordered")
+def dither_ordered(context: PipelineContext, strength: float = 32.0) -> None:
+    """
+    Ordered (Bayer) dithering against the matched palette
+
+    A fixed threshold pattern is added to the pixels before matching again,
+    so smooth gradients alternate between neighbouring blocks. Unlike error
+    diffusion this is a single vectorized pass.
+
+    Args:
+        strength: Peak-to-peak size of the threshold offsets, in RGB units
+    """
+    height, width = context.pixels.shape[:2]
+    thresholds = np.tile(BAYER_4X4, (height // 4 + 1, width // 4 + 1))[:height, :width]
+    offset = (thresholds * strength)[:, :, np.newaxis]
+    dithered = np.clip(context.pixels.astype(np.float32) + offset, 0, 255).round().astype(np.uint8)
+    context.index_grid = context.palette.match(dithered)
+
+@register_strategy("dither", "none")
+def dither_none(context: PipelineContext) -> None:
+    """Keep the nearest-block grid"""
+
+# --- render ----------------------------------------------------------------
+
+@register_strategy("render", "index")
+def render_index(context: PipelineContext, output_scale: int = 4, grid_lines: str = "inner") -> None:
+    """
+    Scale the block grid up in palette index space
+
+    Args:
+        output_scale: Output pixels per block
+        grid_lines: "inner" draws one line between blocks (scales above 3),
+            "border" outlines every block (scales above 2), "none" draws none
+    """
+    if grid_lines not in ("inner", "border", "none"):
+        raise ValueError(f"Unknown grid line style: {grid_lines}")
+    line = context.palette.grid_line_index
+    progress = current_progress()
+    height = context.index_grid.shape[0]
+
+    bands = []
+    for start, end in progress_bands(height):
+        band = _render_index_band(context.index_grid[start:end], output_scale, grid_lines, line, end < height)
+        bands.append(band)
+        if progress is not None:
+            progress.advance("render", end, height)
+            progress.rows(start * output_scale, band, height * output_scale, context.palette.preview_colors)
+    context.preview = bands[0] if len(bands) == 1 else np.concatenate(bands)
+    context.stats["outputScale"] = output_scale
+
+def _render_index_band(index_rows: np.ndarray, output_scale: int, grid_lines: str, line: int, more_below: bool) -> np.ndarray:
+    """Render a band of grid rows exactly as those rows of the whole preview"""
+    if grid_lines == "inner":
+        inner_line = line if output_scale > 3 else None
+        preview = render_index_preview(index_rows, output_scale, inner_line)
+        if inner_line is not None and more_below:
+            # The line under the band's last block row separates it from the next band
+            preview[-1, :] = line
+        return preview
+
+    preview = render_index_preview(index_rows, output_scale)
+    if grid_lines == "border" and output_scale > 2:
+        for offset in (0, output_scale - 1):
+            preview[offset::output_scale, :] = line
+            preview[:, offset::output_scale] = line
+    return preview
+
+@register_strategy("render", "textured")
+def render_textured(context: PipelineContext) -> None:
+    """Draw every block with its 16x16 texture"""
+    from app.services.image_processing.processor import MINECRAFT_BLOCKS, BLOCK_TEXTURES_DIR, BLOCK_ATLAS_PATH
+    from app.services.image_processing.texture_atlas import (
+        get_texture_atlas, render_textured_preview, palette_from_blocks, TEXTURE_SIZE
+    )
+
+    blocks = palette_from_blocks(context.palette.blocks)
+    # BLOCK_ATLAS_PATH only ever holds the atlas of the basic palette
+    basic = [name for name, _ in blocks] == [name for name, _ in MINECRAFT_BLOCKS]
+    atlas = get_texture_atlas(blocks, BLOCK_TEXTURES_DIR, BLOCK_ATLAS_PATH if basic else None)
+
+    progress = current_progress()
+    height = context.index_grid.shape[0]
+    bands = []
+    for start, end in progress_bands(height):
+        bands.append(render_textured_preview(context.index_grid[start:end], atlas))
+        if progress is not None:
+            progress.advance("render", end, height)
+            progress.rows(start * TEXTURE_SIZE, bands[-1], height * TEXTURE_SIZE)
+    context.preview = bands[0] if len(bands) == 1 else np.concatenate(bands)
+    context.stats["outputScale"] = TEXTURE_SIZE
+
+# --- encode ----------------------------------------------------------------
+
+@register_strategy("encode", "preview")
+def encode_preview_image(
+    context: PipelineContext,
+    preview_format: str = DEFAULT_PREVIEW_FORMAT,
+    compress_level: int = DEFAULT_COMPRESS_LEVEL
+) -> None:
+    """
+    Encode the preview as PNG (indexed when rendered in index space) or lossless WebP
+
+    Args:
+        preview_format: "png" or "webp"
+        compress_level: PNG zlib level (0-9); for WebP the effort method (0-6)
+    """
+    encode_start = time.perf_counter()
+    if context.preview.ndim == 2:
+        context.encoded = encode_preview(context.preview, context.palette.preview_colors, preview_format, compress_level)
+    else:
+        buffered = io.BytesIO()
+        image = Image.fromarray(context.preview)
+        if preview_format == "png":
+            image.save(buffered, format="PNG", compress_level=max(0, min(9, compress_level)))
+        elif preview_format == "webp":
+            image.save(buffered, format="WEBP", lossless=True, method=max(0, min(6, compress_level)))
+        else:
+            raise ValueError(f"Unsupported preview format: {preview_format}")
+        context.encoded = buffered.getvalue()
+
+    context.encoded_format = preview_format
+    context.stats["previewStats"] = {
+        "bytes": len(context.encoded),
+        "encodeMs": round((time.perf_counter() - encode_start) * 1000, 2)
+    }
+
+# --- export ----------------------------------------------------------------
+
+@register_strategy("export", "result")
+def export_result(context: PipelineContext, block_grid: bool = False) -> None:
+    """
+    Build the API result dictionary
+
+    Args:
+        block_grid: Also include the {"name", "color"} grid of every block
+    """
+    result = {
+        "imageData": base64.b64encode(context.encoded).decode('utf-8'),
+        "imageFormat": context.encoded_format,
+        "previewStats": context.stats.get("previewStats"),
+        "blockCount": context.block_counts(),
+        "blockIndices": context.grid,
+        "gridSize": context.grid_size,
+        "outputScale": context.stats.get("outputScale"),
+    }
+    if block_grid:
+        # Expanded to {"name", "color"} rows only when serialized for the API
+        result["blockGrid"] = context.grid
+    if "plan" in context.stats:
+        result["plan"] = context.stats["plan"]
+    result["processingTime"] = round(time.time() - context.start_time, 2)
+    context.result = result
+
+@register_strategy("export", "relief")
+def export_relief(
+    context: PipelineContext,
+    relief_height: int = DEFAULT_RELIEF_HEIGHT,
+    filler: str = DEFAULT_FILLER,
+    invert: bool = False,
+    depth_image: Optional[bytes] = None
+) -> None:
+    """
+    Build the API result of a relief: the flat result plus column heights
+
+    Heights come from the lightness of the resized image, or from a depth
+    image when one is given. The schematic of the result is the 3D volume
+    (see services/relief.py), and block counts include the filler.
+
+    Args:
+        relief_height: Height of the lightest (or nearest) column in blocks
+        filler: Block name filling each column below its surface block
+        invert: Raise dark cells instead of light ones
+        depth_image: Encoded greyscale depth image, light is near
+    """
+    validate_filler(filler, get_block_palette().names)
+    export_result(context)
+    shape = context.index_grid.shape
+    if depth_image is not None:
+        lightness = depth_lightness(depth_image, shape)
+    else:
+        lightness = image_lightness(context.pixels, context.lab)
+    heights = lightness_heights(lightness, relief_height, invert=invert)
+
+    volume = ReliefVolume.from_grid(context.index_grid, heights, context.palette.names, filler=filler)
+    result = context.result
+    result["blockCount"] = volume.counts()
+    result["reliefHeights"] = heights
+    result["relief"] = relief_summary(heights, filler)
+    result["processingTime"] = round(time.time() - context.start_time, 2)
+
+@register_strategy("export", "file")
+def export_file(context: PipelineContext, output_path: Optional[str] = None) -> None:
+    """
+    Write the preview to a file; the result is the file path
+
+    Args:
+        output_path: Destination; a different extension than the encoded
+            format re-encodes the preview in the extension's format
+    """
+    if not output_path:
+        raise ValueError("The file export needs an output_path")
+
+    extension = os.path.splitext(output_path)[1].lstrip(".").lower()
+    if extension == context.encoded_format:
+        with open(output_path, "wb") as f:
+            f.write(context.encoded)
+    else:
+        Image.fromarray(context.preview_rgb()).save(output_path)
+    context.result = output_path
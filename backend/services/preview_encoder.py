@@ -0,0 +1,195 @@
+from PIL import Image
+import numpy as np
+from typing import Dict, List, Any, Optional, Sequence, Iterable
+import io
+import os
+import time
+
+# Supported preview encodings and their MIME types
+PREVIEW_FORMATS = {
+    "png": "image/png",    # Indexed ("P" mode) PNG using the block palette
+    "webp": "image/webp",  # Lossless WebP
+}
+
+# Deployment defaults, overridable per request
+DEFAULT_PREVIEW_FORMAT = os.environ.get("PREVIEW_FORMAT", "png")
+DEFAULT_COMPRESS_LEVEL = int(os.environ.get("PREVIEW_COMPRESS_LEVEL", "6"))
+
+# Colour used for the grid lines between blocks
+GRID_LINE_COLOR = (0, 0, 0)
+
+def render_index_preview(
+    index_grid: np.ndarray,
+    scale: int,
+    grid_line_index: Optional[int] = None
+) -> np.ndarray:
+    """
+    Scale a block index grid up to preview resolution without leaving index space
+
+    Args:
+        index_grid: (H, W) array of palette indices (or a BlockGrid)
+        scale: Output pixels per block
+        grid_line_index: Palette index to draw grid lines with (None for no lines)
+
+    Returns:
+        (H * scale, W * scale) uint8 array of palette indices
+    """
+    preview = np.repeat(np.repeat(np.asarray(index_grid, dtype=np.uint8), scale, axis=0), scale, axis=1)
+
+    if grid_line_index is not None:
+        # Last pixel row/column of every block except the final one
+        preview[scale - 1:-1:scale, :] = grid_line_index
+        preview[:, scale - 1:-1:scale] = grid_line_index
+
+    return preview
+
+def preview_palette(block_colors: Sequence[Sequence[int]]) -> np.ndarray:
+    """
+    Build the preview palette: every block colour plus the grid line colour
+
+    Args:
+        block_colors: RGB colour of each block, in palette index order
+
+    Returns:
+        (N + 1, 3) uint8 array; the last entry is the grid line colour
+    """
+    palette = np.asarray(list(block_colors) + [GRID_LINE_COLOR], dtype=np.uint8)
+    if len(palette) > 256:
+        raise ValueError(f"Indexed previews support at most 255 blocks, got {len(palette) - 1}")
+    return palette
+
+def encode_preview(
+    index_image: np.ndarray,
+    palette: np.ndarray,
+    image_format: str = DEFAULT_PREVIEW_FORMAT,
+    compress_level: int = DEFAULT_COMPRESS_LEVEL
+) -> bytes:
+    """
+    Encode an index-space preview image
+
+    Args:
+        index_image: (H, W) uint8 array of palette indices
+        palette: (N, 3) uint8 palette the indices refer to
+        image_format: One of PREVIEW_FORMATS
+        compress_level: PNG zlib level (0-9); for WebP the effort method (0-6)
+
+    Returns:
+        Encoded image bytes
+    """
+    height, width = index_image.shape
+    buffered = io.BytesIO()
+
+    if image_format == "png":
+        image = Image.frombytes("P", (width, height), np.ascontiguousarray(index_image, dtype=np.uint8).tobytes())
+        image.putpalette(palette.astype(np.uint8).tobytes())
+        image.save(buffered, format="PNG", compress_level=max(0, min(9, compress_level)))
+    elif image_format == "webp":
+        # WebP has no indexed mode, so expand through the palette first
+        image = Image.fromarray(palette[index_image])
+        image.save(buffered, format="WEBP", lossless=True, method=max(0, min(6, compress_level)))
+    else:
+        raise ValueError(f"Unsupported preview format: {image_format}")
+
+    return buffered.getvalue()
+
+def encode_animated_preview(
+    index_images: Iterable[np.ndarray],
+    durations: Sequence[int],
+    palette: np.ndarray
+) -> bytes:
+    """
+    Encode index-space frames as an animated GIF sharing the block palette
+
+    Args:
+        index_images: (H, W) uint8 palette index arrays, one per frame
+        durations: Display time of each frame in milliseconds
+        palette: (N, 3) uint8 palette the indices refer to
+
+    Returns:
+        Animated GIF bytes
+    """
+    palette_bytes = palette.astype(np.uint8).tobytes()
+
+    def to_image(index_image: np.ndarray) -> Image.Image:
+        height, width = index_image.shape
+        image = Image.frombytes("P", (width, height), np.ascontiguousarray(index_image, dtype=np.uint8).tobytes())
+        image.putpalette(palette_bytes)
+        return image
+
+    frames = (to_image(index_image) for index_image in index_images)
+    first_frame = next(frames)
+
+    buffered = io.BytesIO()
+    first_frame.save(
+        buffered,
+        format="GIF",
+        save_all=True,
+        append_images=frames,
+        duration=list(durations),
+        loop=0,
+        optimize=False
+    )
+    return buffered.getvalue()
+
+def compare_preview_encodings(
+    index_image: np.ndarray,
+    palette: np.ndarray,
+    compress_levels: Sequence[int] = (1, 6, 9)
+) -> List[Dict[str, Any]]:
+    """
+    Measure encode time and size for each preview format and compression level
+
+    The legacy full-colour optimized PNG is included as a baseline.
+
+    Args:
+        index_image: (H, W) uint8 array of palette indices
+        palette: (N, 3) uint8 palette
+        compress_levels: Compression levels to try for each format
+
+    Returns:
+        List of {"format", "compressLevel", "bytes", "encodeMs"} dicts, fastest first
+    """
+    report = []
+
+    start_time = time.perf_counter()
+    buffered = io.BytesIO()
+    Image.fromarray(palette[index_image]).save(buffered, format="PNG", optimize=True)
+    report.append({
+        "format": "png-rgb",
+        "compressLevel": None,
+        "bytes": buffered.tell(),
+        "encodeMs": round((time.perf_counter() - start_time) * 1000, 2)
+    })
+
+    for image_format in PREVIEW_FORMATS:
+        for level in compress_levels:
+            start_time = time.perf_counter()
+            data = encode_preview(index_image, palette, image_format, level)
+            report.append({
+                "format": image_format,
+                "compressLevel": level,
+                "bytes": len(data),
+                "encodeMs": round((time.perf_counter() - start_time) * 1000, 2)
+            })
+
+    return sorted(report, key=lambda entry: entry["encodeMs"])
+
+if __name__ == "__main__":
+    # Print an encoder comparison for a synthetic grid: python -m services.preview_encoder [grid_size]
+    import sys
+    from services.block_database import get_minecraft_blocks
+
+    grid_size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    block_colors = [block["color"] for block in get_minecraft_blocks()]
+    palette = preview_palette(block_colors)
+
+    rng = np.random.default_rng(42)
+    # Blocky noise so the grid has runs of equal blocks like real output
+    coarse = rng.integers(0, len(block_colors), size=(grid_size // 4 + 1, grid_size // 4 + 1))
+    index_grid = np.kron(coarse, np.ones((4, 4), dtype=coarse.dtype))[:grid_size, :grid_size]
+    index_image = render_index_preview(index_grid, 4, grid_line_index=len(block_colors))
+
+    print(f"{'format':<10}{'level':>7}{'bytes':>12}{'ms':>10}")
+    for entry in compare_preview_encodings(index_image, palette):
+        level = "-" if entry["compressLevel"] is None else entry["compressLevel"]
+        print(f"{entry['format']:<10}{level:>7}{entry['bytes']:>12}{entry['encodeMs']:>10}")
@@ -0,0 +1,135 @@
+from PIL import Image
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+import io
+import os
+import threading
+
+from services.block_database import get_minecraft_blocks
+from services.preview_encoder import render_index_preview, encode_preview
+from app.services.image_processing.processor import BLOCK_TEXTURES_DIR
+from app.services.image_processing.texture_atlas import (
+    get_texture_atlas, render_textured_preview, palette_from_blocks, TEXTURE_SIZE
+)
+
+# Edge length of a tile in pixels
+TILE_SIZE = 256
+
+# At zoom level z each block is drawn 2**z pixels wide; the deepest level
+# shows blocks at full texture resolution
+MAX_ZOOM = TEXTURE_SIZE.bit_length() - 1
+
+# Rendered tiles kept per process, shared by every result
+TILE_CACHE_ITEMS = int(os.environ.get("TILE_CACHE_ITEMS", "256"))
+
+class TileCache:
+    """
+    Least recently used cache of encoded tiles, keyed by (result id, z, x, y)
+
+    A result can have thousands of tiles, so they are bounded across all
+    results rather than kept with each one.
+    """
+    def __init__(self, max_items: int = TILE_CACHE_ITEMS):
+        """
+        Initialize the cache
+
+        Args:
+            max_items: Maximum number of tiles to keep before evicting the least recently used
+        """
+        self.max_items = max_items
+        self._tiles: "OrderedDict[Tuple[str, int, int, int], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, int, int, int]) -> Optional[Any]:
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: Tuple[str, int, int, int], tile: Any) -> None:
+        with self._lock:
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_items:
+                self._tiles.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+def blocks_per_tile(zoom: int) -> int:
+    """Number of blocks along each edge of a tile at the given zoom level"""
+    return TILE_SIZE >> zoom
+
+def tile_layout(width: int, height: int) -> Dict[str, Any]:
+    """
+    Describe the tile pyramid for a grid
+
+    Args:
+        width: Grid width in blocks
+        height: Grid height in blocks
+
+    Returns:
+        Dictionary with the tile size, maximum zoom and tile counts per level
+    """
+    levels = []
+    for zoom in range(MAX_ZOOM + 1):
+        span = blocks_per_tile(zoom)
+        levels.append({
+            "z": zoom,
+            "columns": -(-width // span),
+            "rows": -(-height // span),
+            "blockSize": 1 << zoom
+        })
+    return {"tileSize": TILE_SIZE, "maxZoom": MAX_ZOOM, "levels": levels}
+
+def _block_atlas() -> np.ndarray:
+    """Texture atlas for the block database palette"""
+    return get_texture_atlas(palette_from_blocks(get_minecraft_blocks()), BLOCK_TEXTURES_DIR)
+
+def render_tile(
+    index_grid: np.ndarray,
+    palette: np.ndarray,
+    zoom: int,
+    tile_x: int,
+    tile_y: int
+) -> bytes:
+    """
+    Render and encode one tile of the preview pyramid
+
+    Tiles on the right and bottom edges are cropped to the grid rather than padded.
+
+    Args:
+        index_grid: (H, W) array of palette indices (or a BlockGrid)
+        palette: Preview palette (block colours plus the grid line colour)
+        zoom: Zoom level, 0..MAX_ZOOM
+        tile_x: Tile column
+        tile_y: Tile row
+
+    Returns:
+        PNG bytes for the tile
+
+    Raises:
+        IndexError: If the tile lies outside the grid
+    """
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise IndexError(f"Zoom level must be between 0 and {MAX_ZOOM}")
+
+    span = blocks_per_tile(zoom)
+    index_grid = np.asarray(index_grid)
+    height, width = index_grid.shape
+    if tile_x < 0 or tile_y < 0 or tile_x * span >= width or tile_y * span >= height:
+        raise IndexError("Tile outside the grid")
+
+    region = index_grid[tile_y * span:(tile_y + 1) * span, tile_x * span:(tile_x + 1) * span]
+
+    if zoom == MAX_ZOOM:
+        # Full resolution tiles show the real block textures
+        buffered = io.BytesIO()
+        Image.fromarray(render_textured_preview(region, _block_atlas())).save(buffered, format="PNG")
+        return buffered.getvalue()
+
+    block_size = 1 << zoom
+    grid_line_index = len(palette) - 1 if block_size > 3 else None
+    return encode_preview(render_index_preview(region, block_size, grid_line_index), palette, "png")
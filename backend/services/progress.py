@@ -0,0 +1,126 @@
+import base64
+import contextvars
+import io
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Bands a reported loop is split into: enough for a smooth progress bar and
+# partial preview, few enough that the per-band overhead stays negligible
+PROGRESS_BANDS = 20
+
+# Minimum seconds between two percent events of the same stage
+MIN_EVENT_INTERVAL = 0.1
+
+ProgressEvent = Dict[str, Any]
+
+class ProgressReporter:
+    """
+    Turns pipeline progress into events for a listening client
+
+    Events are dictionaries with a "type" of "stage" (a stage started),
+    "progress" (percent of a stage's loop done) or "rows" (a band of the
+    preview finished, as a base64 PNG). Percent events are rate limited.
+    """
+    def __init__(
+        self,
+        emit: Callable[[ProgressEvent], None],
+        preview_rows: bool = True,
+        min_interval: float = MIN_EVENT_INTERVAL
+    ):
+        """
+        Initialize the reporter
+
+        Args:
+            emit: Called with every event, from the thread running the conversion
+            preview_rows: Send partial preview rows as the render stage finishes them
+            min_interval: Minimum seconds between percent events of a stage
+        """
+        self.emit = emit
+        self.preview_rows = preview_rows
+        self.min_interval = min_interval
+        self._last_percent: Tuple[Optional[str], int, float] = (None, -1, 0.0)
+
+    def stage(self, name: str) -> None:
+        """Report that a stage started"""
+        self.emit({"type": "stage", "stage": name})
+
+    def advance(self, stage_name: str, done: int, total: int) -> None:
+        """Report done out of total units of a stage's loop"""
+        percent = 100 * done // max(total, 1)
+        last_stage, last_percent, last_time = self._last_percent
+        now = time.perf_counter()
+        if stage_name == last_stage and percent < 100 and (
+            percent <= last_percent or now - last_time < self.min_interval
+        ):
+            return
+        self._last_percent = (stage_name, percent, now)
+        self.emit({"type": "progress", "stage": stage_name, "percent": percent})
+
+    def rows(self, y: int, rows: np.ndarray, total_height: int, palette: Optional[np.ndarray] = None) -> None:
+        """
+        Send a finished band of the preview
+
+        Args:
+            y: First preview row of the band
+            rows: (h, W) palette indices, or (h, W, 3) RGB
+            total_height: Height of the whole preview
+            palette: (N, 3) colours the indices refer to (for index rows)
+        """
+        if not self.preview_rows:
+            return
+        if rows.ndim == 2:
+            image = Image.frombytes("P", (rows.shape[1], rows.shape[0]), np.ascontiguousarray(rows, dtype=np.uint8).tobytes())
+            image.putpalette(palette.astype(np.uint8).tobytes())
+        else:
+            image = Image.fromarray(rows)
+        buffered = io.BytesIO()
+        # Speed matters more than size for throwaway partial previews
+        image.save(buffered, format="PNG", compress_level=1)
+        self.emit({
+            "type": "rows",
+            "y": int(y),
+            "height": int(rows.shape[0]),
+            "width": int(rows.shape[1]),
+            "totalHeight": int(total_height),
+            "imageData": base64.b64encode(buffered.getvalue()).decode("utf-8"),
+        })
+
+# Reporter for the conversion running in this context; None means nobody listens
+_current_progress: contextvars.ContextVar = contextvars.ContextVar("progress", default=None)
+
+def current_progress() -> Optional[ProgressReporter]:
+    """The active ProgressReporter, or None"""
+    return _current_progress.get()
+
+def progress_bands(total: int) -> List[Tuple[int, int]]:
+    """
+    Split a loop over total rows into (start, end) bands to report after
+
+    Returns a single band when no reporter is active, so unobserved
+    conversions keep running each stage as one vectorized call.
+    """
+    if _current_progress.get() is None or total <= 1:
+        return [(0, total)]
+    step = max(1, -(-total // PROGRESS_BANDS))
+    return [(start, min(start + step, total)) for start in range(0, total, step)]
+
+@contextmanager
+def report_progress(reporter: ProgressReporter) -> Iterator[ProgressReporter]:
+    """
+    Send the progress of everything run inside the block to reporter
+
+    Args:
+        reporter: Receives the events
+
+    Yields:
+        The reporter
+    """
+    token = _current_progress.set(reporter)
+    try:
+        yield reporter
+    finally:
+        _current_progress.reset(token)
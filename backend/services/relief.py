@@ -0,0 +1,306 @@
+"""
+Relief mode: a block grid raised into a 3D wall of columns
+
+Every grid cell becomes a column whose height comes from the image's
+lightness (or a separate depth image). The matched block caps the column
+and a filler block fills it down to the ground; everything above is air.
+
+Volumes are stored as column run-lengths: each column is one or two runs
+(filler, then surface) of (length, block), so memory grows with the number
+of columns rather than with their height. A 256x256 relief up to 64 blocks
+high takes under 1 MB instead of 8 MB of dense uint16 indices, and dense
+blocks are only produced a few layers at a time while writing a schematic.
+"""
+import io
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from services.color_space import srgb_to_lab
+
+# Tallest relief a request may ask for (a schematic's height is a short,
+# but builds taller than the world are of no use)
+MAX_RELIEF_HEIGHT = int(os.environ.get("MAX_RELIEF_HEIGHT", "256"))
+DEFAULT_RELIEF_HEIGHT = 32
+DEFAULT_FILLER = "Stone"
+AIR = "Air"
+
+# Layers expanded to dense blocks at a time when writing a schematic
+SECTION_HEIGHT = 16
+
+def lightness_heights(lightness: np.ndarray, max_height: int, invert: bool = False) -> np.ndarray:
+    """
+    Map a lightness or depth map to column heights
+
+    Args:
+        lightness: (H, W) values in [0, 1], light (or near) is high
+        max_height: Height of the lightest cell
+        invert: Make dark cells high instead
+
+    Returns:
+        (H, W) uint16 heights from 1 to max_height
+    """
+    if not 1 <= max_height <= MAX_RELIEF_HEIGHT:
+        raise ValueError(f"Relief height must be between 1 and {MAX_RELIEF_HEIGHT}")
+    values = np.clip(lightness, 0.0, 1.0)
+    if invert:
+        values = 1.0 - values
+    # Every column is at least one block, so the image surface is never lost
+    return (1 + np.rint(values * (max_height - 1))).astype(np.uint16)
+
+def image_lightness(pixels: np.ndarray, lab: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Perceptual lightness (CIE L*) of an RGB image, scaled to [0, 1]
+
+    Args:
+        pixels: (H, W, 3) uint8 sRGB pixels
+        lab: Their Lab values, if already computed (e.g. by the resize stage)
+    """
+    if lab is None:
+        lab = srgb_to_lab(pixels)
+    return lab[..., 0] / np.float32(100)
+
+def depth_lightness(depth_image: bytes, shape: Tuple[int, int]) -> np.ndarray:
+    """
+    Decode a depth image and fit it to the grid
+
+    Args:
+        depth_image: Encoded greyscale (or colour, read as luma) image bytes;
+            light is near. It is stretched to the grid, so it should have
+            the same aspect ratio as the source image.
+        shape: Grid (height, width)
+
+    Returns:
+        (height, width) float32 depth stretched to [0, 1]
+    """
+    try:
+        image = Image.open(io.BytesIO(depth_image))
+        image.load()
+    except Exception:
+        raise ValueError("Invalid depth image")
+
+    # 16-bit greyscale keeps its precision; everything else is read as luma
+    image = image.convert("F" if image.mode.startswith("I") else "L")
+    height, width = shape
+    depth = np.asarray(image.resize((width, height), Image.BOX), dtype=np.float32)
+
+    # Depth maps use arbitrary ranges, so the nearest point is always the top
+    low, high = float(depth.min()), float(depth.max())
+    return (depth - low) / np.float32(high - low) if high > low else np.ones_like(depth)
+
+class ReliefVolume:
+    """
+    A block volume stored as run-lengths of (y, then x/z) columns
+
+    Column c (row-major over the grid, c = z * width + x) is the runs
+    offsets[c]:offsets[c + 1], from the ground up. Cells above a column's
+    last run are air.
+    """
+    __slots__ = ("width", "length", "names", "offsets", "lengths", "blocks", "air")
+
+    def __init__(
+        self,
+        width: int,
+        length: int,
+        names: Sequence[str],
+        offsets: np.ndarray,
+        lengths: np.ndarray,
+        blocks: np.ndarray
+    ):
+        """
+        Initialize the volume
+
+        Args:
+            width: Columns along x
+            length: Columns along z
+            names: Block name for every palette index; must include AIR
+            offsets: (width * length + 1,) start of each column's runs
+            lengths: Blocks in each run
+            blocks: Palette index of each run
+        """
+        if len(offsets) != width * length + 1:
+            raise ValueError("A relief volume needs one run offset per column, plus one")
+        self.width = width
+        self.length = length
+        self.names = list(names)
+        self.offsets = offsets
+        self.lengths = lengths
+        self.blocks = blocks
+        self.air = self.names.index(AIR)
+
+    @classmethod
+    def from_grid(
+        cls,
+        index_grid: np.ndarray,
+        heights: np.ndarray,
+        names: Sequence[str],
+        filler: str = DEFAULT_FILLER,
+        surface_depth: int = 1
+    ) -> "ReliefVolume":
+        """
+        Raise a block grid into columns
+
+        Args:
+            index_grid: (H, W) palette indices of the surface blocks
+            heights: (H, W) column heights, at least 1
+            names: Block name for every palette index
+            filler: Block below the surface
+            surface_depth: Blocks of the matched colour at the top of each column
+
+        Returns:
+            The volume; image rows run along z and columns along x
+        """
+        if index_grid.shape != heights.shape:
+            raise ValueError(f"Heights {heights.shape} do not match the grid {index_grid.shape}")
+        if surface_depth < 1:
+            raise ValueError("The surface must be at least one block deep")
+
+        names = relief_names(names, filler)
+        filler_index = names.index(filler)
+
+        heights = heights.ravel().astype(np.uint16)
+        surface = np.minimum(heights, surface_depth).astype(np.uint16)
+        below = heights - surface
+        has_filler = below > 0
+
+        # One or two runs per column: filler (if any) then the surface
+        counts = 1 + has_filler
+        offsets = np.zeros(heights.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        dtype = np.uint8 if len(names) <= 256 else np.uint16
+        lengths = np.empty(offsets[-1], dtype=np.uint16)
+        blocks = np.empty(offsets[-1], dtype=dtype)
+
+        filler_runs = offsets[:-1][has_filler]
+        lengths[filler_runs] = below[has_filler]
+        blocks[filler_runs] = filler_index
+        surface_runs = offsets[1:] - 1
+        lengths[surface_runs] = surface
+        blocks[surface_runs] = index_grid.ravel()
+
+        length, width = index_grid.shape
+        return cls(width, length, names, offsets, lengths, blocks)
+
+    @property
+    def height(self) -> int:
+        """Height of the tallest column"""
+        return int(self.column_heights().max()) if self.offsets[-1] else 0
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        """(height, length, width), the axes of a dense [y, z, x] volume"""
+        return self.height, self.length, self.width
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.lengths.nbytes + self.blocks.nbytes
+
+    def _run_ends(self) -> np.ndarray:
+        """Cumulative run lengths, with a leading zero"""
+        ends = np.zeros(self.lengths.size + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=ends[1:])
+        return ends
+
+    def column_heights(self) -> np.ndarray:
+        """(length, width) blocks in each column"""
+        ends = self._run_ends()
+        return (ends[self.offsets[1:]] - ends[self.offsets[:-1]]).reshape(self.length, self.width)
+
+    def count_array(self) -> np.ndarray:
+        """Number of each palette index in the volume, air left out"""
+        counts = np.bincount(self.blocks, weights=self.lengths, minlength=len(self.names)).astype(np.int64)
+        counts[self.air] = 0
+        return counts
+
+    def counts(self) -> Dict[str, int]:
+        """Number of each block used, by name (air and absent blocks left out)"""
+        counts = self.count_array()
+        return {self.names[i]: int(counts[i]) for i in np.flatnonzero(counts)}
+
+    def used_indices(self) -> np.ndarray:
+        """Palette indices that occur, air included whenever any column is shorter than the volume"""
+        used = np.unique(self.blocks)
+        heights = self.column_heights()
+        if heights.size and heights.min() < heights.max():
+            used = np.union1d(used, [self.air])
+        return used
+
+    def sections(self, section_height: int = SECTION_HEIGHT) -> Iterator[np.ndarray]:
+        """
+        Dense [y, z, x] palette indices, a few layers at a time
+
+        Args:
+            section_height: Layers per section
+
+        Yields:
+            (layers, length, width) arrays from the ground up, air filled in
+        """
+        run_columns = np.repeat(np.arange(self.offsets.size - 1), np.diff(self.offsets))
+        # Run bottoms relative to their column's ground
+        ends = self._run_ends()
+        bottoms = ends[:-1] - ends[self.offsets[:-1]][run_columns]
+        tops = bottoms + self.lengths
+
+        height = self.height
+        for section_start in range(0, height, section_height):
+            section_end = min(section_start + section_height, height)
+            section = np.full(
+                (section_end - section_start, self.length * self.width), self.air, dtype=self.blocks.dtype
+            )
+
+            # Clip every run to the section and expand the overlapping ones to layers
+            starts = np.maximum(bottoms, section_start)
+            stops = np.minimum(tops, section_end)
+            overlapping = np.flatnonzero(stops > starts)
+            layers = stops[overlapping] - starts[overlapping]
+            run_of_layer = np.repeat(overlapping, layers)
+            first_layer = np.cumsum(layers) - layers
+            y = starts[run_of_layer] + np.arange(run_of_layer.size) - np.repeat(first_layer, layers)
+            section[y - section_start, run_columns[run_of_layer]] = self.blocks[run_of_layer]
+            yield section.reshape(-1, self.length, self.width)
+
+    def dense(self) -> np.ndarray:
+        """The whole (height, length, width) volume of palette indices"""
+        sections = list(self.sections())
+        if not sections:
+            return np.zeros((0, self.length, self.width), dtype=self.blocks.dtype)
+        return np.concatenate(sections)
+
+    def __repr__(self) -> str:
+        return f"ReliefVolume({self.width}x{self.length}x{self.height}, {self.offsets[-1]} runs)"
+
+def relief_names(names: Sequence[str], filler: str) -> List[str]:
+    """Palette names of a relief over a grid palette: the grid's, then filler and air if missing"""
+    names = list(names)
+    return names + [extra for extra in dict.fromkeys((filler, AIR)) if extra not in names]
+
+def relief_volume(result: Dict[str, Any]) -> ReliefVolume:
+    """
+    The volume of a stored relief result
+
+    Args:
+        result: Record with "indexGrid", "blockNames", "reliefHeights" and "reliefFiller"
+    """
+    return ReliefVolume.from_grid(
+        np.asarray(result["indexGrid"]),
+        np.asarray(result["reliefHeights"]),
+        result["blockNames"],
+        filler=result.get("reliefFiller") or DEFAULT_FILLER
+    )
+
+def relief_summary(heights: np.ndarray, filler: str) -> Dict[str, Any]:
+    """API summary of a relief: its size and filler"""
+    length, width = heights.shape
+    return {
+        "width": int(width),
+        "length": int(length),
+        "height": int(heights.max()) if heights.size else 0,
+        "filler": filler,
+    }
+
+def validate_filler(filler: str, names: Sequence[str]) -> None:
+    """Raise ValueError unless filler is a known block"""
+    if filler not in names:
+        raise ValueError(f"Unknown filler block: {filler}")
@@ -0,0 +1,356 @@
+import io
+import json
+from abc import ABC, abstractmethod
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+class ResultStore(ABC):
+    """
+    Interface for keeping processed results by id
+
+    A stored result is a dictionary holding at least "indexGrid" (a 2D numpy
+    array of palette indices), "palette", "gridSize" and "blockCount".
+    """
+    @abstractmethod
+    def get(self, result_id: str) -> Optional[Dict[str, Any]]:
+        """Return the result stored under result_id, or None"""
+
+    @abstractmethod
+    def put(self, result_id: str, result: Dict[str, Any]) -> None:
+        """Store a result under result_id"""
+
+    @abstractmethod
+    def delete(self, result_id: str) -> None:
+        """Remove a result if present"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of stored results"""
+
+    def put_preview(self, result_id: str, image_format: str, preview: Tuple[bytes, str]) -> None:
+        """
+        Keep a preview encoded after the result was stored
+
+        Stores that hand out the stored record itself already hold it, once
+        the caller added it to the record's "previews".
+
+        Args:
+            result_id: Result the preview belongs to
+            image_format: Preview format key
+            preview: (encoded bytes, etag)
+        """
+
+    def __contains__(self, result_id: str) -> bool:
+        return self.get(result_id) is not None
+
+class MemoryResultStore(ResultStore):
+    """
+    In-process result store that keeps the most recently used results
+    """
+    def __init__(self, max_items: int = 20):
+        """
+        Initialize the store
+
+        Args:
+            max_items: Maximum number of results to keep before evicting the least recently used
+        """
+        self.max_items = max_items
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, result_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            result = self._results.get(result_id)
+            if result is not None:
+                self._results.move_to_end(result_id)
+            return result
+
+    def put(self, result_id: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._results[result_id] = result
+            self._results.move_to_end(result_id)
+            while len(self._results) > self.max_items:
+                self._results.popitem(last=False)
+
+    def delete(self, result_id: str) -> None:
+        with self._lock:
+            self._results.pop(result_id, None)
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+class SqliteResultStore(ResultStore):
+    """
+    Result store shared by every worker process on a host
+
+    Metadata lives in a SQLite database (WAL mode, so workers can read while
+    another writes) and the bulky parts of each result in one blob file:
+    index grids as compressed .npy members and encoded previews as-is.
+    Results expire after a TTL, and the oldest-accessed are evicted once the
+    store exceeds its item or byte limit.
+
+    Records may hold JSON-serializable values, numpy arrays, lists of numpy
+    arrays (animation frames) and "previews", a dict of format to
+    (bytes, etag); previews encoded later are added with put_preview. Tiles
+    are not part of records: a tile is cheap to render, and a result can
+    have thousands. Recently read records are kept decoded in memory, so
+    repeated tile and preview requests do not re-read the blob; reads from memory still refresh the access time used for
+    eviction, at most once per access_interval.
+    """
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = 86400,
+        max_items: int = 1000,
+        max_bytes: int = 512 * 1024 * 1024,
+        memory_items: int = 8,
+        access_interval: float = 60
+    ):
+        """
+        Initialize the store
+
+        Args:
+            directory: Directory for the database and blob files
+            ttl: Seconds a result is kept after it was stored
+            max_items: Maximum number of results
+            max_bytes: Maximum total size of the blob files
+            memory_items: Decoded records kept in this process
+            access_interval: Seconds between access time updates of a record
+                read from memory
+        """
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.db_path = os.path.join(directory, "results.db")
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.access_interval = access_interval
+        self._memory = MemoryResultStore(max_items=memory_items)
+        self._local = threading.local()
+        # The database is only opened on first use: the store is created at
+        # import, and gunicorn's preload_app imports in the master before forking
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread and process
+
+        sqlite3 connections are not shared between threads, and must not be
+        used across fork: a child never touches a connection its parent
+        opened (it is kept referenced, not closed, so the parent's locks are
+        left alone) and opens its own.
+        """
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(os.getpid())
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " id TEXT PRIMARY KEY, created REAL NOT NULL, accessed REAL NOT NULL,"
+                " size INTEGER NOT NULL, meta TEXT NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            connections[os.getpid()] = connection
+        return connection
+
+    def _blob_path(self, result_id: str) -> str:
+        return os.path.join(self.blob_dir, f"{result_id}.zip")
+
+    def get(self, result_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        result = self._memory.get(result_id)
+        if result is not None:
+            if result["_created"] > now - self.ttl:
+                if result["_accessed"] <= now - self.access_interval:
+                    result["_accessed"] = now
+                    self._connection().execute("UPDATE results SET accessed = ? WHERE id = ?", (now, result_id))
+                return result
+            self._memory.delete(result_id)
+
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT meta, created FROM results WHERE id = ? AND created > ?", (result_id, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+
+        try:
+            with open(self._blob_path(result_id), "rb") as f:
+                result = _decode_record(json.loads(row[0]), f.read())
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            print(f"Dropping unreadable result {result_id}: {e}")
+            self.delete(result_id)
+            return None
+
+        result["_created"] = row[1]
+        result["_accessed"] = now
+        connection.execute("UPDATE results SET accessed = ? WHERE id = ?", (now, result_id))
+        self._memory.put(result_id, result)
+        return result
+
+    def put(self, result_id: str, result: Dict[str, Any]) -> None:
+        meta, blob = _encode_record(result)
+        path = self._blob_path(result_id)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(blob)
+        os.replace(temp_path, path)
+
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO results (id, created, accessed, size, meta) VALUES (?, ?, ?, ?, ?)",
+            (result_id, now, now, len(blob), json.dumps(meta))
+        )
+        self._memory.put(result_id, {**result, "_created": now, "_accessed": now})
+        self._evict(now)
+
+    def put_preview(self, result_id: str, image_format: str, preview: Tuple[bytes, str]) -> None:
+        """Add a preview to the stored blob, so other workers and later reads need not encode it"""
+        data, etag = preview
+        path = self._blob_path(result_id)
+        connection = self._connection()
+        # The write lock keeps concurrent additions from losing each other's blob or metadata
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT meta FROM results WHERE id = ?", (result_id,)).fetchone()
+            if row is None:
+                connection.execute("ROLLBACK")
+                return
+            meta = json.loads(row[0])
+            if image_format in meta["previewEtags"]:
+                connection.execute("ROLLBACK")
+                return
+
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(path, temp_path)
+            with zipfile.ZipFile(temp_path, "a") as blob:
+                blob.writestr(f"previews/{image_format}", data, zipfile.ZIP_STORED)
+            os.replace(temp_path, path)
+
+            meta["previewEtags"][image_format] = etag
+            connection.execute(
+                "UPDATE results SET meta = ?, size = ? WHERE id = ?",
+                (json.dumps(meta), os.path.getsize(path), result_id)
+            )
+            connection.execute("COMMIT")
+        except (OSError, zipfile.BadZipFile) as e:
+            connection.execute("ROLLBACK")
+            print(f"Failed to store {image_format} preview of {result_id}: {e}")
+            return
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        result = self._memory.get(result_id)
+        if result is not None:
+            result["previews"][image_format] = preview
+
+    def delete(self, result_id: str) -> None:
+        self._memory.delete(result_id)
+        self._connection().execute("DELETE FROM results WHERE id = ?", (result_id,))
+        try:
+            os.remove(self._blob_path(result_id))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, now: float) -> None:
+        """Drop expired results, then the least recently accessed until within the limits"""
+        connection = self._connection()
+        expired = [row[0] for row in connection.execute(
+            "SELECT id FROM results WHERE created <= ?", (now - self.ttl,)
+        )]
+
+        count, total_size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        overflow = []
+        if count > self.max_items or total_size > self.max_bytes:
+            for result_id, size in connection.execute(
+                "SELECT id, size FROM results WHERE created > ? ORDER BY accessed", (now - self.ttl,)
+            ):
+                if count - len(overflow) <= self.max_items and total_size <= self.max_bytes:
+                    break
+                overflow.append(result_id)
+                total_size -= size
+
+        for result_id in expired + overflow:
+            self.delete(result_id)
+
+    def __len__(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM results WHERE created > ?", (time.time() - self.ttl,)
+        ).fetchone()[0]
+
+def _array_bytes(array: np.ndarray) -> bytes:
+    buffered = io.BytesIO()
+    np.save(buffered, np.ascontiguousarray(array), allow_pickle=False)
+    return buffered.getvalue()
+
+def _encode_record(result: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+    """Split a record into JSON metadata and a zip blob of its arrays and previews"""
+    meta: Dict[str, Any] = {"arrays": [], "arrayLists": {}, "previewEtags": {}}
+    buffered = io.BytesIO()
+    with zipfile.ZipFile(buffered, "w") as blob:
+        for key, value in result.items():
+            if key in ("_created", "_accessed"):
+                continue
+            if isinstance(value, np.ndarray):
+                blob.writestr(f"{key}.npy", _array_bytes(value), zipfile.ZIP_DEFLATED)
+                meta["arrays"].append(key)
+            elif isinstance(value, list) and value and isinstance(value[0], np.ndarray):
+                for i, array in enumerate(value):
+                    blob.writestr(f"{key}/{i}.npy", _array_bytes(array), zipfile.ZIP_DEFLATED)
+                meta["arrayLists"][key] = len(value)
+            elif key == "previews":
+                for image_format, (data, etag) in value.items():
+                    # Encoded images are already compressed
+                    blob.writestr(f"previews/{image_format}", data, zipfile.ZIP_STORED)
+                    meta["previewEtags"][image_format] = etag
+            else:
+                meta.setdefault("fields", {})[key] = value
+    return meta, buffered.getvalue()
+
+def _decode_record(meta: Dict[str, Any], blob_data: bytes) -> Dict[str, Any]:
+    """Rebuild a record from _encode_record's metadata and blob"""
+    result = dict(meta.get("fields", {}))
+    with zipfile.ZipFile(io.BytesIO(blob_data)) as blob:
+        def load(name: str) -> np.ndarray:
+            return np.load(io.BytesIO(blob.read(name)), allow_pickle=False)
+
+        for key in meta["arrays"]:
+            result[key] = load(f"{key}.npy")
+        for key, length in meta["arrayLists"].items():
+            result[key] = [load(f"{key}/{i}.npy") for i in range(length)]
+        result["previews"] = {
+            image_format: (blob.read(f"previews/{image_format}"), etag)
+            for image_format, etag in meta["previewEtags"].items()
+        }
+    return result
+
+def create_result_store() -> ResultStore:
+    """
+    Build the result store selected by the environment
+
+    RESULT_STORE=sqlite (default) shares results between workers through
+    RESULT_STORE_DIR; RESULT_STORE=memory keeps them in this process only.
+    """
+    kind = os.environ.get("RESULT_STORE", "sqlite").lower()
+    if kind == "memory":
+        return MemoryResultStore(max_items=int(os.environ.get("MAX_STORED_RESULTS", "20")))
+    if kind != "sqlite":
+        raise ValueError(f"Unknown RESULT_STORE: {kind}")
+    return SqliteResultStore(
+        os.environ.get("RESULT_STORE_DIR", os.path.join("temp", "results")),
+        ttl=float(os.environ.get("RESULT_STORE_TTL", "86400")),
+        max_items=int(os.environ.get("RESULT_STORE_MAX_ITEMS", "1000")),
+        max_bytes=int(os.environ.get("RESULT_STORE_MAX_MB", "512")) * 1024 * 1024
+    )
@@ -0,0 +1,396 @@
+"""
+Per-client fair scheduling and rate limiting for conversions
+
+Conversions run in a fixed number of slots. Each client (an API key from
+data/client_limits.json, otherwise the client's address) has a token bucket
+that limits how much work it may submit, and queued conversions start in
+weighted fair queuing order: a client that submits hundreds of large jobs
+waits behind its own backlog instead of in front of everyone else's.
+
+Work is measured in cost units estimated from the image and grid size (see
+estimate_cost). A conversion's virtual finish time is its client's previous
+finish time (or the scheduler's virtual clock, if later) plus cost / weight,
+and the queued conversion with the earliest finish time starts first
+(self-clocked fair queuing).
+"""
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from services.admission import AdmissionRejected, grid_dimensions
+from services.metrics import registry
+
+CLIENT_LIMITS_PATH = os.environ.get(
+    "CLIENT_LIMITS_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "client_limits.json")
+)
+
+# Conversions running at once, and conversions allowed to wait for a slot
+SCHEDULER_SLOTS = int(os.environ.get("SCHEDULER_SLOTS", max(1, os.cpu_count() or 1)))
+SCHEDULER_QUEUE_SIZE = int(os.environ.get("SCHEDULER_QUEUE_SIZE", "64"))
+SCHEDULER_QUEUE_TIMEOUT = float(os.environ.get("SCHEDULER_QUEUE_TIMEOUT", "60"))
+
+# Use the first X-Forwarded-For address as the client. Only enable this when
+# every request comes through a proxy that overwrites the header with the
+# peer address (as the frontend's /api/process-image route does); otherwise
+# clients can pick their own rate limit key. Left off, every request the
+# frontend proxies shares the proxy's address and one bucket.
+SCHEDULER_TRUST_PROXY = os.environ.get("SCHEDULER_TRUST_PROXY", "0").lower() in ("1", "true", "yes", "on")
+
+# Cost units: one per source megapixel decoded plus one per 10,000 grid cells
+COST_PER_MEGAPIXEL = 1.0
+COST_PER_10K_CELLS = 1.0
+
+# Idle clients are forgotten once this many are tracked
+MAX_TRACKED_CLIENTS = 4096
+
+SCHEDULER_WAIT = registry.histogram(
+    "mcimage_scheduler_wait_seconds", "Time conversions waited for a scheduler slot"
+)
+SCHEDULER_REJECTIONS = registry.counter(
+    "mcimage_scheduler_rejections_total", "Conversions refused by the scheduler by reason", ("reason",)
+)
+SCHEDULER_QUEUE_DEPTH = registry.gauge(
+    "mcimage_scheduler_queue_depth", "Conversions waiting for a scheduler slot"
+)
+SCHEDULER_COST = registry.counter(
+    "mcimage_scheduler_cost_total", "Cost units of scheduled conversions, by default or custom client limits", ("limits",)
+)
+
+class ClientLimits(NamedTuple):
+    """
+    Rate limit and scheduling weight of a client
+
+    Attributes:
+        rate: Cost units the bucket refills per second
+        burst: Bucket size (cost units a client may submit at once)
+        weight: Share of the slots relative to other busy clients
+        max_queued: Conversions the client may have waiting at once
+    """
+    rate: float
+    burst: float
+    weight: float = 1.0
+    max_queued: int = 8
+
+DEFAULT_LIMITS = ClientLimits(rate=5.0, burst=60.0)
+
+def load_client_limits(path: str = CLIENT_LIMITS_PATH) -> Tuple[ClientLimits, Dict[str, ClientLimits]]:
+    """
+    Read the default and per-key limits
+
+    Args:
+        path: JSON file with a "default" entry and a "clients" object mapping
+            API keys to entries; entries hold any of rate, burst, weight and
+            maxQueued, and keys inherit missing fields from the default
+
+    Returns:
+        (default limits, limits by client key); DEFAULT_LIMITS if the file is missing
+    """
+    try:
+        with open(path, "r") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return DEFAULT_LIMITS, {}
+
+    def parse(entry: Mapping[str, Any], base: ClientLimits) -> ClientLimits:
+        return ClientLimits(
+            rate=float(entry.get("rate", base.rate)),
+            burst=float(entry.get("burst", base.burst)),
+            weight=float(entry.get("weight", base.weight)),
+            max_queued=int(entry.get("maxQueued", base.max_queued))
+        )
+
+    default = parse(config.get("default", {}), DEFAULT_LIMITS)
+    clients = {key: parse(entry, default) for key, entry in config.get("clients", {}).items()}
+    return default, clients
+
+def estimate_cost(width: int, height: int, grid_size: int = 100, frames: int = 1) -> float:
+    """
+    Estimate the work of a conversion from its image header and grid size
+
+    Args:
+        width: Source width in pixels
+        height: Source height in pixels
+        grid_size: Maximum grid size in blocks
+        frames: Number of animation frames
+
+    Returns:
+        Cost in units of one source megapixel or 10,000 grid cells
+    """
+    grid_width, grid_height = grid_dimensions(width, height, grid_size)
+    per_frame = (
+        width * height / 1e6 * COST_PER_MEGAPIXEL
+        + grid_width * grid_height / 1e4 * COST_PER_10K_CELLS
+    )
+    return per_frame * max(1, frames)
+
+class _TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+    def refill(self, limits: ClientLimits, now: float) -> None:
+        self.tokens = min(limits.burst, self.tokens + (now - self.updated) * limits.rate)
+        self.updated = now
+
+class FairScheduler:
+    """
+    Rate limits clients with token buckets and starts conversions in
+    weighted fair queuing order
+    """
+    def __init__(
+        self,
+        slots: int = SCHEDULER_SLOTS,
+        default_limits: ClientLimits = DEFAULT_LIMITS,
+        client_limits: Optional[Dict[str, ClientLimits]] = None,
+        max_queue: int = SCHEDULER_QUEUE_SIZE,
+        queue_timeout: float = SCHEDULER_QUEUE_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Initialize the scheduler
+
+        Args:
+            slots: Conversions allowed to run at once
+            default_limits: Limits of clients without their own entry
+            client_limits: Limits by API key (client keys "key:<api key>")
+            max_queue: Conversions allowed to wait in total
+            queue_timeout: Seconds a conversion may wait before it is rejected
+            clock: Time source (seconds)
+        """
+        self.slots = slots
+        self.default_limits = default_limits
+        self.client_limits = client_limits or {}
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.running = 0
+        self.virtual_time = 0.0
+        self._buckets: Dict[str, _TokenBucket] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._queued: Dict[str, int] = {}
+        self._served: Dict[str, float] = {}
+        # (virtual finish time, arrival order, ticket) of waiting conversions
+        self._queue: List[Tuple[float, int, object]] = []
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+
+    def client_key(self, headers: Mapping[str, str], address: Optional[str]) -> str:
+        """
+        Identify the client a request is scheduled and rate limited as
+
+        Args:
+            headers: Request headers (lower-case lookups, as Starlette's)
+            address: Peer address of the connection
+
+        Returns:
+            "key:<api key>" for an X-Client-Key listed in the limits, else "ip:<address>"
+        """
+        api_key = headers.get("x-client-key")
+        if api_key and api_key in self.client_limits:
+            return f"key:{api_key}"
+        if SCHEDULER_TRUST_PROXY and headers.get("x-forwarded-for"):
+            address = headers["x-forwarded-for"].split(",")[0].strip()
+        return f"ip:{address or 'unknown'}"
+
+    def limits_for(self, client: str) -> ClientLimits:
+        """Limits of a client key as returned by client_key"""
+        if client.startswith("key:"):
+            return self.client_limits.get(client[4:], self.default_limits)
+        return self.default_limits
+
+    def charge(self, client: str, cost: float, message: Optional[str] = None) -> None:
+        """
+        Take cost from a client's bucket up front, for work scheduled later with charge=False
+
+        Args:
+            client: Client key from client_key
+            cost: Total cost units of the work
+            message: Client message if the bucket is short
+
+        Raises:
+            AdmissionRejected: 429 if the client is over its rate limit
+        """
+        with self._condition:
+            self._charge(client, cost, self.limits_for(client), self.clock(), message)
+
+    @contextmanager
+    def schedule(self, client: str, cost: float, charge: bool = True) -> Iterator[None]:
+        """
+        Hold a conversion slot while the block runs, waiting for one in fair order
+
+        Args:
+            client: Client key from client_key
+            cost: Cost units from estimate_cost
+            charge: Take cost from the client's bucket (False if charge() already did)
+
+        Raises:
+            AdmissionRejected: 429 if the client is over its rate limit or has
+                too many conversions waiting, 503 if the queue is full or no
+                slot freed up within the queue timeout
+        """
+        limits = self.limits_for(client)
+        start = self.clock()
+        with self._condition:
+            # Charged on arrival, so the client's later conversions queue behind this one
+            if charge:
+                self._charge(client, cost, limits, start)
+            previous_finish = self._last_finish.get(client)
+            finish = max(self.virtual_time, previous_finish or 0.0) + cost / limits.weight
+            self._last_finish[client] = finish
+
+            if self._queue or self.running >= self.slots:
+                try:
+                    self._wait_for_slot(client, finish, limits, start)
+                except AdmissionRejected:
+                    self._refund(client, cost if charge else 0.0, limits, finish, previous_finish)
+                    raise
+            self.running += 1
+            self.virtual_time = max(self.virtual_time, finish)
+            self._served[client] = self._served.get(client, 0.0) + cost
+            self._forget_idle_clients()
+        SCHEDULER_WAIT.observe(self.clock() - start)
+        SCHEDULER_COST.inc(cost, limits="custom" if limits is not self.default_limits else "default")
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.running -= 1
+                self._condition.notify_all()
+
+    def _charge(
+        self, client: str, cost: float, limits: ClientLimits, now: float, message: Optional[str] = None
+    ) -> None:
+        """Take cost from the client's bucket (called with the lock held)"""
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = _TokenBucket(limits.burst, now)
+        bucket.refill(limits, now)
+
+        # A conversion larger than the bucket is let through once the bucket
+        # is full, leaving it in debt
+        needed = min(cost, limits.burst)
+        if bucket.tokens < needed:
+            SCHEDULER_REJECTIONS.inc(reason="rate_limited")
+            raise AdmissionRejected(
+                message or "Too many conversions from this client. Please slow down.",
+                status_code=429, retry_after=max(1, math.ceil((needed - bucket.tokens) / limits.rate))
+            )
+        bucket.tokens -= cost
+
+    def _refund(
+        self, client: str, cost: float, limits: ClientLimits, finish: float, previous_finish: Optional[float]
+    ) -> None:
+        """Undo the charge of a conversion that never got a slot (called with the lock held)"""
+        bucket = self._buckets.get(client)
+        if bucket is not None:
+            bucket.tokens = min(limits.burst, bucket.tokens + cost)
+        # Later conversions of the client may have queued behind this one; they keep their places
+        if self._last_finish.get(client) == finish:
+            if previous_finish is None:
+                del self._last_finish[client]
+            else:
+                self._last_finish[client] = previous_finish
+
+    def _wait_for_slot(self, client: str, finish: float, limits: ClientLimits, start: float) -> None:
+        """Queue until this conversion has the earliest finish time and a slot is free (called with the lock held)"""
+        if self._queued.get(client, 0) >= limits.max_queued:
+            SCHEDULER_REJECTIONS.inc(reason="client_queue_full")
+            raise AdmissionRejected(
+                "Too many conversions from this client are already waiting. Please try again shortly.",
+                status_code=429, retry_after=max(1, int(self.queue_timeout / 4))
+            )
+        if len(self._queue) >= self.max_queue:
+            SCHEDULER_REJECTIONS.inc(reason="queue_full")
+            raise AdmissionRejected(
+                "The server is busy converting other images. Please try again shortly.",
+                status_code=503, retry_after=max(1, int(self.queue_timeout / 4))
+            )
+
+        ticket = object()
+        entry = (finish, next(self._arrivals), ticket)
+        heapq.heappush(self._queue, entry)
+        self._queued[client] = self._queued.get(client, 0) + 1
+        SCHEDULER_QUEUE_DEPTH.set(len(self._queue))
+        deadline = start + self.queue_timeout
+        try:
+            while self._queue[0][2] is not ticket or self.running >= self.slots:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    SCHEDULER_REJECTIONS.inc(reason="timeout")
+                    raise AdmissionRejected(
+                        "The server is busy converting other images. Please try again shortly.",
+                        status_code=503, retry_after=max(1, int(self.queue_timeout / 4))
+                    )
+                self._condition.wait(remaining)
+        finally:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._queued[client] -= 1
+            if not self._queued[client]:
+                del self._queued[client]
+            SCHEDULER_QUEUE_DEPTH.set(len(self._queue))
+            # The next conversion in line may start now
+            self._condition.notify_all()
+
+    def _forget_idle_clients(self) -> None:
+        """Drop state of clients with no backlog and a full bucket (called with the lock held)"""
+        if len(self._buckets) <= MAX_TRACKED_CLIENTS:
+            return
+        now = self.clock()
+        for client in list(self._buckets):
+            limits = self.limits_for(client)
+            self._buckets[client].refill(limits, now)
+            idle = client not in self._queued and self._last_finish.get(client, 0.0) <= self.virtual_time
+            if idle and self._buckets[client].tokens >= limits.burst:
+                del self._buckets[client]
+                self._last_finish.pop(client, None)
+                self._served.pop(client, None)
+
+    def status(self, top: int = 10) -> Dict[str, Any]:
+        """Slots, queue and the busiest clients, for the admission endpoint"""
+        with self._condition:
+            busiest = sorted(self._served.items(), key=lambda item: -item[1])[:top]
+            return {
+                "slots": self.slots,
+                "running": self.running,
+                "queued": len(self._queue),
+                "virtualTime": round(self.virtual_time, 3),
+                "clients": [
+                    {
+                        "client": _display_key(client),
+                        "cost": round(cost, 3),
+                        "queued": self._queued.get(client, 0),
+                        "tokens": round(self._buckets[client].tokens, 3) if client in self._buckets else None,
+                    }
+                    for client, cost in busiest
+                ],
+            }
+
+def _display_key(client: str) -> str:
+    """Client key with most of an API key hidden"""
+    if client.startswith("key:"):
+        return f"key:{client[4:8]}..."
+    return client
+
+_scheduler: Optional[FairScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> FairScheduler:
+    """Return the process-wide scheduler, with limits from CLIENT_LIMITS_PATH"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                default_limits, client_limits = load_client_limits()
+                _scheduler = FairScheduler(default_limits=default_limits, client_limits=client_limits)
+    return _scheduler
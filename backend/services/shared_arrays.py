@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+# Where arrays shared between worker processes are written. Every worker
+# memory-maps the same files, so the data is held once in the page cache.
+SHARED_DATA_DIR = os.environ.get("SHARED_DATA_DIR", os.path.join("temp", "shared"))
+
+def data_fingerprint(*parts: Any) -> str:
+    """Short hash of JSON-serializable inputs, used to version shared files"""
+    payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.md5(payload).hexdigest()[:12]
+
+def shared_path(name: str, fingerprint: str, directory: Optional[str] = None) -> str:
+    return os.path.join(directory or SHARED_DATA_DIR, f"{name}-{fingerprint}.npy")
+
+def save_atomic(path: str, array: np.ndarray) -> None:
+    """
+    Write an .npy file so readers never see it half written
+
+    Concurrent writers (workers starting together) each write a private
+    temporary file and rename it into place; the last rename wins and every
+    version is identical.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(temp_path, path)
+
+def save_exclusive(path: str, array: np.ndarray) -> bool:
+    """
+    Write an .npy file only if none exists yet
+
+    The file is written privately and hard-linked into place, which fails
+    instead of replacing a file another process created in the meantime. Use
+    this for files that are mapped writable: replacing one would leave its
+    earlier mappers writing to an orphaned copy.
+
+    Returns:
+        Whether this call created the file
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, array)
+    try:
+        os.link(temp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(temp_path)
+
+def shared_array(name: str, fingerprint: str, build: Callable[[], np.ndarray]) -> np.ndarray:
+    """
+    Return a read-only array backed by a shared memory-mapped file
+
+    The first process to ask builds the array and writes the file; later
+    processes (and restarts) map it without rebuilding. Falls back to the
+    built in-memory array if the file cannot be written.
+
+    Args:
+        name: File name prefix
+        fingerprint: Version of the inputs the array is built from
+        build: Builds the array when no file exists
+
+    Returns:
+        Read-only array
+    """
+    path = shared_path(name, fingerprint)
+    if not os.path.isfile(path):
+        array = np.ascontiguousarray(build())
+        try:
+            save_atomic(path, array)
+        except OSError as e:
+            print(f"Failed to write shared array {path}: {e}")
+            array.setflags(write=False)
+            return array
+    return np.asarray(np.load(path, mmap_mode="r"))
+
+def shared_table(name: str, fingerprint: str, size: int, fill: int) -> np.ndarray:
+    """
+    Return a writable uint8 table shared by every process that maps it
+
+    Used for lookup tables that are filled in lazily. The mapping is shared,
+    so a value written by one worker is visible to all of them. Writers must
+    only ever store the value every other writer would store.
+
+    Args:
+        name: File name prefix
+        fingerprint: Version of the inputs the table values depend on
+        size: Number of entries
+        fill: Initial value meaning "not computed yet"
+
+    Returns:
+        (size,) uint8 array, memory-mapped when possible
+    """
+    path = shared_path(name, fingerprint)
+    try:
+        if not os.path.isfile(path):
+            # Workers starting together all get here; the first file wins and the others map it
+            save_exclusive(path, np.full(size, fill, dtype=np.uint8))
+        return np.asarray(np.load(path, mmap_mode="r+"))
+    except OSError as e:
+        print(f"Failed to map shared table {path}, using a private one: {e}")
+        return np.full(size, fill, dtype=np.uint8)
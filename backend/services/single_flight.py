@@ -0,0 +1,181 @@
+"""
+Single-flight execution: identical concurrent requests share one computation
+
+Calls with the same key that overlap in time are coalesced. Within a
+process, the first caller (the leader) computes and the others wait for its
+result. Across worker processes on a host, leaders take an exclusive lock on
+a per-key file; a worker that finds the key locked waits for the lock and
+then reads the result the other worker stored (e.g. in the on-disk result
+cache) instead of computing it again.
+"""
+import copy
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Type, TypeVar
+
+from services.metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the process only
+    fcntl = None
+
+T = TypeVar("T")
+
+# Longest a worker waits for another worker's computation before doing it itself
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "120"))
+LOCK_POLL_INTERVAL = 0.05
+
+SINGLE_FLIGHT_CALLS = registry.counter(
+    "mcimage_single_flight_total",
+    "Computations by outcome: leader (computed), coalesced within the process or from another worker",
+    ("outcome",)
+)
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Coalesces overlapping calls that share a key
+    """
+    def __init__(self, lock_dir: Optional[str] = None, timeout: float = SINGLE_FLIGHT_TIMEOUT):
+        """
+        Initialize the group
+
+        Args:
+            lock_dir: Directory for the per-key lock files that coalesce
+                across processes (None for within the process only)
+            timeout: Seconds to wait for another process before computing anyway
+        """
+        self.lock_dir = Path(lock_dir) if lock_dir is not None and fcntl is not None else None
+        if self.lock_dir is not None:
+            self.lock_dir.mkdir(exist_ok=True, parents=True)
+        self.timeout = timeout
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self,
+        key: str,
+        compute: Callable[[], T],
+        reuse: Optional[Callable[[], Optional[T]]] = None,
+        retry_on: Tuple[Type[BaseException], ...] = ()
+    ) -> T:
+        """
+        Return compute()'s result, sharing it with overlapping calls for key
+
+        Args:
+            key: Identity of the computation (content and parameter hash)
+            compute: Produces the result; it should also store it where
+                reuse can find it
+            reuse: Looks up a result another process stored, or returns None
+            retry_on: Errors that concern the leader's call rather than the
+                computation (e.g. its client being rate limited); callers
+                that waited for it run their own compute instead of raising them
+
+        Returns:
+            The result; callers that waited get a shallow copy, so each may
+            set its own top-level fields
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+
+            call.done.wait()
+            if isinstance(call.error, retry_on):
+                continue
+            SINGLE_FLIGHT_CALLS.inc(outcome="coalesced")
+            if call.error is not None:
+                raise call.error
+            return copy.copy(call.result)
+
+        try:
+            call.result = self._run_locked(key, compute, reuse)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_locked(self, key: str, compute: Callable[[], T], reuse: Optional[Callable[[], Optional[T]]]) -> T:
+        """
+        Compute while holding the key's lock file, or reuse another process's result
+
+        The holder removes the lock file once its result is stored, so lock
+        files do not pile up with every distinct key. A waiter that then gets
+        the lock on the removed file locks the file now at the path instead.
+        """
+        if self.lock_dir is None:
+            SINGLE_FLIGHT_CALLS.inc(outcome="leader")
+            return compute()
+
+        path = self.lock_dir / f"{hashlib.sha1(key.encode()).hexdigest()}.lock"
+        waited = False
+        deadline = time.monotonic() + self.timeout
+        while True:
+            lock_file = open(path, "a")
+            locked = _try_lock(lock_file)
+            if not locked:
+                # Another worker is computing: wait for it to finish
+                waited = True
+                while not locked and time.monotonic() < deadline:
+                    time.sleep(LOCK_POLL_INTERVAL)
+                    locked = _try_lock(lock_file)
+            if locked and not _is_current(lock_file, path):
+                lock_file.close()
+                continue
+            break
+
+        try:
+            if waited and reuse is not None:
+                result = reuse()
+                if result is not None:
+                    SINGLE_FLIGHT_CALLS.inc(outcome="coalesced_worker")
+                    return result
+            SINGLE_FLIGHT_CALLS.inc(outcome="leader")
+            return compute()
+        finally:
+            if locked:
+                # Removed while still locked, so no other worker can hold a lock on this file
+                if _is_current(lock_file, path):
+                    os.remove(path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def in_flight(self) -> int:
+        """Number of keys being computed in this process"""
+        with self._lock:
+            return len(self._calls)
+
+def _is_current(lock_file: Any, path: Path) -> bool:
+    """Whether an open lock file is still the file at path (not removed by its last holder)"""
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(lock_file.fileno())
+    return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+def _try_lock(lock_file: Any) -> bool:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
@@ -0,0 +1,60 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+class StageTimings:
+    """
+    Wall-clock time spent in each named pipeline stage
+    """
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        """Accumulate time for a stage (stages may run more than once)"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+# Collector for the current request or benchmark run; None means timing is off
+_current_timings: contextvars.ContextVar = contextvars.ContextVar("stage_timings", default=None)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a block of pipeline code as the named stage
+
+    Does nothing beyond one context variable lookup when no collector is active.
+
+    Args:
+        name: Stage name, e.g. "ingest", "resize", "quantize", "match", "render", "encode"
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start_time)
+
+@contextmanager
+def collect_stage_timings(timings: Optional[StageTimings] = None) -> Iterator[StageTimings]:
+    """
+    Collect the stage timings of everything run inside the block
+
+    Args:
+        timings: Existing collector to add to, or None to start a new one
+
+    Yields:
+        The StageTimings being filled in
+    """
+    timings = timings if timings is not None else StageTimings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
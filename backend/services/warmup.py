@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+# "background" warms up after startup without delaying the health check,
+# "blocking" finishes warming before the app accepts requests, "off" skips it
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "background").lower()
+
+def _import_sklearn() -> None:
+    import sklearn.cluster  # noqa: F401
+
+def _import_cv2() -> None:
+    import cv2  # noqa: F401
+
+def _block_palette() -> None:
+    from services.palette import get_block_palette
+    get_block_palette().warm()
+
+def _pipelines() -> None:
+    # Load the pipeline configuration and every palette its match stages use
+    from services.cost_model import MATCHERS, get_cost_model
+    from services.palette import get_block_palette
+    from services.pipeline import get_pipelines
+    for pipeline in get_pipelines().values():
+        for step in pipeline.steps:
+            if step.stage == "match":
+                metric = step.options.get("metric", "rgb")
+                # The cost model may pick any matcher for "auto"
+                for name in MATCHERS if metric == "auto" else (metric,):
+                    get_block_palette(step.options.get("palette", "blocks"), name)
+            elif step.stage == "quantize" and step.strategy.name == "auto":
+                get_cost_model()
+
+def _kmeans() -> None:
+    # The first fit initialises sklearn's validation and thread pools
+    from sklearn.cluster import MiniBatchKMeans
+    pixels = np.random.default_rng(0).integers(0, 256, size=(256, 3)).astype(np.float64)
+    MiniBatchKMeans(n_clusters=8, batch_size=256, random_state=42).fit(pixels)
+
+def _tile_atlas() -> None:
+    from services.preview_tiles import _block_atlas
+    _block_atlas()
+
+def _texture_atlas() -> None:
+    from app.services.image_processing.processor import MINECRAFT_BLOCKS, BLOCK_TEXTURES_DIR, BLOCK_ATLAS_PATH
+    from app.services.image_processing.texture_atlas import get_texture_atlas
+    get_texture_atlas(MINECRAFT_BLOCKS, BLOCK_TEXTURES_DIR, BLOCK_ATLAS_PATH)
+
+# Warm-up steps by name, run in the order given by each app
+WARMUP_STEPS: Dict[str, Callable[[], None]] = {
+    "sklearn": _import_sklearn,
+    "cv2": _import_cv2,
+    "palette": _block_palette,
+    "pipelines": _pipelines,
+    "kmeans": _kmeans,
+    "tile_atlas": _tile_atlas,
+    "texture_atlas": _texture_atlas,
+}
+
+class WarmUp:
+    """
+    Pre-loads heavy imports and lookup structures, recording how long each took
+
+    The state goes from "cold" through "warming" to "warm", or to "degraded"
+    when a step failed; a later run() retries the failed steps.
+    """
+    def __init__(self, steps: Sequence[str]):
+        unknown = set(steps) - set(WARMUP_STEPS)
+        if unknown:
+            raise ValueError(f"Unknown warm-up steps: {', '.join(sorted(unknown))}")
+        self.steps = list(steps)
+        self.state = "cold"
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self) -> Dict[str, Any]:
+        """Run every step not yet done, failed ones included (safe to call more than once)"""
+        with self._lock:
+            if self.state != "warm":
+                self.state = "warming"
+                for name in self.steps:
+                    if name in self.timings:
+                        continue
+                    start_time = time.perf_counter()
+                    try:
+                        WARMUP_STEPS[name]()
+                    except Exception as e:
+                        # A failed step just leaves its cost to the first request
+                        print(f"Warm-up step {name} failed: {e}")
+                        self.errors[name] = str(e)
+                        continue
+                    self.timings[name] = round((time.perf_counter() - start_time) * 1000, 1)
+                    self.errors.pop(name, None)
+                self.state = "degraded" if self.errors else "warm"
+        return self.status()
+
+    def start_background(self) -> None:
+        """Run the warm-up in a daemon thread so startup is not delayed"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def on_startup(self) -> None:
+        """Apply WARMUP_ON_STARTUP"""
+        if WARMUP_ON_STARTUP == "blocking":
+            self.run()
+        elif WARMUP_ON_STARTUP != "off":
+            self.start_background()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "stepsMs": dict(self.timings),
+            "totalMs": round(sum(self.timings.values()), 1),
+            "errors": dict(self.errors),
+        }
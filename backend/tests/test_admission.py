@@ -0,0 +1,129 @@
+import pytest
+import os
+import sys
+import io
+import threading
+import time
+import numpy as np
+from PIL import Image
+from fastapi.testclient import TestClient
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.admission as admission
+from services.admission import AdmissionController, AdmissionRejected, estimate_peak_bytes
+from main_optimized import app
+
+client = TestClient(app)
+
+def test_admit_queue_and_reject():
+    """Test requests wait for memory in order and are rejected when they cannot be served"""
+    controller = AdmissionController(budget_bytes=100, max_queue=1, queue_timeout=5, calibrate=False)
+    order = []
+    release_first = threading.Event()
+
+    def first():
+        with controller.admit(60):
+            order.append("first")
+            release_first.wait(5)
+
+    def second():
+        with controller.admit(60):
+            order.append("second")
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    threads[0].start()
+    while controller.in_flight == 0:
+        time.sleep(0.01)
+    threads[1].start()
+    while controller.status()["queued"] == 0:
+        time.sleep(0.01)
+
+    # Queue full, and a request over the whole budget never fits
+    with pytest.raises(AdmissionRejected) as busy:
+        with controller.admit(10):
+            pass
+    assert busy.value.status_code == 503 and busy.value.retry_after
+    with pytest.raises(AdmissionRejected) as too_large:
+        with controller.admit(101):
+            pass
+    assert too_large.value.status_code == 413
+
+    release_first.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["first", "second"]
+    assert controller.reserved == 0 and controller.in_flight == 0
+
+def test_calibration_scales_estimates():
+    """Test measured peaks pull the estimate towards reality"""
+    controller = AdmissionController(budget_bytes=1 << 30, calibrate=True)
+    raw = estimate_peak_bytes(1000, 800, grid_size=100)
+    assert controller.estimate(1000, 800, grid_size=100) == raw
+
+    for _ in range(admission.CALIBRATION_MIN_SAMPLES):
+        controller.record_peak(raw, raw * 2)
+    assert controller.correction == pytest.approx(2.0)
+    assert controller.estimate(1000, 800, grid_size=100) == pytest.approx(raw * 2, rel=1e-6)
+    assert estimate_peak_bytes(2000, 1600, grid_size=100) > raw
+
+def test_peak_measurement_sampled_outside_lock(monkeypatch):
+    """Test solo conversions are measured one in N once calibrated, without holding the lock"""
+    controller = AdmissionController(budget_bytes=1 << 30)
+    resets = []
+
+    def reset_peak_rss():
+        # Another thread can take the lock while the peak is being reset
+        free = []
+        def try_lock():
+            free.append(controller._condition.acquire(blocking=False))
+            if free[0]:
+                controller._condition.release()
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        assert free == [True]
+        resets.append(1)
+        return 0
+
+    monkeypatch.setattr(admission, "_reset_peak_rss", reset_peak_rss)
+    monkeypatch.setattr(admission, "_read_status_kb", lambda *fields: {"VmHWM": 2048})
+
+    solo_runs = admission.CALIBRATION_SKIP_FIRST + admission.CALIBRATION_MIN_SAMPLES
+    for _ in range(solo_runs):
+        with controller.admit(1024):
+            pass
+    assert len(resets) == solo_runs
+    assert len(controller.samples) == admission.CALIBRATION_MIN_SAMPLES
+
+    for _ in range(admission.CALIBRATION_SAMPLE_EVERY * 3):
+        with controller.admit(1024):
+            pass
+    assert len(resets) == solo_runs + 3
+
+    # A full sample window stops measuring
+    for _ in range(admission.CALIBRATION_MAX_SAMPLES):
+        controller.record_peak(1024, 2048)
+    for _ in range(admission.CALIBRATION_SAMPLE_EVERY):
+        with controller.admit(1024):
+            pass
+    assert len(resets) == solo_runs + 3
+
+def test_process_image_rejects_over_budget(monkeypatch):
+    """Test the API answers 413 with a message when an image cannot fit the memory budget"""
+    monkeypatch.setattr(admission, "_controller", AdmissionController(budget_bytes=1024 * 1024))
+    buffered = io.BytesIO()
+    Image.fromarray(np.zeros((200, 300, 3), dtype=np.uint8)).save(buffered, format="PNG")
+
+    response = client.post(
+        "/process-image",
+        files={"image": ("big.png", buffered.getvalue(), "image/png")},
+        headers={"X-Grid-Size": "50"}
+    )
+
+    assert response.status_code == 413
+    assert "processing budget" in response.json()["message"]
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
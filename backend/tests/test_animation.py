@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+import numpy as np
+import gzip
+import io
+import os
+import sys
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_optimized import app
+from services.animation_processor import iter_animation_frames
+
+client = TestClient(app)
+
+def _animated_gif(frame_count=4, size=(32, 32)):
+    """A red square moving across a blue background"""
+    frames = []
+    for i in range(frame_count):
+        frame = Image.new('RGB', size, color=(40, 60, 200))
+        frame.paste((220, 30, 30), (i * 4, 8, i * 4 + 8, 16))
+        frames.append(frame)
+    gif = io.BytesIO()
+    frames[0].save(gif, format='GIF', save_all=True, append_images=frames[1:], duration=80, loop=0)
+    return gif.getvalue()
+
+def test_frames_reuse_unchanged_pixels():
+    """Test only pixels that change between frames are re-matched"""
+    image = Image.open(io.BytesIO(_animated_gif()))
+
+    frames = list(iter_animation_frames(image, grid_size=32, num_colors=4))
+
+    assert len(frames) == 4
+    assert frames[0]["changedPixels"] == 32 * 32
+    # Moving an 8x8 square by 4 pixels changes 2 * 4 * 8 pixels
+    assert all(frame["changedPixels"] == 64 for frame in frames[1:])
+    assert frames[1]["duration"] == 80
+    # The background keeps its block, the square moves
+    assert frames[1]["indexGrid"][0, 0] == frames[0]["indexGrid"][0, 0]
+    assert frames[1]["indexGrid"][10, 9] != frames[0]["indexGrid"][10, 9]
+
+def test_animated_upload():
+    """Test an animated GIF returns an animated preview and a schematic per frame"""
+    response = client.post(
+        "/process-image",
+        files={"image": ("anim.gif", _animated_gif(), "image/gif")},
+        headers={"X-Grid-Size": "32"}
+    )
+
+    assert response.status_code == 200
+    animation = response.json()["animation"]
+    assert animation["frameCount"] == 4
+
+    preview = client.get(animation["previewUrl"])
+    assert preview.headers["content-type"] == "image/gif"
+    assert Image.open(io.BytesIO(preview.content)).n_frames == 4
+
+    schematic = client.get(animation["schematicUrl"].format(frame=3))
+    assert schematic.status_code == 200
+    assert gzip.decompress(schematic.content)[:1] == b"\x0a"
+    assert client.get(animation["schematicUrl"].format(frame=4)).status_code == 404
+
+if __name__ == "__main__":
+    # Run tests if this file is executed directly
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,157 @@
+import pytest
+from fastapi.testclient import TestClient
+import os
+import io
+import time
+import json
+import zipfile
+from PIL import Image
+
+# Add parent directory to path so we can import our modules
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_optimized import app
+from services import batch_processor
+from services.batch_processor import expand_archive, resolve_item_params
+
+client = TestClient(app)
+
+def _png_bytes(color, size=(24, 16)):
+    img_bytes = io.BytesIO()
+    Image.new('RGB', size, color=color).save(img_bytes, format='PNG')
+    return img_bytes.getvalue()
+
+def test_resolve_item_params():
+    """Test per-item parameters from a list or a name-keyed object with defaults"""
+    names = ["a.png", "b.png"]
+
+    assert resolve_item_params(names, None) == [{}, {}]
+    assert resolve_item_params(names, json.dumps([{"gridSize": 10}, {}])) == [{"grid_size": 10}, {}]
+    assert resolve_item_params(
+        names, json.dumps({"*": {"gridSize": 20}, "b.png": {"gridSize": 30, "previewFormat": "webp"}})
+    ) == [{"grid_size": 20}, {"grid_size": 30, "preview_format": "webp"}]
+
+    with pytest.raises(ValueError):
+        resolve_item_params(names, json.dumps([{}]))
+    with pytest.raises(ValueError):
+        resolve_item_params(names, json.dumps({"*": {"bogus": 1}}))
+
+    # Values the pipeline can't take are refused naming the item, not left to fail later
+    for bad in ([{"gridSize": [10]}, {}], [{}, {"gridSize": {"x": 1}}], [{"numColors": 2.5}, {}], [{"gridSize": True}, {}]):
+        with pytest.raises(ValueError, match="a.png" if bad[0] else "b.png"):
+            resolve_item_params(names, json.dumps(bad))
+    with pytest.raises(ValueError, match="b.png"):
+        resolve_item_params(names, json.dumps({"b.png": [1]}))
+
+def test_batch_endpoint_streams_results():
+    """Test files and zip members are converted and streamed back as NDJSON"""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("zipped.png", _png_bytes((200, 30, 30)))
+        zf.writestr("notes.txt", "not an image")
+
+    response = client.post(
+        "/batch",
+        files=[
+            ("images", ("first.png", _png_bytes((30, 200, 30)), "image/png")),
+            ("images", ("broken.png", b"not an image", "image/png")),
+            ("archive", ("bundle.zip", archive.getvalue(), "application/zip")),
+        ],
+        data={"params": json.dumps({"*": {"gridSize": 12}})}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    items = {line["name"]: line for line in lines[:-1]}
+
+    assert set(items) == {"first.png", "broken.png", "zipped.png"}
+    assert items["first.png"]["status"] == "ok"
+    assert items["first.png"]["gridSize"] == {"width": 12, "height": 8}
+    assert items["broken.png"]["status"] == "error"
+    assert client.get(items["zipped.png"]["previewUrl"]).status_code == 200
+    assert lines[-1]["summary"]["succeeded"] == 2
+
+def test_batch_endpoint_rejects_empty_request():
+    """Test a batch with no images is rejected up front"""
+    response = client.post("/batch", data={"params": "[]"})
+    assert response.status_code == 400
+
+def test_batch_endpoint_rejects_malformed_item_params():
+    """Test a parameter of the wrong type is a 400 naming the item, not a 500"""
+    response = client.post(
+        "/batch",
+        files=[("images", ("first.png", _png_bytes((10, 200, 10)), "image/png"))],
+        data={"params": json.dumps([{"gridSize": [12]}])}
+    )
+    assert response.status_code == 400
+    assert "first.png" in response.json()["message"]
+
+def test_batch_rate_limited_as_a_whole(monkeypatch):
+    """Test a batch is charged once up front, so it runs in full or is refused with a 429"""
+    from services import scheduler
+    from services.scheduler import ClientLimits, FairScheduler, estimate_cost
+    item_cost = estimate_cost(24, 16, grid_size=12)
+    monkeypatch.setattr(scheduler, "_scheduler", FairScheduler(
+        default_limits=ClientLimits(rate=1e-6, burst=item_cost * 5)
+    ))
+    files = [("images", (f"{i}.png", _png_bytes((10 * i, 80, 80)), "image/png")) for i in range(3)]
+    params = {"params": json.dumps({"*": {"gridSize": 12}})}
+
+    # Charging every item again would have refused the third
+    response = client.post("/batch", files=files, data=params)
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1])["summary"]["succeeded"] == 3
+
+    response = client.post("/batch", files=files, data=params)
+    assert response.status_code == 429
+    assert "batch" in response.json()["message"]
+    assert int(response.headers["Retry-After"]) > 0
+
+def test_expand_archive_limits(monkeypatch):
+    """Test members are read with a bounded stream and extraction stops at the image limit"""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for position in range(3):
+            zf.writestr(f"{position}.png", _png_bytes((position, 0, 0)))
+    assert len(expand_archive(archive.getvalue(), max_images=3)) == 3
+    with pytest.raises(ValueError, match="Too many images"):
+        expand_archive(archive.getvalue(), max_images=2)
+
+    # A header that understates the member's size does not get past the limit
+    monkeypatch.setattr(batch_processor, "MAX_ARCHIVE_MEMBER_SIZE", 1000)
+    crafted = io.BytesIO()
+    with zipfile.ZipFile(crafted, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("big.png", b"\0" * 5000)
+    real_size = (5000).to_bytes(4, "little")
+    data = crafted.getvalue().replace(real_size, (10).to_bytes(4, "little"))
+    assert data != crafted.getvalue()
+    with pytest.raises(ValueError):
+        expand_archive(data)
+
+def test_run_batch_submits_a_window_and_cancels_on_close():
+    """Test only a window of items is in flight, and closing the batch stops the rest"""
+    from services.metrics import BATCH_QUEUE_DEPTH
+    items = [(f"{i}.png", bytes([i]), {}) for i in range(10)]
+    started = []
+    process = lambda image_data, **kwargs: started.append(image_data) or {}
+
+    outcomes = list(batch_processor.run_batch(items, process, window=3))
+    assert sorted(outcome["index"] for outcome in outcomes) == list(range(10))
+
+    queued = BATCH_QUEUE_DEPTH.value()
+    started.clear()
+    batch = batch_processor.run_batch(items, process, window=2)
+    next(batch)
+    batch.close()
+    assert len(started) <= 2
+    # Cancelled and never-submitted items leave the queue depth where it was
+    deadline = time.time() + 2
+    while BATCH_QUEUE_DEPTH.value() != queued and time.time() < deadline:
+        time.sleep(0.01)
+    assert BATCH_QUEUE_DEPTH.value() == queued
+
+if __name__ == "__main__":
+    # Run tests if this file is executed directly
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,50 @@
+import pytest
+import os
+import sys
+import json
+import pickle
+import numpy as np
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.block_grid import BlockGrid, GridPalette, json_default, json_object_hook
+from services.palette import get_block_palette
+from services.preview_encoder import render_index_preview
+from models.response_models import ProcessedImageResponse
+
+PALETTE = GridPalette(["stone", "dirt", "sand"], np.array([[120, 120, 120], [130, 90, 60], [220, 210, 160]], dtype=np.uint8))
+
+def test_counts_slicing_and_runs():
+    """Test counts, 2D slicing and the run-length view"""
+    grid = BlockGrid([[0, 0, 1, 1, 1], [2, 2, 2, 0, 1]], PALETTE)
+
+    assert grid.indices.dtype == np.uint8
+    assert grid.counts() == {"stone": 3, "dirt": 4, "sand": 3}
+    assert grid[1].shape == (1, 5) and grid[1].tolist() == [[2, 2, 2, 0, 1]]
+    assert grid[:, 1:3] == BlockGrid([[0, 1], [2, 2]], PALETTE)
+    assert grid != BlockGrid(grid.indices, GridPalette(["a", "b", "c"], PALETTE.colors))
+
+    rows, starts, lengths, values = grid.runs()
+    assert rows.tolist() == [0, 0, 1, 1, 1]
+    assert starts.tolist() == [0, 2, 0, 3, 4]
+    assert lengths.tolist() == [2, 3, 3, 1, 1]
+    assert values.tolist() == [0, 1, 2, 0, 1]
+
+    assert grid.to_legacy()[1][0] == {"name": "sand", "color": [220, 210, 160]}
+    assert render_index_preview(grid, 2).shape == (4, 10)
+
+def test_serialized_forms_round_trip():
+    """Test the JSON, pickle and API forms of a grid on the shared palette"""
+    palette = get_block_palette()
+    grid = BlockGrid(np.random.default_rng(8).integers(0, len(palette), size=(30, 40)), palette)
+
+    restored = json.loads(json.dumps({"grid": grid}, default=json_default), object_hook=json_object_hook)["grid"]
+    assert restored == grid
+    assert pickle.loads(pickle.dumps(grid)) == grid
+
+    response = ProcessedImageResponse(blockCount=grid.counts(), blockGrid=grid[:2, :3])
+    assert response.blockGrid[1][2].name == palette.names[grid.indices[1, 2]]
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,60 @@
+import pytest
+import os
+import sys
+import io
+import json
+import numpy as np
+from PIL import Image
+from fastapi.testclient import TestClient
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.block_stream import stream_block_rows, read_binary_block_stream
+
+def test_ndjson_and_binary_streams_carry_the_grid():
+    """Test both encodings round-trip the grid between a header and a summary"""
+    grid = np.random.default_rng(7).integers(0, 200, size=(37, 23), dtype=np.uint8)
+    header = {"id": "x", "gridSize": {"width": 23, "height": 37}}
+    summary = {"blockCount": {"stone": 1}}
+
+    records = [json.loads(line) for line in stream_block_rows(header, grid, summary, rows_per_chunk=10)]
+    assert [record["type"] for record in records] == ["header", "rows", "rows", "rows", "rows", "summary"]
+    assert [record["y"] for record in records[1:-1]] == [0, 10, 20, 30]
+    assert np.array_equal(np.array([row for record in records[1:-1] for row in record["rows"]]), grid)
+
+    data = b"".join(stream_block_rows(header, grid, summary, "binary", rows_per_chunk=10))
+    decoded_header, decoded_grid, decoded_summary = read_binary_block_stream(data)
+    assert decoded_header == header and decoded_summary == summary
+    assert np.array_equal(decoded_grid, grid)
+
+def test_stream_endpoint_stores_the_result():
+    """Test the streaming endpoint sends the grid and keeps the result for downloads"""
+    import main_optimized
+    client = TestClient(main_optimized.app)
+    buffered = io.BytesIO()
+    Image.fromarray(np.random.default_rng().integers(0, 256, size=(60, 90, 3), dtype=np.uint8)).save(buffered, format="PNG")
+
+    response = client.post(
+        "/process-image/stream",
+        files={"image": ("test.png", buffered.getvalue(), "image/png")},
+        headers={"X-Grid-Size": "30", "X-Stream-Format": "binary"}
+    )
+    assert response.status_code == 200
+    header, grid, summary = read_binary_block_stream(response.content)
+    assert grid.shape == (20, 30)
+    assert sum(summary["blockCount"].values()) == 20 * 30
+    assert grid.max() < len(header["palette"])
+    assert client.get(summary["previewUrl"]).status_code == 200
+    assert client.get(summary["schematicUrl"]).status_code == 200
+
+    response = client.post(
+        "/process-image/stream",
+        files={"image": ("test.png", buffered.getvalue(), "image/png")},
+        headers={"X-Grid-Size": "large"}
+    )
+    assert response.status_code == 400
+    assert response.json() == {"message": "X-Grid-Size must be a whole number"}
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,53 @@
+import pytest
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.block_database import rgb_to_lab, find_closest_block
+from services.color_space import srgb_to_lab, srgb_to_linear, linear_to_srgb
+from services.palette import get_block_palette
+from services.pipeline import PipelineContext
+from services.pipeline_strategies import ingest_decode, resize_linear_area
+
+def test_conversions_match_reference():
+    """Test the vectorized conversions against rgb_to_lab and round-trip through linear light"""
+    values = np.arange(256, dtype=np.uint8)
+    assert np.array_equal(linear_to_srgb(srgb_to_linear(values)), values)
+
+    colors = np.random.default_rng(0).integers(0, 256, size=(200, 3)).astype(np.uint8)
+    expected = np.array([rgb_to_lab(color) for color in colors.tolist()])
+    assert np.allclose(srgb_to_lab(colors, np.float64), expected, atol=1e-9)
+    assert np.allclose(srgb_to_lab(colors), expected, atol=1e-2)
+
+    # Vectorized Lab matching picks the same blocks as find_closest_block
+    palette = get_block_palette("blocks", "lab")
+    expected_names = [find_closest_block(color, palette.blocks)[0] for color in colors.tolist()]
+    assert [palette.names[i] for i in palette.match_lab(srgb_to_lab(colors))] == expected_names
+
+def test_linear_area_resize():
+    """Test area averaging happens in linear light and yields Lab for the matcher"""
+    # A one-pixel black and white checkerboard is half as bright as white in
+    # linear light, which is sRGB 188 rather than the 128 of averaging sRGB
+    checkerboard = (np.indices((80, 60)).sum(axis=0) % 2 * 255).astype(np.uint8)
+    context = PipelineContext(Image.fromarray(checkerboard).convert("RGB"), {})
+    ingest_decode(context)
+    resize_linear_area(context, grid_size=10)
+
+    assert context.pixels.shape == (10, 7, 3)
+    assert np.all(context.pixels == 188)
+    assert np.allclose(context.lab, srgb_to_lab(context.pixels), atol=0.5)
+
+    # Transparent pixels end up white; replacing the pixels drops the stale Lab image
+    context = PipelineContext(Image.new("RGBA", (40, 40), (255, 0, 0, 0)), {})
+    ingest_decode(context)
+    resize_linear_area(context, grid_size=4)
+    assert np.all(context.pixels == 255)
+    context.pixels = context.pixels[:2]
+    assert context.lab is None
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,47 @@
+import pytest
+import os
+import sys
+import json
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import convert
+
+def _write_image(path, seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(20, 30, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+def test_convert_directory_and_resume(tmp_path, capsys):
+    """Test a directory is converted once and only changed images are redone"""
+    source = tmp_path / "in"
+    (source / "nested").mkdir(parents=True)
+    _write_image(source / "a.png", 1)
+    _write_image(source / "nested" / "b.png", 2)
+    (source / "readme.txt").write_text("not an image")
+    output = tmp_path / "out"
+    argv = [str(source), "-o", str(output), "--workers", "0", "--grid-size", "10"]
+
+    assert convert.main(argv) == 0
+    assert (output / "a.preview.png").is_file()
+    assert (output / "nested" / "b.schem").is_file()
+    counts = json.loads((output / "nested" / "b.blocks.json").read_text())
+    assert sum(counts["blockCount"].values()) == counts["gridSize"]["width"] * counts["gridSize"]["height"]
+    assert set(json.loads((output / "manifest.json").read_text())["entries"]) == {"a.png", "nested/b.png"}
+    capsys.readouterr()
+
+    # Nothing changed: everything is skipped
+    assert convert.main(argv) == 0
+    assert "Converted 0, skipped 2" in capsys.readouterr().err
+
+    # A changed image and changed settings are both converted again
+    _write_image(source / "a.png", 3)
+    assert convert.main(argv) == 0
+    assert "Converted 1, skipped 1" in capsys.readouterr().err
+    assert convert.main(argv[:-1] + ["12"]) == 0
+    assert "Converted 2, skipped 0" in capsys.readouterr().err
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
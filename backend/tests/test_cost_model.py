@@ -0,0 +1,88 @@
+import pytest
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.cost_model import CostModel, Plan, all_plans, feature_vector
+
+def _synthetic_samples():
+    # Lab matching costs more per cell than RGB; threads halve match time; k-means costs a fixed 5 ms
+    per_cell = {"rgb": 1e-6, "lab": 3e-6}
+    samples = []
+    for cells in (1000, 10000, 40000):
+        for quantizer in ("minibatch_kmeans", "none"):
+            colors = 48 if quantizer != "none" else cells // 4
+            samples.append({"term": f"quantize:{quantizer}", "cells": cells, "colors": colors,
+                            "paletteSize": 100, "seconds": 0.005 if quantizer != "none" else 0.0})
+            for matcher, cost in per_cell.items():
+                for executor, share in (("serial", 1.0), ("threads", 0.5)):
+                    samples.append({"term": f"match:{matcher}:{executor}", "cells": cells, "colors": colors,
+                                    "paletteSize": 100, "seconds": cost * cells * share})
+            for encoder in ("png", "webp"):
+                samples.append({"term": f"encode:{encoder}", "cells": cells, "colors": colors,
+                                "paletteSize": 100, "seconds": 1e-7 * cells})
+    return samples
+
+def test_fit_predicts_and_selects_within_quality_target():
+    """Test the fitted model reproduces stage times and picks the fastest acceptable plan"""
+    quality = {"minibatch_kmeans:rgb": 18.0, "minibatch_kmeans:lab": 15.0, "none:rgb": 15.5, "none:lab": 11.5}
+    model = CostModel.fit(_synthetic_samples(), quality)
+
+    predicted = model.coefficients["match:lab:serial"] @ feature_vector(20000, 48, 100)
+    assert predicted == pytest.approx(0.06, rel=0.01)
+
+    # Without a quality limit the fastest plan wins: RGB, threaded, no k-means
+    plan, seconds = model.select(cells=20000, unique_colors=5000, palette_size=100, max_delta_e=100)
+    assert plan == Plan("none", "rgb", "threads", "png")
+    assert seconds == pytest.approx(0.01 + 0.002, rel=0.05)
+
+    # A tighter target rules out RGB matching
+    plan, _ = model.select(cells=20000, unique_colors=5000, palette_size=100, encoder="webp", max_delta_e=12)
+    assert plan == Plan("none", "lab", "threads", "webp")
+
+    # No plan meets an impossible target: the most accurate one is used
+    plan, _ = model.select(cells=20000, unique_colors=5000, palette_size=100, max_delta_e=1)
+    assert plan.quality_key == "none:lab"
+
+    # Terms without calibration are never chosen
+    del model.coefficients["match:lab:threads"]
+    plan, _ = model.select(cells=20000, unique_colors=5000, palette_size=100, max_delta_e=12)
+    assert plan == Plan("none", "lab", "serial", "png")
+    assert len(all_plans()) == 16
+
+    # Without match threads the threaded plans are left out even if calibrated
+    model = CostModel.fit(_synthetic_samples(), quality)
+    plan, _ = model.select(
+        cells=20000, unique_colors=5000, palette_size=100, max_delta_e=12, plans=all_plans(executors=("serial",))
+    )
+    assert plan == Plan("none", "lab", "serial", "png")
+    assert len(all_plans(executors=("serial",))) == 8
+
+def test_optimized_pipeline_reports_chosen_plan():
+    """Test the optimized pipeline runs the plan the cost model chose"""
+    from services.pipeline import get_pipeline
+
+    rng = np.random.default_rng(7)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, size=(80, 120, 3), dtype=np.uint8)).save(buffer, format="PNG")
+
+    context = get_pipeline("optimized").run_context(buffer.getvalue(), grid_size=40)
+    plan = context.stats["plan"]
+    assert context.palette.metric == plan["matcher"]
+    assert plan["encoder"] == context.encoded_format
+    assert plan["uniqueColors"] > 48
+    assert context.result["plan"] == plan
+    assert context.index_grid.shape[1] == 40
+
+    from services import pipeline_strategies
+    if pipeline_strategies.MATCH_THREADS <= 1:
+        assert plan["executor"] == "serial"
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,63 @@
+import pytest
+import os
+import sys
+import io
+import numpy as np
+from PIL import Image
+from fastapi.testclient import TestClient
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.block_grid import BlockGrid, GridPalette
+from services.materials import materials_report
+
+PALETTE = GridPalette(["stone", "dirt", "sand"], np.zeros((3, 3), dtype=np.uint8))
+
+def test_stacks_shulker_boxes_and_subtotals():
+    """Test the breakdown into boxes, stacks and blocks and the subtotals"""
+    indices = np.zeros((50, 40), dtype=np.uint8)
+    indices[:, 30:] = 1
+    indices[0, 0] = 2
+    grid = BlockGrid(indices, PALETTE)
+
+    report = materials_report(grid, "rows")
+    assert report["totalBlocks"] == 2000
+    stone, dirt, sand = report["materials"]
+    assert (stone["name"], stone["count"]) == ("stone", 1499)
+    assert (stone["shulkerBoxes"], stone["stacks"], stone["remainder"]) == (0, 23, 27)
+    assert (dirt["count"], sand["count"]) == (500, 1)
+    assert report["totals"] == {"slots": 24 + 8 + 1, "shulkerBoxes": 2}
+    assert report["rows"][0]["counts"] == {"stone": 29, "dirt": 10, "sand": 1}
+    assert report["rows"][49]["counts"] == {"stone": 30, "dirt": 10}
+
+    sections = materials_report(grid, "sections", section_size=32)["sections"]
+    assert [(section["x"], section["y"]) for section in sections] == [(0, 0), (1, 0), (0, 1), (1, 1)]
+    assert sections[3]["bounds"] == {"left": 32, "top": 32, "width": 8, "height": 18}
+    assert sections[3]["counts"] == {"dirt": 8 * 18}
+
+    with pytest.raises(ValueError):
+        materials_report(grid, "columns")
+
+def test_materials_from_the_api():
+    """Test the materials list on /process-image and for a stored result"""
+    import main_optimized
+    client = TestClient(main_optimized.app)
+    buffered = io.BytesIO()
+    Image.fromarray(np.random.default_rng().integers(0, 256, size=(40, 60, 3), dtype=np.uint8)).save(buffered, format="PNG")
+
+    response = client.post(
+        "/process-image",
+        files={"image": ("test.png", buffered.getvalue(), "image/png")},
+        headers={"X-Grid-Size": "30", "X-Materials": "rows"}
+    ).json()
+    assert response["materials"]["totalBlocks"] == 30 * 20
+    assert len(response["materials"]["rows"]) == 20
+    assert {m["name"]: m["count"] for m in response["materials"]["materials"]} == response["blockCount"]
+
+    stored = client.get(f"/results/{response['id']}/materials").json()
+    assert stored["materials"] == response["materials"]["materials"]
+    assert client.get(f"/results/{response['id']}/materials?subtotals=columns").status_code == 400
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,64 @@
+import pytest
+from fastapi.testclient import TestClient
+import os
+import io
+from PIL import Image
+import numpy as np
+
+# Add parent directory to path so we can import our modules
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_optimized import app
+from middleware.cache import ImageProcessingCache
+from services.metrics import MetricsRegistry
+from services.pipeline import get_pipeline
+
+client = TestClient(app)
+
+def test_server_timing_header(tmp_path, monkeypatch):
+    """Test the processing response breaks its time down by stage"""
+    # An empty result cache, so the conversion runs every stage
+    monkeypatch.setattr(get_pipeline("optimized"), "cache", ImageProcessingCache(str(tmp_path)))
+    img = Image.fromarray(np.random.default_rng(11).integers(0, 256, size=(20, 20, 3), dtype=np.uint8))
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format='PNG')
+
+    response = client.post(
+        "/process-image",
+        files={"image": ("test_image.png", img_bytes.getvalue(), "image/png")},
+        headers={"X-Grid-Size": "20"}
+    )
+    assert response.status_code == 200
+
+    timing = response.headers["Server-Timing"]
+    stages = [entry.split(";")[0] for entry in timing.split(", ")]
+    assert "match" in stages and "serialize" in stages
+    assert stages[-1] == "total"
+
+def test_metrics_endpoint():
+    """Test /metrics exposes request latency by route template"""
+    client.get("/health")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'mcimage_request_duration_seconds_count{method="GET",route="/health",status="200"}' in response.text
+    assert "# TYPE mcimage_stage_duration_seconds histogram" in response.text
+
+def test_histogram_buckets_are_cumulative():
+    """Test histogram rendering follows the Prometheus text format"""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Test", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5.0, stage="a")
+
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="a"} 3' in lines
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,55 @@
+import pytest
+import os
+import sys
+import numpy as np
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.shared_arrays as shared_arrays
+from services.block_database import get_minecraft_blocks
+from services.palette import BlockPalette, UNMATCHED
+
+def test_shared_palette_matches_private_palette(tmp_path, monkeypatch):
+    """Test the lookup table path gives the same blocks as direct matching"""
+    monkeypatch.setattr(shared_arrays, "SHARED_DATA_DIR", str(tmp_path))
+    blocks = get_minecraft_blocks()
+    pixels = np.random.default_rng(5).integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+
+    shared = BlockPalette(blocks, shared=True)
+    private = BlockPalette(blocks)
+
+    np.testing.assert_array_equal(shared.match(pixels), private.match(pixels))
+    # Second pass is answered from the table
+    np.testing.assert_array_equal(shared.match(pixels), private.match(pixels))
+    assert not shared.colors.flags.writeable
+
+def test_lookup_table_shared_between_instances(tmp_path, monkeypatch):
+    """Test colours matched by one palette are visible to another mapping the same file"""
+    monkeypatch.setattr(shared_arrays, "SHARED_DATA_DIR", str(tmp_path))
+    blocks = get_minecraft_blocks()
+
+    first = BlockPalette(blocks, shared=True)
+    second = BlockPalette(blocks, shared=True)
+    code = (10 << 16) | (200 << 8) | 30
+    assert second._lookup[code] == UNMATCHED
+
+    first.match(np.array([[10, 200, 30]], dtype=np.uint8))
+    assert second._lookup[code] != UNMATCHED
+
+def test_shared_table_never_replaced(tmp_path, monkeypatch):
+    """Test a worker that missed another's new table maps that file instead of replacing it"""
+    monkeypatch.setattr(shared_arrays, "SHARED_DATA_DIR", str(tmp_path))
+    first = shared_arrays.shared_table("lookup", "abc", 16, UNMATCHED)
+    first[3] = 7
+
+    # As if the file appeared between this worker's check and its write
+    monkeypatch.setattr(shared_arrays.os.path, "isfile", lambda path: False)
+    second = shared_arrays.shared_table("lookup", "abc", 16, UNMATCHED)
+    assert second[3] == 7
+    second[4] = 9
+    assert first[4] == 9
+    assert [path.name for path in tmp_path.iterdir()] == ["lookup-abc.npy"]
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,139 @@
+import pytest
+import os
+import sys
+import io
+import json
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.block_database import get_minecraft_blocks, find_closest_block
+from services.pipeline import Pipeline, Step, computation_guard, load_pipelines, get_pipeline, register_strategy
+
+def _png(pixels: np.ndarray) -> bytes:
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def test_lab_match_agrees_with_find_closest_block():
+    """Test the legacy colour metric gives the per-pixel result of find_closest_block"""
+    pixels = np.random.default_rng(3).integers(0, 256, size=(12, 12, 3), dtype=np.uint8)
+    pipeline = Pipeline("lab", [
+        Step("ingest", "decode"),
+        Step("normalise", "drop_alpha"),
+        Step("match", "nearest", {"metric": "lab"}),
+    ])
+
+    context = pipeline.run_context(_png(pixels))
+
+    blocks = get_minecraft_blocks()
+    expected = [[find_closest_block(pixel, blocks)[0] for pixel in row] for row in pixels]
+    assert [[context.palette.names[i] for i in row] for row in context.index_grid] == expected
+
+def test_pipeline_hooks_timings_and_params():
+    """Test stages run in order, report timings and take request parameters over options"""
+    pixels = np.random.default_rng(4).integers(0, 256, size=(40, 60, 3), dtype=np.uint8)
+    pipeline = get_pipeline("optimized")
+    seen = []
+
+    result = pipeline.run(
+        _png(pixels), use_cache=False, hooks=[lambda name, context: seen.append(name)],
+        grid_size=20, output_scale=2
+    )
+
+    assert seen == [step.stage for step in pipeline.steps]
+    assert result["gridSize"] == {"width": 20, "height": 13}
+    assert result["outputScale"] == 2
+    assert sum(result["blockCount"].values()) == 20 * 13
+
+    with pytest.raises(TypeError):
+        pipeline.run(_png(pixels), use_cache=False, grid_sise=20)
+
+def test_custom_strategy_from_config(tmp_path):
+    """Test pipelines are built from configuration and accept registered strategies"""
+    @register_strategy("quantize", "posterize_test")
+    def posterize(context, levels: int = 4):
+        step = 256 // levels
+        context.pixels = (context.pixels // step * step).astype(np.uint8)
+
+    config = {
+        "posterized": {"stages": [
+            {"stage": "ingest", "strategy": "decode"},
+            {"stage": "normalise", "strategy": "white_background"},
+            {"stage": "quantize", "strategy": "posterize_test", "options": {"levels": 2}},
+        ]}
+    }
+    config_path = tmp_path / "pipelines.json"
+    config_path.write_text(json.dumps(config))
+
+    context = load_pipelines(str(config_path))["posterized"].run_context(
+        _png(np.full((4, 4, 3), 200, dtype=np.uint8))
+    )
+    assert (context.pixels == 128).all()
+
+    config["posterized"]["stages"][2]["options"] = {"colours": 2}
+    config_path.write_text(json.dumps(config))
+    with pytest.raises(ValueError):
+        load_pipelines(str(config_path))
+
+def test_computation_guard_skips_cached_and_shared_runs(tmp_path):
+    """Test only the run that computes enters the guard; duplicates and cache hits do not, refused runs are retried"""
+    import threading
+    import time
+    from contextlib import contextmanager
+    from middleware.cache import ImageProcessingCache
+
+    @register_strategy("export", "cell_count")
+    def cell_count(context):
+        context.result = {"cells": int(context.index_grid.size)}
+
+    pipeline = Pipeline("guarded", [
+        Step("ingest", "decode"),
+        Step("normalise", "drop_alpha"),
+        Step("match", "nearest"),
+        Step("export", "cell_count"),
+    ], cache=True)
+    pipeline.cache = ImageProcessingCache(str(tmp_path))
+    image = _png(np.random.default_rng(9).integers(0, 256, size=(16, 16, 3), dtype=np.uint8))
+
+    entered, release = [], threading.Event()
+    @contextmanager
+    def guard(name):
+        entered.append(name)
+        if name == "refused":
+            release.wait(5)
+            raise LookupError("rate limited")
+        yield
+
+    results = {}
+    def request(name):
+        with computation_guard(lambda: guard(name), refusals=(LookupError,)):
+            try:
+                results[name] = pipeline.run(image)
+            except LookupError as e:
+                results[name] = e
+
+    # The first request's guard refuses it while a duplicate waits: the duplicate runs itself
+    first = threading.Thread(target=request, args=("refused",))
+    first.start()
+    while not entered:
+        pass
+    second = threading.Thread(target=request, args=("duplicate",))
+    second.start()
+    time.sleep(0.1)
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert isinstance(results["refused"], LookupError)
+    assert results["duplicate"] == {"cells": 256}
+    assert entered == ["refused", "duplicate"]
+
+    # Cached now: no guard at all
+    request("cached")
+    assert results["cached"] == {"cells": 256}
+    assert entered == ["refused", "duplicate"]
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,68 @@
+import pytest
+from PIL import Image
+import numpy as np
+import io
+import os
+import sys
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.preview_encoder import (
+    render_index_preview, preview_palette, encode_preview, compare_preview_encodings
+)
+
+def _sample_preview():
+    palette = preview_palette([[255, 0, 0], [0, 255, 0], [0, 0, 255]])
+    index_grid = np.array([[0, 1, 2], [2, 1, 0]])
+    return render_index_preview(index_grid, 4, grid_line_index=3), palette
+
+def test_render_index_preview():
+    """Test blocks are scaled up and separated by grid lines"""
+    index_image, _ = _sample_preview()
+
+    assert index_image.shape == (8, 12)
+    assert index_image[0, 0] == 0 and index_image[0, 4] == 1 and index_image[4, 0] == 2
+    # Grid lines between blocks but not on the outer edge
+    assert (index_image[:, 3] == 3).all() and (index_image[3, :] == 3).all()
+    assert index_image[0, 11] == 2 and index_image[7, 0] == 2
+
+def test_encode_indexed_png():
+    """Test the PNG preview is palette mode and decodes to the block colours"""
+    index_image, palette = _sample_preview()
+
+    image = Image.open(io.BytesIO(encode_preview(index_image, palette, "png")))
+
+    assert image.mode == "P"
+    rgb = np.array(image.convert("RGB"))
+    assert np.array_equal(rgb, palette[index_image])
+
+def test_encode_lossless_webp():
+    """Test the WebP preview round-trips losslessly"""
+    index_image, palette = _sample_preview()
+
+    image = Image.open(io.BytesIO(encode_preview(index_image, palette, "webp", compress_level=0)))
+
+    assert image.format == "WEBP"
+    assert np.array_equal(np.array(image.convert("RGB")), palette[index_image])
+
+def test_encode_unknown_format():
+    """Test unsupported formats are rejected"""
+    index_image, palette = _sample_preview()
+
+    with pytest.raises(ValueError):
+        encode_preview(index_image, palette, "gif")
+
+def test_compare_preview_encodings():
+    """Test the comparison report covers every format and level"""
+    index_image, palette = _sample_preview()
+
+    report = compare_preview_encodings(index_image, palette, compress_levels=(1, 9))
+
+    assert {entry["format"] for entry in report} == {"png-rgb", "png", "webp"}
+    assert len(report) == 5
+    assert all(entry["bytes"] > 0 for entry in report)
+
+if __name__ == "__main__":
+    # Run tests if this file is executed directly
+    pytest.main(["-xvs", __file__])
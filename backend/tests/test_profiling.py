@@ -0,0 +1,72 @@
+import pytest
+import os
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add parent directory to path so we can import our modules
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import middleware.profiling as profiling
+
+def _busy(seconds: float) -> int:
+    total = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        total += sum(range(200))
+    return total
+
+def _profiled_app() -> FastAPI:
+    app = FastAPI()
+    app.middleware("http")(profiling.profiling_middleware)
+
+    @app.get("/work")
+    def work():
+        return {"total": _busy(0.1)}
+
+    return app
+
+def test_profile_written_when_requested(tmp_path, monkeypatch):
+    """Test a request sent with the profiling token in X-Profile gets a stored report"""
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "s3cret")
+    client = TestClient(_profiled_app())
+
+    response = client.get("/work", headers={"X-Profile": "s3cret"})
+    profile_id = response.headers["X-Profile-Id"]
+    report = profiling.load_profile(profile_id)
+
+    assert report["path"] == "/work"
+    assert report["samples"] > 0
+    assert any("_busy" in entry["function"] for entry in report["topFunctions"])
+    assert report["allocations"]["peakKb"] > 0
+    assert (tmp_path / f"{profile_id}.collapsed").is_file()
+
+def test_no_profile_without_header(tmp_path, monkeypatch):
+    """Test ordinary requests are not profiled"""
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    client = TestClient(_profiled_app())
+
+    response = client.get("/work")
+
+    assert "X-Profile-Id" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+    assert profiling.load_profile("../secrets") is None
+
+def test_profile_needs_configured_token(tmp_path, monkeypatch):
+    """Test X-Profile is ignored without a configured token and must match it otherwise"""
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    client = TestClient(_profiled_app())
+
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", None)
+    assert "X-Profile-Id" not in client.get("/work", headers={"X-Profile": "1"}).headers
+
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "s3cret")
+    assert "X-Profile-Id" not in client.get("/work", headers={"X-Profile": "1"}).headers
+    assert list(tmp_path.iterdir()) == []
+    assert profiling.profile_token_valid("s3cret")
+    assert not profiling.profile_token_valid(None)
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
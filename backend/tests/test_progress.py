@@ -0,0 +1,60 @@
+import pytest
+import os
+import sys
+import io
+import numpy as np
+from PIL import Image
+from fastapi.testclient import TestClient
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.pipeline import get_pipeline
+from services.progress import ProgressReporter, report_progress
+
+def _png(pixels: np.ndarray) -> bytes:
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+@pytest.mark.parametrize("pipeline_name", ["optimized", "legacy"])
+def test_reported_run_matches_unreported_run(pipeline_name):
+    """Test banded matching and rendering give the same grid and preview as one pass"""
+    image_data = _png(np.random.default_rng(6).integers(0, 256, size=(70, 110, 3), dtype=np.uint8))
+    pipeline = get_pipeline(pipeline_name)
+    expected = pipeline.run_context(image_data, stop_after="render", grid_size=43)
+
+    events = []
+    with report_progress(ProgressReporter(events.append, min_interval=0)):
+        context = pipeline.run_context(image_data, stop_after="render", grid_size=43)
+
+    assert np.array_equal(context.index_grid, expected.index_grid)
+    assert np.array_equal(context.preview, expected.preview)
+    stages = [step.stage for step in pipeline.steps]
+    assert [event["stage"] for event in events if event["type"] == "stage"] == stages[:stages.index("render") + 1]
+    assert [event["percent"] for event in events if event.get("stage") == "render" and event["type"] == "progress"][-1] == 100
+
+    rows = [event for event in events if event["type"] == "rows"]
+    assert rows[0]["y"] == 0 and sum(event["height"] for event in rows) == expected.preview.shape[0]
+
+def test_websocket_progress_ends_with_result():
+    """Test the WebSocket endpoint streams stage events before the result"""
+    import main_optimized
+    client = TestClient(main_optimized.app)
+    image_data = _png(np.random.default_rng().integers(0, 256, size=(60, 80, 3), dtype=np.uint8))
+
+    with client.websocket_connect("/ws/process-image") as websocket:
+        websocket.send_json({"gridSize": 40, "previewRows": False})
+        websocket.send_bytes(image_data)
+        events = [websocket.receive_json()]
+        while events[-1]["type"] not in ("result", "error"):
+            events.append(websocket.receive_json())
+
+    assert events[0]["type"] == "accepted"
+    assert events[-1]["type"] == "result" and events[-1]["id"] == events[0]["id"]
+    assert "match" in [event.get("stage") for event in events]
+    assert not [event for event in events if event["type"] == "rows"]
+    assert client.get(f"/get-schematic/{events[0]['id']}").status_code == 200
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
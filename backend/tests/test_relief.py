@@ -0,0 +1,118 @@
+import pytest
+from fastapi.testclient import TestClient
+import gzip
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.relief import ReliefVolume, lightness_heights
+from services.schematic_generator import create_relief_schematic, create_schematic
+
+def test_relief_volume_matches_dense_columns():
+    """Test run-length columns expand to the right blocks and write the same schematic as a dense volume"""
+    rng = np.random.default_rng(3)
+    names = ["Stone", "Red Wool", "Blue Wool", "White Concrete"]
+    grid = rng.integers(0, 4, size=(24, 32)).astype(np.uint8)
+    heights = lightness_heights(rng.random((24, 32)), 20)
+    volume = ReliefVolume.from_grid(grid, heights, names, filler="Dirt", surface_depth=2)
+
+    # Dense reference: filler up to two blocks below the top, then the surface block, then air
+    y = np.arange(20)[:, None, None]
+    top = heights.astype(int)
+    expected = np.where(y < top - 2, volume.names.index("Dirt"), volume.air)
+    expected = np.where((y >= top - 2) & (y < top), grid, expected)
+    dense = volume.dense()
+    assert volume.shape == (20, 24, 32)
+    assert np.array_equal(dense, expected)
+    assert np.array_equal(volume.column_heights(), heights)
+    assert volume.counts()["Dirt"] == int((expected == volume.names.index("Dirt")).sum())
+    assert "Air" not in volume.counts()
+
+    # Sections of any height concatenate to the dense schematic
+    reference = gzip.decompress(create_schematic(dense, volume.names))
+    assert gzip.decompress(create_relief_schematic(volume, section_height=7)) == reference
+
+    # A 256x256 relief 64 blocks high stays small
+    large = ReliefVolume.from_grid(
+        rng.integers(0, 4, size=(256, 256)).astype(np.uint8),
+        rng.integers(1, 65, size=(256, 256)).astype(np.uint16),
+        names
+    )
+    assert large.height == 64
+    assert large.nbytes < 1024 * 1024
+
+def test_relief_request_and_schematic():
+    """Test relief mode returns its size and a 3D schematic, from lightness or a depth image"""
+    from main_optimized import app
+    client = TestClient(app)
+
+    # Left half dark, right half light
+    pixels = np.zeros((20, 40, 3), dtype=np.uint8)
+    pixels[:, 20:] = 255
+    image_bytes = io.BytesIO()
+    Image.fromarray(pixels).save(image_bytes, format="PNG")
+
+    response = client.post(
+        "/process-image",
+        files={"image": ("relief.png", image_bytes.getvalue(), "image/png")},
+        headers={"X-Grid-Size": "40", "X-Relief-Height": "12"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["relief"] == {"width": 40, "length": 20, "height": 12, "filler": "Stone"}
+    assert sum(data["blockCount"].values()) == 20 * 20 * 1 + 20 * 20 * 12
+
+    schematic = client.get(f"/get-schematic/{data['id']}")
+    assert schematic.status_code == 200
+    assert gzip.decompress(schematic.content)[:1] == b"\x0a"
+    assert client.get(f"/results/{data['id']}").json()["relief"]["height"] == 12
+
+    # The materials list counts the filler under the surface too
+    materials = client.get(f"/results/{data['id']}/materials?subtotals=rows").json()
+    assert materials["totalBlocks"] == sum(data["blockCount"].values())
+    assert {item["name"]: item["count"] for item in materials["materials"]} == data["blockCount"]
+    row_totals = {}
+    for row in materials["rows"]:
+        for name, count in row["counts"].items():
+            row_totals[name] = row_totals.get(name, 0) + count
+    assert row_totals == data["blockCount"]
+
+    # A depth image raises the top rows instead
+    depth = np.zeros((20, 40), dtype=np.uint8)
+    depth[:10] = 255
+    depth_bytes = io.BytesIO()
+    Image.fromarray(depth).save(depth_bytes, format="PNG")
+    response = client.post(
+        "/process-image",
+        files={
+            "image": ("relief.png", image_bytes.getvalue(), "image/png"),
+            "depth": ("depth.png", depth_bytes.getvalue(), "image/png"),
+        },
+        headers={"X-Grid-Size": "40", "X-Relief-Height": "5"}
+    )
+    assert response.status_code == 200
+    assert sum(response.json()["blockCount"].values()) == 40 * 10 * 5 + 40 * 10
+
+    response = client.post(
+        "/process-image",
+        files={"image": ("relief.png", image_bytes.getvalue(), "image/png")},
+        headers={"X-Relief-Height": "8", "X-Relief-Filler": "Not A Block"}
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        "/process-image",
+        files={"image": ("relief.png", image_bytes.getvalue(), "image/png")},
+        headers={"X-Relief-Height": "tall"}
+    )
+    assert response.status_code == 400
+    assert response.json() == {"message": "X-Relief-Height must be a whole number"}
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
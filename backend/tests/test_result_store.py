@@ -0,0 +1,90 @@
+import pytest
+import os
+import sys
+import time
+import numpy as np
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.result_store import SqliteResultStore
+
+def _record(seed: int, size: int = 32):
+    rng = np.random.default_rng(seed)
+    return {
+        "id": f"result-{seed}",
+        "indexGrid": rng.integers(0, 40, size=(size, size), dtype=np.uint8),
+        "palette": rng.integers(0, 256, size=(40, 3), dtype=np.uint8),
+        "blockNames": [f"block_{i}" for i in range(40)],
+        "gridSize": {"width": size, "height": size},
+        "blockCount": {"block_0": 3},
+        "previews": {"png": (b"\x89PNG fake", "etag-1")},
+        "frames": [rng.integers(0, 40, size=(size, size), dtype=np.uint8) for _ in range(2)],
+        "durations": [100, 120],
+    }
+
+def test_results_shared_between_store_instances(tmp_path):
+    """Test a result put by one store (worker) round-trips through another"""
+    record = _record(1)
+    SqliteResultStore(str(tmp_path)).put("a", record)
+
+    other = SqliteResultStore(str(tmp_path))
+    result = other.get("a")
+    assert result is not None and "a" in other and len(other) == 1
+    assert np.array_equal(result["indexGrid"], record["indexGrid"])
+    assert result["indexGrid"].dtype == np.uint8
+    assert all(np.array_equal(a, b) for a, b in zip(result["frames"], record["frames"]))
+    assert result["previews"] == record["previews"]
+    assert set(record) <= set(result)
+    assert result["blockNames"] == record["blockNames"]
+    assert result["durations"] == [100, 120]
+
+    other.delete("a")
+    assert SqliteResultStore(str(tmp_path)).get("a") is None
+    assert os.listdir(tmp_path / "blobs") == []
+
+def test_ttl_and_size_bounds(tmp_path):
+    """Test results expire after the TTL and the least recently used are evicted"""
+    store = SqliteResultStore(str(tmp_path), max_items=2)
+    for name in ("a", "b"):
+        store.put(name, _record(2))
+    assert SqliteResultStore(str(tmp_path)).get("a") is not None
+    store.put("c", _record(3))
+    assert len(store) == 2 and store.get("b") is None and store.get("a") is not None
+
+    expiring = SqliteResultStore(str(tmp_path / "ttl"), ttl=0.05)
+    expiring.put("a", _record(4))
+    time.sleep(0.1)
+    assert expiring.get("a") is None and len(expiring) == 0
+
+def test_memory_hits_refresh_access_and_previews_persist(tmp_path):
+    """Test reads served from memory still count for eviction and later previews reach other workers"""
+    store = SqliteResultStore(str(tmp_path), max_items=2, access_interval=0)
+    store.put("a", _record(5))
+    store.put("b", _record(6))
+    time.sleep(0.01)
+    assert store.get("a") is not None
+    store.put("c", _record(7))
+    assert store.get("b") is None and store.get("a") is not None
+
+    webp = (b"RIFF fake", "etag-2")
+    store.get("a")["previews"]["webp"] = webp
+    store.put_preview("a", "webp", webp)
+    store.put_preview("a", "webp", (b"ignored", "etag-3"))
+    store.put_preview("missing", "webp", webp)
+    previews = SqliteResultStore(str(tmp_path)).get("a")["previews"]
+    assert previews == {"png": (b"\x89PNG fake", "etag-1"), "webp": webp}
+
+def test_store_opens_its_database_lazily_per_process(tmp_path, monkeypatch):
+    """Test creating a store leaves the database closed and a forked process opens its own connection"""
+    store = SqliteResultStore(str(tmp_path))
+    assert not (tmp_path / "results.db").exists()
+
+    store.put("a", _record(8))
+    parent_connection = store._connection()
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    assert store._connection() is not parent_connection
+    assert store.get("a") is not None
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,102 @@
+import pytest
+from fastapi.testclient import TestClient
+import os
+import io
+from PIL import Image
+import numpy as np
+
+# Add parent directory to path so we can import our modules
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_optimized import app
+
+client = TestClient(app)
+
+def _process_test_image(**headers):
+    """Upload a small random image and return the JSON response"""
+    rng = np.random.default_rng(7)
+    img = Image.fromarray(rng.integers(0, 256, size=(30, 60, 3), dtype=np.uint8))
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format='PNG')
+    img_bytes.seek(0)
+
+    response = client.post(
+        "/process-image",
+        files={"image": ("test_image.png", img_bytes, "image/png")},
+        headers={"X-Grid-Size": "40", **headers}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+def test_metadata_only_response():
+    """Test url preview mode leaves the image out of the JSON"""
+    data = _process_test_image(**{"X-Preview-Mode": "url"})
+
+    assert data["imageData"] is None
+    assert data["previewUrl"].endswith("/preview.png")
+    assert data["tiles"]["maxZoom"] == 4
+
+def test_preview_resource_is_cacheable():
+    """Test the preview is served as raw bytes with validators"""
+    data = _process_test_image()
+
+    response = client.get(data["previewUrl"])
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+    assert Image.open(io.BytesIO(response.content)).size == (40 * 4, 20 * 4)
+
+    # Conditional requests are answered without a body
+    cached = client.get(data["previewUrl"], headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+
+def test_preview_tiles():
+    """Test tiles render lazily at every zoom level and reject out-of-range tiles"""
+    data = _process_test_image()
+    tile_url = data["tiles"]["url"]
+
+    for level in data["tiles"]["levels"]:
+        response = client.get(tile_url.format(z=level["z"], x=0, y=0))
+        assert response.status_code == 200
+        tile = Image.open(io.BytesIO(response.content))
+        assert tile.width == min(256, 40 * level["blockSize"])
+
+    assert client.get(tile_url.format(z=0, x=1, y=0)).status_code == 404
+    assert client.get("/results/missing/preview.png").status_code == 404
+
+def test_tile_cache_is_bounded(monkeypatch):
+    """Test rendered tiles are kept in a bounded LRU shared by every result"""
+    import main_optimized
+    from services.preview_tiles import TileCache
+    monkeypatch.setattr(main_optimized, "tile_cache", TileCache(max_items=2))
+    data = _process_test_image()
+    tile_url = data["tiles"]["url"]
+
+    first = client.get(tile_url.format(z=0, x=0, y=0))
+    for level in data["tiles"]["levels"]:
+        assert client.get(tile_url.format(z=level["z"], x=0, y=0)).status_code == 200
+    assert len(main_optimized.tile_cache) == 2
+    assert main_optimized.tile_cache.get((data["id"], 0, 0, 0)) is None
+
+    # An evicted tile renders again, the same as before
+    again = client.get(tile_url.format(z=0, x=0, y=0))
+    assert again.content == first.content
+    assert again.headers["etag"] == first.headers["etag"]
+
+def test_invalid_compress_level_is_rejected():
+    """Test a non-numeric X-Compress-Level is a client error, not a processing failure"""
+    img_bytes = io.BytesIO()
+    Image.new('RGB', (20, 10), color=(200, 30, 30)).save(img_bytes, format='PNG')
+
+    response = client.post(
+        "/process-image",
+        files={"image": ("test_image.png", img_bytes.getvalue(), "image/png")},
+        headers={"X-Compress-Level": "fast"}
+    )
+    assert response.status_code == 400
+    assert "X-Compress-Level" in response.json()["message"]
+
+if __name__ == "__main__":
+    # Run tests if this file is executed directly
+    pytest.main(["-xvs", __file__])
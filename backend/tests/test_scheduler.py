@@ -0,0 +1,102 @@
+import pytest
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.admission import AdmissionRejected
+from services.scheduler import ClientLimits, FairScheduler, estimate_cost
+
+UNLIMITED = ClientLimits(rate=1000.0, burst=1000.0)
+
+def test_fair_queuing_order():
+    """Test a newly arrived client starts ahead of another client's backlog"""
+    scheduler = FairScheduler(slots=1, default_limits=UNLIMITED, queue_timeout=5)
+    order = []
+    release_first = threading.Event()
+
+    def run(client, hold=False):
+        with scheduler.schedule(client, 1.0):
+            order.append(client)
+            if hold:
+                release_first.wait(5)
+
+    threads = [threading.Thread(target=run, args=("ip:a", True))]
+    threads[0].start()
+    while scheduler.running == 0:
+        time.sleep(0.01)
+
+    # Client a queues a backlog of three, then client b sends one
+    for client in ("ip:a", "ip:a", "ip:a", "ip:b"):
+        threads.append(threading.Thread(target=run, args=(client,)))
+        threads[-1].start()
+        queued = len(threads) - 1
+        while scheduler.status()["queued"] < queued:
+            time.sleep(0.01)
+
+    release_first.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["ip:a", "ip:a", "ip:b", "ip:a", "ip:a"]
+    assert scheduler.running == 0 and scheduler.status()["queued"] == 0
+
+def test_token_bucket_limits_and_client_keys():
+    """Test per-key token buckets reject, report a retry delay and refill"""
+    now = [0.0]
+    scheduler = FairScheduler(
+        slots=4,
+        default_limits=ClientLimits(rate=1.0, burst=4.0),
+        client_limits={"partner": ClientLimits(rate=10.0, burst=40.0, weight=2.0)},
+        clock=lambda: now[0]
+    )
+
+    # Unlisted keys fall back to the client's address
+    assert scheduler.client_key({"x-client-key": "partner"}, "10.0.0.1") == "key:partner"
+    assert scheduler.client_key({"x-client-key": "made-up"}, "10.0.0.1") == "ip:10.0.0.1"
+
+    cost = estimate_cost(2000, 1000, grid_size=200)
+    assert cost == pytest.approx(2.0 + 200 * 100 / 1e4)
+
+    with scheduler.schedule("ip:10.0.0.1", cost):
+        pass
+    with pytest.raises(AdmissionRejected) as limited:
+        with scheduler.schedule("ip:10.0.0.1", cost):
+            pass
+    assert limited.value.status_code == 429 and limited.value.retry_after == 4
+
+    # The partner key has its own, larger bucket
+    for _ in range(10):
+        with scheduler.schedule("key:partner", cost):
+            pass
+
+    now[0] += 4.0
+    with scheduler.schedule("ip:10.0.0.1", cost):
+        pass
+    assert scheduler.status()["clients"][0] == {"client": "key:part...", "cost": 40.0, "queued": 0, "tokens": 0.0}
+
+def test_rejected_conversion_is_not_charged():
+    """Test a conversion refused for a full queue leaves its client's tokens and finish time unchanged"""
+    now = [0.0]
+    scheduler = FairScheduler(
+        slots=1, default_limits=ClientLimits(rate=1.0, burst=10.0), max_queue=0, clock=lambda: now[0]
+    )
+
+    with scheduler.schedule("ip:a", 3.0):
+        tokens = scheduler._buckets["ip:a"].tokens
+        finish = scheduler._last_finish["ip:a"]
+        for client in ("ip:a", "ip:b"):
+            with pytest.raises(AdmissionRejected) as busy:
+                with scheduler.schedule(client, 4.0):
+                    pass
+            assert busy.value.status_code == 503
+
+        assert scheduler._buckets["ip:a"].tokens == tokens == 7.0
+        assert scheduler._last_finish["ip:a"] == finish
+        assert scheduler._buckets["ip:b"].tokens == 10.0
+        assert "ip:b" not in scheduler._last_finish
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,85 @@
+import pytest
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.single_flight import SingleFlight, SINGLE_FLIGHT_CALLS
+
+def test_concurrent_calls_share_one_computation():
+    """Test overlapping calls for a key compute once and each get their own copy"""
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+    results = [None] * 5
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"blockCount": {"stone": 4}}
+
+    def run(position):
+        results[position] = flights.do("image-hash_params-hash", compute)
+
+    coalesced_before = SINGLE_FLIGHT_CALLS.value(outcome="coalesced")
+    threads = [threading.Thread(target=run, args=(position,)) for position in range(5)]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert all(result == {"blockCount": {"stone": 4}} for result in results)
+    assert len({id(result) for result in results}) == 5
+    assert SINGLE_FLIGHT_CALLS.value(outcome="coalesced") - coalesced_before == 4
+    assert flights.in_flight() == 0
+
+    # Errors reach every waiter, and the key is free again afterwards
+    with pytest.raises(ValueError):
+        flights.do("broken", lambda: (_ for _ in ()).throw(ValueError("bad image")))
+    assert flights.do("broken", lambda: {"ok": True}) == {"ok": True}
+
+def test_other_worker_reuses_stored_result(tmp_path):
+    """Test a worker that finds the key locked waits and reuses the stored result"""
+    # Two groups on one lock directory stand in for two worker processes
+    worker_a, worker_b = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path))
+    store = {}
+    started, release = threading.Event(), threading.Event()
+
+    def compute_a():
+        started.set()
+        release.wait(5)
+        store["result"] = {"id": "a"}
+        return store["result"]
+
+    thread = threading.Thread(target=worker_a.do, args=("key", compute_a))
+    thread.start()
+    started.wait(5)
+
+    outcome = {}
+    def run_b():
+        outcome["result"] = worker_b.do("key", lambda: {"id": "b"}, reuse=lambda: store.get("result"))
+    waiter = threading.Thread(target=run_b)
+    waiter.start()
+    time.sleep(0.1)
+    assert "result" not in outcome
+
+    release.set()
+    thread.join(5)
+    waiter.join(5)
+    assert outcome["result"] == {"id": "a"}
+
+    # Lock files are removed once their flight is over
+    assert list(tmp_path.iterdir()) == []
+    assert worker_a.do("other", lambda: {"id": "c"}) == {"id": "c"}
+    assert list(tmp_path.iterdir()) == []
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
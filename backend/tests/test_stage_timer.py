@@ -0,0 +1,43 @@
+import os
+import sys
+import pytest
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.stage_timer import stage, collect_stage_timings, StageTimings
+
+def test_stage_is_noop_without_collector():
+    """Stages run normally when nobody is collecting"""
+    with stage("match"):
+        value = 1
+    assert value == 1
+
+def test_collect_stage_timings_accumulates():
+    """Repeated stages add up and nested collectors restore the outer one"""
+    with collect_stage_timings() as timings:
+        with stage("match"):
+            pass
+        with stage("match"):
+            pass
+        with collect_stage_timings() as inner:
+            with stage("encode"):
+                pass
+        with stage("render"):
+            pass
+
+    assert set(timings.stages) == {"match", "render"}
+    assert set(inner.stages) == {"encode"}
+    assert timings.total() == pytest.approx(sum(timings.stages.values()))
+
+def test_stage_records_time_on_error():
+    """A failing stage still records its time"""
+    timings = StageTimings()
+    with pytest.raises(ValueError):
+        with collect_stage_timings(timings):
+            with stage("decode"):
+                raise ValueError("bad image")
+    assert "decode" in timings.stages
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,73 @@
+import pytest
+from PIL import Image
+import numpy as np
+import os
+import sys
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.image_processing.texture_atlas import (
+    build_texture_atlas, render_textured_preview, texture_filename
+)
+from app.services.image_processing.processor import process_image_to_minecraft_blocks
+
+def test_texture_filename():
+    """Test block names map to Minecraft texture file names"""
+    assert texture_filename("Oak Planks") == "oak_planks.png"
+    assert texture_filename("stone") == "stone.png"
+
+def test_build_texture_atlas(tmp_path):
+    """Test the atlas loads texture files and falls back to colour tiles"""
+    Image.new('RGB', (16, 16), color=(10, 20, 30)).save(tmp_path / "stone.png")
+    blocks = [("stone", (128, 128, 128)), ("dirt", (134, 96, 67))]
+
+    atlas = build_texture_atlas(blocks, str(tmp_path))
+
+    assert atlas.shape == (2, 16, 16, 3)
+    assert atlas.dtype == np.uint8
+    assert (atlas[0] == [10, 20, 30]).all()
+    # Missing textures use a tile close to the block colour
+    assert np.abs(atlas[1].mean(axis=(0, 1)) - [134, 96, 67]).max() < 4
+
+def test_texture_atlas_npy_cache(tmp_path):
+    """Test the atlas can be saved and memory-mapped back from a .npy file"""
+    blocks = [("stone", (128, 128, 128)), ("dirt", (134, 96, 67))]
+    cache_path = str(tmp_path / "atlas.npy")
+
+    built = build_texture_atlas(blocks, str(tmp_path), cache_path)
+    loaded = build_texture_atlas(blocks, str(tmp_path), cache_path)
+
+    assert isinstance(loaded, np.memmap)
+    assert np.array_equal(built, loaded)
+
+    # A reordered palette of the same length is rebuilt rather than reusing stale textures
+    reordered = build_texture_atlas(blocks[::-1], str(tmp_path), cache_path)
+    assert np.abs(reordered[0].mean(axis=(0, 1)) - [134, 96, 67]).max() < 4
+    assert not isinstance(reordered, np.memmap)
+
+def test_render_textured_preview():
+    """Test each grid cell is drawn with its block's texture"""
+    atlas = np.arange(3 * 16 * 16 * 3, dtype=np.uint32).reshape(3, 16, 16, 3).astype(np.uint8)
+    index_grid = np.array([[0, 2], [1, 0]])
+
+    preview = render_textured_preview(index_grid, atlas)
+
+    assert preview.shape == (32, 32, 3)
+    assert np.array_equal(preview[:16, 16:], atlas[2])
+    assert np.array_equal(preview[16:, :16], atlas[1])
+
+def test_process_image_to_minecraft_blocks(tmp_path):
+    """Test the app processor renders a 16px-per-block preview"""
+    input_path = str(tmp_path / "input.png")
+    output_path = str(tmp_path / "output.png")
+    Image.new('RGB', (40, 20), color=(128, 128, 128)).save(input_path)
+
+    process_image_to_minecraft_blocks(input_path, output_path, grid_size=8)
+
+    with Image.open(output_path) as output:
+        assert output.size == (8 * 16, 4 * 16)
+
+if __name__ == "__main__":
+    # Run tests if this file is executed directly
+    pytest.main(["-xvs", __file__])
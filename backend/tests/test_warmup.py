@@ -0,0 +1,46 @@
+import pytest
+import os
+import sys
+
+# Add parent directory to path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.warmup import WarmUp
+
+def test_warm_up_runs_each_step_once():
+    """Test warm-up records step timings and is idempotent"""
+    warm_up = WarmUp(["sklearn", "palette"])
+    assert warm_up.state == "cold"
+
+    status = warm_up.run()
+    assert status["state"] == "warm"
+    assert set(status["stepsMs"]) == {"sklearn", "palette"}
+    assert warm_up.run()["stepsMs"] == status["stepsMs"]
+
+def test_failed_step_degrades_and_is_retried(monkeypatch):
+    """Test a failing step leaves the warm-up degraded until a later run succeeds"""
+    from services import warmup
+    calls = []
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("not yet")
+    monkeypatch.setitem(warmup.WARMUP_STEPS, "sklearn", flaky)
+    warm_up = WarmUp(["sklearn"])
+
+    status = warm_up.run()
+    assert status["state"] == "degraded"
+    assert status["errors"] == {"sklearn": "not yet"}
+
+    status = warm_up.run()
+    assert status["state"] == "warm"
+    assert status["errors"] == {}
+    assert "sklearn" in status["stepsMs"]
+    assert len(calls) == 2
+
+def test_unknown_step_rejected():
+    with pytest.raises(ValueError):
+        WarmUp(["sklearn", "gpu"])
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -163,10 +163,10 @@ export default function ImagePreview({ processedImage, loading, error }) {
         <a
           href={
             selectedDownload === 'image'
-              ? `data:image/png;base64,${processedImage.imageData}`
+              ? `data:image/${processedImage.imageFormat || 'png'};base64,${processedImage.imageData}`
               : `/api/download-schematic?imageId=${processedImage.id}`
           }
-          download={selectedDownload === 'image' ? "minecraft-art.png" : "minecraft-art.schematic"}
+          download={selectedDownload === 'image' ? `minecraft-art.${processedImage.imageFormat || 'png'}` : "minecraft-art.schem"}
           className="inline-block bg-blue-600 hover:bg-blue-700 text-white px-4 py-2 rounded-md font-medium text-sm transition-colors w-full text-center"
         >
           Download {selectedDownload === 'image' ? 'Image' : 'Schematic File'}
@@ -71,9 +71,12 @@ export default function ImageUploader({ onProcessingStart, onProcessed, onError
       
       // Send the image to the backend
       setProcessingStage("processing");
+      // The API route streams the upload through unparsed, so the grid size
+      // travels as a header rather than a form field
       const response = await axios.post('/api/process-image', formData, {
         headers: {
-          'Content-Type': 'multipart/form-data'
+          'Content-Type': 'multipart/form-data',
+          'X-Grid-Size': size.toString()
         }
       });
       
@@ -20,7 +20,7 @@ export default async function handler(req, res) {
 
     // Set appropriate headers for download
     res.setHeader('Content-Type', 'application/octet-stream');
-    res.setHeader('Content-Disposition', 'attachment; filename=minecraft-art.schematic');
+    res.setHeader('Content-Disposition', 'attachment; filename=minecraft-art.schem');
     
     // Send the schematic file data
     return res.send(Buffer.from(response.data));
@@ -1,157 +1,148 @@
-import { IncomingForm } from 'formidable';
-import axios from 'axios';
-import fs from 'fs';
-import FormData from 'form-data';
+import http from 'http';
+import https from 'https';
 
-// Disable the default body parser to handle form data
+// Stream the request body through untouched and allow large responses
 export const config = {
   api: {
     bodyParser: false,
+    responseLimit: false,
   },
 };
 
-export default async function handler(req, res) {
+const BACKEND_URL = new URL(process.env.BACKEND_URL || 'http://localhost:5000');
+// Longest the backend may stay silent (no response bytes) before giving up
+const BACKEND_TIMEOUT_MS = parseInt(process.env.BACKEND_TIMEOUT_MS || '120000', 10);
+const MAX_UPLOAD_BYTES = 10 * 1024 * 1024; // 10MB limit
+
+// Reuse connections to the backend across requests
+const transport = BACKEND_URL.protocol === 'https:' ? https : http;
+const backendAgent = new transport.Agent({ keepAlive: true, maxSockets: 64 });
+
+// Request headers passed on to the backend (plus every X- header)
+const FORWARDED_REQUEST_HEADERS = ['content-type', 'content-length', 'accept', 'accept-encoding'];
+// Per-connection response headers that must not be copied to the browser
+const HOP_BY_HOP_HEADERS = ['connection', 'keep-alive', 'transfer-encoding', 'upgrade'];
+
+function backendHeaders(req) {
+  const headers = {};
+  for (const [name, value] of Object.entries(req.headers)) {
+    if (FORWARDED_REQUEST_HEADERS.includes(name) || name.startsWith('x-')) {
+      headers[name] = value;
+    }
+  }
+  // The backend rate limits by client address (with SCHEDULER_TRUST_PROXY=1), so it
+  // gets the browser's own address; any X-Forwarded-For the browser sent is dropped
+  headers['x-forwarded-for'] = req.socket.remoteAddress || '';
+  return headers;
+}
+
+function errorMessage(status, body) {
+  // FastAPI errors carry "detail" (a string or a list of validation errors)
+  try {
+    const data = JSON.parse(body);
+    if (data.message) return data.message;
+    if (Array.isArray(data.detail)) return data.detail[0]?.msg || 'Error processing image on server';
+    if (data.detail) return data.detail;
+  } catch (parseError) {
+    // Not JSON, fall through
+  }
+  return status === 413 ? 'Image too large. Maximum size is 10MB.' : 'Error processing image on server';
+}
+
+function sendError(res, status, message) {
+  if (res.headersSent) {
+    res.destroy();
+    return;
+  }
+  res.status(status).json({ message });
+}
+
+export default function handler(req, res) {
   if (req.method !== 'POST') {
     return res.status(405).json({ message: 'Method Not Allowed' });
   }
 
-  let files = {};
-  try {
-    // Parse the form data with newer formidable API
-    const form = new IncomingForm({
-      maxFileSize: 10 * 1024 * 1024, // 10MB limit
-      keepExtensions: true,
-    });
-    
-    // Use the updated formidable promise API
-    const [fields, formFiles] = await new Promise((resolve, reject) => {
-      form.parse(req, (err, fields, files) => {
-        if (err) reject(err);
-        resolve([fields, files]);
-      });
-    });
-    
-    // Store files for cleanup in finally block
-    files = formFiles;
-    
-    console.log("Form files:", files);
-    console.log("Form fields:", fields);
-
-    // Check if an image was uploaded
-    if (!files || !files.image) {
-      return res.status(400).json({ message: 'No image uploaded. Make sure you are sending a file with name "image".' });
-    }
+  if (!(req.headers['content-type'] || '').startsWith('multipart/form-data')) {
+    return res.status(400).json({ message: 'No image uploaded. Make sure you are sending a file with name "image".' });
+  }
+  if (parseInt(req.headers['content-length'] || '0', 10) > MAX_UPLOAD_BYTES) {
+    return res.status(413).json({ message: 'Image too large. Maximum size is 10MB.' });
+  }
 
-    // Fix: Handle the array structure that formidable returns in Next.js
-    const imageFile = Array.isArray(files.image) ? files.image[0] : files.image;
-    
-    console.log("Image file info:", {
-      mimetype: imageFile.mimetype,
-      originalFilename: imageFile.originalFilename,
-      filepath: imageFile.filepath,
-      size: imageFile.size
-    });
-    
-    // Check if we have a valid filepath
-    if (!imageFile.filepath) {
-      return res.status(400).json({ message: 'Invalid file upload - missing file path.' });
-    }
-    
-    // Validate the mime type
-    const validMimeTypes = ['image/jpeg', 'image/png', 'image/gif'];
-    if (!validMimeTypes.includes(imageFile.mimetype)) {
-      return res.status(400).json({ 
-        message: 'Invalid file type. Please upload a JPG, PNG, or GIF image.'
-      });
-    }
+  // ?stream selects the row-by-row block stream (X-Stream-Format picks NDJSON or binary)
+  const path = req.query.stream ? '/process-image/stream' : '/process-image';
+
+  return new Promise((resolve) => {
+    const backendRequest = transport.request(
+      new URL(path, BACKEND_URL),
+      { method: 'POST', agent: backendAgent, headers: backendHeaders(req) },
+      (backendResponse) => {
+        const status = backendResponse.statusCode;
 
-    // Read the image file
-    const imageData = fs.readFileSync(imageFile.filepath);
-    
-    // Get grid size parameter
-    const gridSize = parseInt(fields.gridSize || '50', 10);
-    console.log("Using grid size:", gridSize);
-
-    // Send the image to the backend service
-    try {
-      console.log("Sending request to backend...");
-      
-      // Create a multipart/form-data request that FastAPI expects
-      const formData = new FormData();
-      formData.append('image', imageData, {
-        filename: imageFile.originalFilename || 'image.png',
-        contentType: imageFile.mimetype,
-      });
-      
-      // Send using multipart/form-data format instead of raw binary
-      const backendResponse = await axios.post(
-        'http://localhost:5000/process-image', 
-        formData, 
-        {
-          headers: {
-            ...formData.getHeaders(),
-            'X-Grid-Size': gridSize.toString(),
-          },
-          // Remove timeout limit to allow processing to complete
-          // timeout: 30000, // Removing this 30 second timeout
+        if (status >= 400) {
+          // Error bodies are small: read them to return the usual { message }
+          const chunks = [];
+          backendResponse.on('data', (chunk) => chunks.push(chunk));
+          backendResponse.on('end', () => {
+            sendError(res, status, errorMessage(status, Buffer.concat(chunks).toString('utf8')));
+            resolve();
+          });
+          return;
         }
-      );
 
-      console.log("Backend response received");
-      // Add unique ID to the response
-      const responseData = {
-        ...backendResponse.data,
-        id: Date.now().toString() // Simple ID for referencing the image
-      };
+        // Success: pass the status, headers and body through as they arrive
+        for (const [name, value] of Object.entries(backendResponse.headers)) {
+          if (!HOP_BY_HOP_HEADERS.includes(name)) {
+            res.setHeader(name, value);
+          }
+        }
+        res.status(status);
+        backendResponse.pipe(res);
+        backendResponse.on('end', resolve);
+        backendResponse.on('error', (error) => {
+          console.error('Backend response error:', error);
+          res.destroy(error);
+          resolve();
+        });
+      }
+    );
 
-      return res.status(200).json(responseData);
-    } catch (error) {
+    backendRequest.setTimeout(BACKEND_TIMEOUT_MS, () => {
+      backendRequest.destroy(Object.assign(new Error('Backend timed out'), { code: 'ETIMEDOUT' }));
+    });
+
+    backendRequest.on('error', (error) => {
       console.error('Backend processing error:', error);
-      
-      // Provide appropriate error messages based on the error
-      if (error.response) {
-        console.error('Backend error response:', error.response.data);
-        // The request was made and the server responded with an error status
-        return res.status(error.response.status).json({ 
-          message: error.response.data.detail 
-            ? (Array.isArray(error.response.data.detail) 
-               ? error.response.data.detail[0]?.msg || 'Error processing image on server'
-               : error.response.data.detail) 
-            : 'Error processing image on server' 
-        });
-      } else if (error.code === 'ECONNREFUSED') {
-        return res.status(503).json({ message: 'Backend service unavailable. Please make sure the backend server is running.' });
+      if (error.code === 'ECONNREFUSED') {
+        sendError(res, 503, 'Backend service unavailable. Please make sure the backend server is running.');
       } else if (error.code === 'ETIMEDOUT') {
-        return res.status(504).json({ message: 'Processing timed out. Try a smaller grid size.' });
+        sendError(res, 504, 'Processing timed out. Try a smaller grid size.');
+      } else if (error.code === 'LIMIT_FILE_SIZE') {
+        sendError(res, 413, 'Image too large. Maximum size is 10MB.');
       } else {
-        return res.status(500).json({ message: `Failed to process image: ${error.message}` });
+        sendError(res, 502, `Failed to process image: ${error.message}`);
       }
-    }
-  } catch (error) {
-    console.error('Error in API handler:', error);
-    
-    // Handle formidable errors
-    if (error.code === 'LIMIT_FILE_SIZE') {
-      return res.status(413).json({ message: 'Image too large. Maximum size is 10MB.' });
-    }
-    
-    return res.status(500).json({ message: `Failed to process request: ${error.message}` });
-  } finally {
-    // Fix: Cleanup with proper array handling
-    try {
-      if (files && files.image) {
-        const imageFiles = Array.isArray(files.image) ? files.image : [files.image];
-        
-        for (const file of imageFiles) {
-          if (file && file.filepath) {
-            fs.unlink(file.filepath, (err) => {
-              if (err) console.error('Error removing temp file:', err);
-            });
-          }
-        }
+      resolve();
+    });
+
+    // The browser going away cancels the backend request
+    res.on('close', () => {
+      if (!res.writableFinished) {
+        backendRequest.destroy();
       }
-    } catch (cleanupError) {
-      console.error('Error during file cleanup:', cleanupError);
-    }
-  }
+    });
+
+    // Pipe the multipart upload straight through, enforcing the size limit
+    // for uploads sent without a Content-Length
+    let received = 0;
+    req.on('data', (chunk) => {
+      received += chunk.length;
+      if (received > MAX_UPLOAD_BYTES) {
+        req.unpipe(backendRequest);
+        backendRequest.destroy(Object.assign(new Error('Upload too large'), { code: 'LIMIT_FILE_SIZE' }));
+      }
+    });
+    req.on('error', (error) => backendRequest.destroy(error));
+    req.pipe(backendRequest);
+  });
 }